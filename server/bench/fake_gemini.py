@@ -0,0 +1,271 @@
+"""
+Gemini stand-in for offline benchmarks.
+
+Serves GenerateContent and StreamGenerateContent over gRPC, the transport
+the app's async client uses, with TLS on a throwaway self-signed
+certificate. The app talks to it unchanged once started with
+
+    GEMINI_API_ENDPOINT=127.0.0.1:<port>
+    GRPC_DEFAULT_SSL_ROOTS_FILE_PATH=<certificate path printed at startup>
+
+Replies take a configurable, jittered time and fail at a configurable rate,
+so upstream latency dominates chat requests the way it does in production.
+
+    python -m bench.fake_gemini --port 50051 --latency 0.8 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import json
+import os
+import random
+import signal
+import tempfile
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import grpc
+import google.ai.generativelanguage_v1beta as glm
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+# What the real API fails with under load; the SDK retries UNAVAILABLE itself
+ERROR_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.INTERNAL)
+
+_WORDS = (
+    "please restart the device and sign in again if the problem persists raise a ticket "
+    "with the error message so the service desk can check your account access and network"
+).split()
+
+
+def self_signed_certificate(host: str = "127.0.0.1") -> Tuple[bytes, bytes]:
+    """(private key, certificate) in PEM, valid for host and localhost"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "fake-gemini")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    alt_names = [x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]
+    if host not in ("localhost", "127.0.0.1"):
+        try:
+            alt_names.append(x509.IPAddress(ipaddress.ip_address(host)))
+        except ValueError:
+            alt_names.append(x509.DNSName(host))
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName(alt_names), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    return key_pem, cert.public_bytes(serialization.Encoding.PEM)
+
+
+def _model_name(request: glm.GenerateContentRequest) -> str:
+    return request.model.rpartition("/")[2]
+
+
+def parse_model_overrides(specs: List[str]) -> Dict[str, Tuple[float, float]]:
+    """Parse ["name=latency[:error_rate]", ...]"""
+    overrides = {}
+    for spec in specs:
+        name, _, behaviour = spec.partition("=")
+        latency, _, error_rate = behaviour.partition(":")
+        overrides[name.strip()] = (float(latency), float(error_rate or 0))
+    return overrides
+
+
+def _prompt_text(request: glm.GenerateContentRequest) -> str:
+    return " ".join(part.text for content in request.contents for part in content.parts)
+
+
+class FakeGemini:
+    """
+    gRPC server answering like the Gemini API.
+
+    latency is the mean time to a complete reply in seconds and jitter its
+    standard deviation; streamed replies spread the same time over chunks.
+    A fraction error_rate of calls fails with one of ERROR_CODES after the
+    delay. models overrides (latency, error_rate) per model name, e.g. to
+    make one model slow and watch the app fail over.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.8,
+                 jitter: float = 0.3, error_rate: float = 0.0, reply_words: int = 60,
+                 chunks: int = 6, seed: Optional[int] = None,
+                 models: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.reply_words = reply_words
+        self.chunks = chunks
+        self.models = models or {}
+        self.random = random.Random(seed)
+        self.cert_path: Optional[str] = None
+        self.calls: Dict[str, int] = {}
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._server: Optional[grpc.aio.Server] = None
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def app_env(self) -> dict:
+        """Environment that points the app at this server"""
+        return {"GEMINI_API_ENDPOINT": self.endpoint, "GRPC_DEFAULT_SSL_ROOTS_FILE_PATH": self.cert_path}
+
+    async def start(self, cert_path: Optional[str] = None) -> None:
+        """Start serving; the certificate goes to cert_path or a temporary file"""
+        key_pem, cert_pem = self_signed_certificate(self.host)
+        if cert_path is None:
+            fd, cert_path = tempfile.mkstemp(prefix="fake-gemini-", suffix=".pem")
+            os.close(fd)
+        with open(cert_path, "wb") as f:
+            f.write(cert_pem)
+        self.cert_path = cert_path
+
+        handler = grpc.method_handlers_generic_handler(SERVICE, {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                self.generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize,
+            ),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                self.stream_generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize,
+            ),
+        })
+        self._server = grpc.aio.server()
+        self._server.add_generic_rpc_handlers((handler,))
+        credentials = grpc.ssl_server_credentials([(key_pem, cert_pem)])
+        self.port = self._server.add_secure_port(f"{self.host}:{self.port}", credentials)
+        await self._server.start()
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            await self._server.stop(grace=1)
+            self._server = None
+        if self.cert_path:
+            os.unlink(self.cert_path)
+            self.cert_path = None
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "errors": self.errors, "peak_in_flight": self.peak_in_flight}
+
+    def _behaviour(self, request: glm.GenerateContentRequest) -> Tuple[float, float]:
+        """(delay, error rate) for this call"""
+        latency, error_rate = self.models.get(_model_name(request), (self.latency, self.error_rate))
+        jitter = self.jitter * latency / self.latency if self.latency else self.jitter
+        return max(latency * 0.1, self.random.gauss(latency, jitter)), error_rate
+
+    def _reply(self) -> str:
+        return " ".join(self.random.choice(_WORDS) for _ in range(self.reply_words))
+
+    def _response(self, text: str, prompt_tokens: int, completion_tokens: int,
+                  final: bool) -> glm.GenerateContentResponse:
+        candidate = glm.Candidate(
+            content=glm.Content(role="model", parts=[glm.Part(text=text)]),
+            finish_reason=glm.Candidate.FinishReason.STOP if final else None,
+        )
+        usage = glm.GenerateContentResponse.UsageMetadata(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=completion_tokens,
+            total_token_count=prompt_tokens + completion_tokens,
+        )
+        return glm.GenerateContentResponse(candidates=[candidate], usage_metadata=usage)
+
+    def _enter(self, request: glm.GenerateContentRequest) -> None:
+        model = _model_name(request)
+        self.calls[model] = self.calls.get(model, 0) + 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    async def _maybe_fail(self, context: grpc.aio.ServicerContext, error_rate: float) -> None:
+        if self.random.random() < error_rate:
+            self.errors += 1
+            code = self.random.choice(ERROR_CODES)
+            await context.abort(code, f"fake upstream error ({code.name})")
+
+    async def generate_content(self, request: glm.GenerateContentRequest,
+                               context: grpc.aio.ServicerContext) -> glm.GenerateContentResponse:
+        self._enter(request)
+        delay, error_rate = self._behaviour(request)
+        try:
+            await asyncio.sleep(delay)
+            await self._maybe_fail(context, error_rate)
+            text = self._reply()
+            return self._response(text, len(_prompt_text(request)) // 4, self.reply_words, final=True)
+        finally:
+            self.in_flight -= 1
+
+    async def stream_generate_content(self, request: glm.GenerateContentRequest,
+                                      context: grpc.aio.ServicerContext
+                                      ) -> AsyncIterator[glm.GenerateContentResponse]:
+        self._enter(request)
+        delay, error_rate = self._behaviour(request)
+        try:
+            words = self._reply().split()
+            step = max(1, -(-len(words) // self.chunks))
+            pause = delay / self.chunks
+            prompt_tokens = len(_prompt_text(request)) // 4
+            for start in range(0, len(words), step):
+                await asyncio.sleep(pause)
+                if start == 0:
+                    await self._maybe_fail(context, error_rate)
+                piece = " ".join(words[start:start + step]) + " "
+                final = start + step >= len(words)
+                yield self._response(piece, prompt_tokens, min(start + step, len(words)), final)
+        finally:
+            self.in_flight -= 1
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    fake = FakeGemini(args.host, args.port, args.latency, args.jitter, args.error_rate, seed=args.seed,
+                      models=parse_model_overrides(args.model))
+    await fake.start(args.cert_file)
+    print(f"Fake Gemini listening on {fake.endpoint}; start the app with:")
+    for name, value in fake.app_env().items():
+        print(f"  export {name}={value}", flush=True)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    try:
+        await stopping.wait()
+    finally:
+        await fake.stop()
+        # Last line of output, read by bench.run
+        print(json.dumps(fake.stats()), flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Gemini stand-in for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--latency", type=float, default=0.8, help="Mean reply time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Standard deviation of the reply time")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that fail")
+    parser.add_argument("--cert-file", help="Where to write the certificate; default is a temporary file")
+    parser.add_argument("--model", action="append", default=[], metavar="NAME=LATENCY[:ERROR_RATE]",
+                        help="Per-model behaviour, e.g. gemini-2.5-flash-lite=5:0.2")
+    parser.add_argument("--seed", type=int, default=None)
+    asyncio.run(_serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
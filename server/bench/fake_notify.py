@@ -0,0 +1,160 @@
+"""
+SMTP server and SMS gateway stand-ins for running notifications offline.
+
+Accepts mail on the SMTP port and SMS batches as JSON on the HTTP port, and
+prints every message it receives as one JSON line. The app sends to it
+unchanged with the default NOTIFY_SMTP_URL and NOTIFY_SMS_URL, or with
+
+    NOTIFY_SMTP_URL=smtp://127.0.0.1:<smtp port>
+    NOTIFY_SMS_URL=http://127.0.0.1:<sms port>/messages
+
+Messages fail at a configurable rate, so retries and dead-lettering can be
+exercised too.
+
+    python -m bench.fake_notify --smtp-port 1025 --sms-port 1026 --error-rate 0.1
+"""
+import argparse
+import asyncio
+import json
+import random
+import signal
+import sys
+from email import message_from_bytes, policy
+from typing import Optional, TextIO
+
+
+class Recorder:
+    """Writes received messages as JSON lines and decides which ones fail"""
+
+    def __init__(self, out: TextIO, error_rate: float):
+        self.out = out
+        self.error_rate = error_rate
+
+    def accept(self) -> bool:
+        return random.random() >= self.error_rate
+
+    def record(self, channel: str, **fields) -> None:
+        self.out.write(json.dumps({"channel": channel, **fields}) + "\n")
+        self.out.flush()
+
+
+async def handle_smtp(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, recorder: Recorder) -> None:
+    """Just enough SMTP for smtplib: EHLO, MAIL, RCPT, DATA, RSET, NOOP and QUIT"""
+    async def reply(line: str) -> None:
+        writer.write(f"{line}\r\n".encode())
+        await writer.drain()
+
+    await reply("220 fake-notify ESMTP ready")
+    sender: Optional[str] = None
+    recipients = []
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                await reply("250 fake-notify")
+            elif verb == "MAIL":
+                sender, recipients = command.partition(":")[2].strip(" <>"), []
+                await reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.partition(":")[2].strip(" <>"))
+                await reply("250 OK")
+            elif verb == "DATA":
+                await reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data = await reader.readline()
+                    if data in (b".\r\n", b".\n", b""):
+                        break
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                message = message_from_bytes(b"".join(lines), policy=policy.default)
+                if recorder.accept():
+                    recorder.record("email", sender=sender, to=recipients, subject=message["Subject"],
+                                    body=message.get_content().strip())
+                    await reply("250 OK: queued")
+                else:
+                    await reply("451 Requested action aborted: local error in processing")
+                sender, recipients = None, []
+            elif verb == "RSET":
+                sender, recipients = None, []
+                await reply("250 OK")
+            elif verb == "NOOP":
+                await reply("250 OK")
+            elif verb == "QUIT":
+                await reply("221 Bye")
+                break
+            else:
+                await reply("502 Command not implemented")
+    finally:
+        writer.close()
+
+
+async def handle_sms(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, recorder: Recorder) -> None:
+    """One POST per connection carrying {"messages": [{"to", "body"}, ...]}"""
+    try:
+        request_line = await reader.readline()
+        length = 0
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value.strip())
+        if not request_line.startswith(b"POST"):
+            status, body = "405 Method Not Allowed", {"error": "POST a JSON batch of messages"}
+        else:
+            messages = json.loads(await reader.readexactly(length) or b"{}").get("messages", [])
+            results = []
+            for message in messages:
+                if recorder.accept():
+                    recorder.record("sms", to=message.get("to"), body=message.get("body"))
+                    results.append({"error": None})
+                else:
+                    results.append({"error": "carrier rejected the message"})
+            status, body = "200 OK", {"results": results}
+        payload = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(host: str, smtp_port: int, sms_port: int, recorder: Recorder) -> None:
+    smtp = await asyncio.start_server(lambda r, w: handle_smtp(r, w, recorder), host, smtp_port)
+    sms = await asyncio.start_server(lambda r, w: handle_sms(r, w, recorder), host, sms_port)
+    print(f"fake notify: smtp://{host}:{smtp_port} http://{host}:{sms_port}/messages", file=sys.stderr, flush=True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    async with smtp, sms:
+        await stop.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--smtp-port", type=int, default=1025)
+    parser.add_argument("--sms-port", type=int, default=1026)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of messages rejected")
+    parser.add_argument("--out", help="Append received messages to this file instead of stdout")
+    args = parser.parse_args()
+
+    out = open(args.out, "a") if args.out else sys.stdout
+    try:
+        asyncio.run(serve(args.host, args.smtp_port, args.sms_port, Recorder(out, args.error_rate)))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""
+Open-loop load test for the API, runnable offline.
+
+By default it starts the fake Gemini server in its own process, launches
+the app under uvicorn with the SQLite database backend in a temporary
+directory, seeds it with tickets through the bulk endpoint and a user whose
+locally minted token signs the chat requests, and then fires
+requests at a fixed Poisson arrival rate for the given duration. Arrivals do not wait for
+earlier responses, and latency is measured from each request's scheduled
+start, so a slow server shows up as queueing delay rather than as a lower
+offered load. Pass --target to run the same load against a server that is
+already running, with --token for its chat endpoint.
+
+    python -m bench.run --rate 200 --duration 60 --mix chat=30,create=15,list=25,search=15,stats=15
+
+Reports requests, errors, throughput and p50/p95/p99 latency per scenario,
+plus the peak number of requests in flight. --max-p99-ms and
+--max-error-rate make the exit status non-zero on a regression, as does any
+chat rejected with a 401, and --json
+saves the report for comparison between runs.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from jose import jwt
+
+from bench.scenarios import DEFAULT_MIX, TICKET_PATH, Scenarios, parse_mix, ticket_payload
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_TIMEOUT_SECONDS = 30
+SEED_CHUNK = 500
+# The local app verifies chat users' tokens against this secret
+BENCH_JWT_SECRET = "bench-jwt-secret"
+BENCH_USER = {"id": "00000000-0000-4000-8000-00000000be9c", "email": "bench@example.com",
+              "name": "Bench User", "username": "bench"}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """Latencies and outcomes per scenario"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.skipped = 0
+
+    def started(self) -> None:
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def finished(self, name: str, seconds: float, error: Optional[str]) -> None:
+        self.in_flight -= 1
+        self.latencies.setdefault(name, []).append(seconds * 1000)
+        if error is not None:
+            errors = self.errors.setdefault(name, {})
+            errors[error] = errors.get(error, 0) + 1
+
+    def report(self, elapsed: float) -> dict:
+        rows = {}
+        for name in sorted(self.latencies):
+            values = sorted(self.latencies[name])
+            errors = sum(self.errors.get(name, {}).values())
+            rows[name] = {
+                "requests": len(values),
+                "errors": errors,
+                "error_kinds": self.errors.get(name, {}),
+                "throughput_rps": round((len(values) - errors) / elapsed, 2),
+                "p50_ms": round(percentile(values, 50), 1),
+                "p95_ms": round(percentile(values, 95), 1),
+                "p99_ms": round(percentile(values, 99), 1),
+                "max_ms": round(values[-1], 1),
+            }
+        everything = sorted(v for values in self.latencies.values() for v in values)
+        total_errors = sum(row["errors"] for row in rows.values())
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "requests": len(everything),
+            "errors": total_errors,
+            "error_rate": round(total_errors / len(everything), 4) if everything else 0.0,
+            "skipped": self.skipped,
+            "throughput_rps": round((len(everything) - total_errors) / elapsed, 2),
+            "p50_ms": round(percentile(everything, 50), 1),
+            "p95_ms": round(percentile(everything, 95), 1),
+            "p99_ms": round(percentile(everything, 99), 1),
+            "peak_in_flight": self.peak_in_flight,
+            "scenarios": rows,
+        }
+
+
+async def _fire(recorder: Recorder, scenarios: Scenarios, name: str,
+                client: httpx.AsyncClient, scheduled: float) -> None:
+    error = None
+    try:
+        error = scenarios.error(await scenarios.get(name)(client))
+    except httpx.TimeoutException:
+        error = "timeout"
+    except Exception as e:
+        error = type(e).__name__
+    recorder.finished(name, time.perf_counter() - scheduled, error)
+
+
+async def open_loop(client: httpx.AsyncClient, scenarios: Scenarios, mix: Dict[str, float],
+                    rate: float, duration: float, max_in_flight: int,
+                    rng: random.Random) -> dict:
+    """Issue requests with exponential inter-arrival times for duration seconds"""
+    recorder = Recorder()
+    names, weights = list(mix), list(mix.values())
+    tasks = set()
+    start = time.perf_counter()
+    scheduled = start
+    while True:
+        scheduled += rng.expovariate(rate)
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if recorder.in_flight >= max_in_flight:
+            # The generator's own limit, not the server's: count it and move on
+            recorder.skipped += 1
+            continue
+        name = rng.choices(names, weights)[0]
+        recorder.started()
+        task = asyncio.create_task(_fire(recorder, scenarios, name, client, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return recorder.report(time.perf_counter() - start)
+
+
+async def seed_tickets(client: httpx.AsyncClient, count: int, rng: random.Random) -> int:
+    """Create count tickets through the bulk endpoint so reads have data"""
+    created = 0
+    for offset in range(0, count, SEED_CHUNK):
+        items = [ticket_payload(rng, -(offset + i + 1)) for i in range(min(SEED_CHUNK, count - offset))]
+        response = await client.post(f"{TICKET_PATH}/bulk", json=items)
+        response.raise_for_status()
+        created += response.json()["created"]
+    return created
+
+
+async def seed_user(sqlite_path: str) -> None:
+    """Give the bench user a profile in the local app's database"""
+    from local_database import LocalDatabase
+    db = LocalDatabase(sqlite_path)
+    try:
+        if not await db.get_profile(BENCH_USER["id"]):
+            await db.create_profile(BENCH_USER)
+    finally:
+        db.close()
+
+
+def mint_token(secret: str, lifetime: float) -> str:
+    """An HS256 access token for the bench user, shaped like Supabase's"""
+    now = int(time.time())
+    return jwt.encode({"sub": BENCH_USER["id"], "email": BENCH_USER["email"], "aud": "authenticated",
+                       "role": "authenticated", "iat": now, "exp": now + int(lifetime)},
+                      secret, algorithm="HS256")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_fake_gemini(workdir: str, port: int, args: argparse.Namespace) -> Tuple[subprocess.Popen, Dict[str, str]]:
+    """Run bench.fake_gemini in its own process so it never competes with the load generator"""
+    cert_path = os.path.join(workdir, "fake-gemini.pem")
+    command = [sys.executable, "-m", "bench.fake_gemini", "--port", str(port), "--cert-file", cert_path,
+               "--latency", str(args.llm_latency), "--jitter", str(args.llm_jitter),
+               "--error-rate", str(args.llm_error_rate)]
+    for spec in args.llm_model:
+        command += ["--model", spec]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    process = subprocess.Popen(command, cwd=SERVER_DIR, stdout=subprocess.PIPE, text=True)
+    # The first line is printed once the server is listening
+    if not process.stdout.readline():
+        raise RuntimeError("Fake Gemini did not start")
+    return process, {"GEMINI_API_ENDPOINT": f"127.0.0.1:{port}", "GRPC_DEFAULT_SSL_ROOTS_FILE_PATH": cert_path}
+
+
+def _stop(process: Optional[subprocess.Popen]) -> str:
+    """Terminate process and return what it printed since it started"""
+    if process is None:
+        return ""
+    process.terminate()
+    try:
+        output, _ = process.communicate(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        output, _ = process.communicate()
+    return output or ""
+
+
+async def _wait_until_up(url: str, process: subprocess.Popen, log_path: str) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    async with httpx.AsyncClient(timeout=1) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"App exited with {process.returncode}; see {log_path}")
+            try:
+                if (await client.get(f"{url}/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"App did not start within {STARTUP_TIMEOUT_SECONDS}s; see {log_path}")
+
+
+def _start_app(workdir: str, port: int, workers: int, env: Dict[str, str]) -> subprocess.Popen:
+    app_env = dict(os.environ)
+    app_env.update({
+        "DATABASE_BACKEND": "sqlite",
+        "DATA_DIR": workdir,
+        "SQLITE_PATH": os.path.join(workdir, "bench.sqlite3"),
+        "SESSION_BACKEND": "memory",
+        "SUPABASE_JWT_SECRET": BENCH_JWT_SECRET,
+        "GEMINI_API_KEY": "bench",
+        "SUPABASE_URL": app_env.get("SUPABASE_URL", "http://localhost"),
+        "SUPABASE_KEY": app_env.get("SUPABASE_KEY", "bench"),
+        "LOG_LEVEL": "WARNING",
+    })
+    app_env.update(env)
+    log = open(os.path.join(workdir, "app.log"), "wb")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--no-access-log", "--log-level", "warning"],
+        cwd=SERVER_DIR, env=app_env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def print_report(report: dict) -> None:
+    header = f"{'scenario':<10}{'requests':>10}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, row in report["scenarios"].items():
+        print(f"{name:<10}{row['requests']:>10}{row['errors']:>8}{row['throughput_rps']:>9}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{row['max_ms']:>10}")
+        if row["error_kinds"]:
+            print(f"{'':<10}errors: {row['error_kinds']}")
+    print("-" * len(header))
+    print(f"{'all':<10}{report['requests']:>10}{report['errors']:>8}{report['throughput_rps']:>9}"
+          f"{report['p50_ms']:>10}{report['p95_ms']:>10}{report['p99_ms']:>10}")
+    print(f"\nElapsed {report['elapsed_s']}s, peak {report['peak_in_flight']} requests in flight, "
+          f"{report['skipped']} arrivals skipped by the generator")
+    if "fake_gemini" in report:
+        print(f"Fake Gemini: {report['fake_gemini']}")
+
+
+async def run(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    fake, app, workdir = None, None, None
+    url = args.target
+    token = args.token
+    report = {}
+    try:
+        if url is None:
+            workdir = tempfile.mkdtemp(prefix="sahayak-bench-")
+            fake, fake_env = _start_fake_gemini(workdir, _free_port(), args)
+            port = _free_port()
+            extra_env = dict(item.split("=", 1) for item in args.env)
+            app = _start_app(workdir, port, args.workers, {**fake_env, **extra_env})
+            url = f"http://127.0.0.1:{port}"
+            await _wait_until_up(url, app, os.path.join(workdir, "app.log"))
+            await seed_user(os.path.join(workdir, "bench.sqlite3"))
+            token = mint_token(BENCH_JWT_SECRET, args.duration + args.timeout + 600)
+
+        limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+        async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+            if args.seed_tickets:
+                print(f"Seeding {await seed_tickets(client, args.seed_tickets, rng)} tickets")
+            print(f"Running {args.mix} at {args.rate}/s for {args.duration}s against {url}\n")
+            report = await open_loop(client, Scenarios(rng, token=token), mix, args.rate, args.duration,
+                                     args.max_in_flight, rng)
+    finally:
+        _stop(app)
+        fake_output = _stop(fake).strip().splitlines()
+        if fake_output:
+            report["fake_gemini"] = json.loads(fake_output[-1])
+        if workdir is not None and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report["config"] = {k: v for k, v in vars(args).items() if k != "json"}
+    print_report(report)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Open-loop load test with local stand-ins")
+    parser.add_argument("--target", help="Base URL of a running server; default starts one locally")
+    parser.add_argument("--rate", type=float, default=100, help="Arrivals per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Scenario weights")
+    parser.add_argument("--seed-tickets", type=int, default=1000, help="Tickets created before the run")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the local app")
+    parser.add_argument("--max-in-flight", type=int, default=2000, help="Generator-side cap on open requests")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Fake Gemini mean reply time")
+    parser.add_argument("--llm-jitter", type=float, default=0.3)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-model", action="append", default=[], metavar="NAME=LATENCY[:ERROR_RATE]",
+                        help="Fake Gemini behaviour for one model, e.g. to watch the app fail over")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the local app, e.g. LLM_MAX_CONCURRENCY=64")
+    parser.add_argument("--token", help="Bearer token for chat requests against --target; minted locally otherwise")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for a repeatable request sequence")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary database and app log")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--max-p99-ms", type=float, help="Exit non-zero if overall p99 is above this")
+    parser.add_argument("--max-error-rate", type=float, help="Exit non-zero if the error rate is above this")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.max_p99_ms is not None and report["p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 {report['p99_ms']}ms > {args.max_p99_ms}ms")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {report['error_rate']} > {args.max_error_rate}")
+    rejected = report["scenarios"].get("chat", {}).get("error_kinds", {}).get("401", 0)
+    if rejected:
+        # Every chat was turned away before reaching the model, so the run measured nothing
+        failures.append(f"{rejected} chat requests were rejected as unauthenticated")
+    if failures:
+        print("FAILED: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
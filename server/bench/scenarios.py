@@ -0,0 +1,140 @@
+import random
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from models import TicketCategory, TicketPriority, TicketSource
+
+TICKET_PATH = "/api/v1/ticket"
+CHAT_PATH = "/api/chat/"
+
+DEFAULT_MIX = "chat=30,create=15,list=25,search=15,stats=15"
+
+# The chat router answers upstream failures with a 200 and a reply starting with this
+GEMINI_ERROR_PREFIX = "Error contacting Gemini API"
+
+TITLES = {
+    TicketCategory.PASSWORD_RESET: ["Cannot reset my password", "Password expired and reset link fails"],
+    TicketCategory.VPN_ACCESS: ["VPN disconnects every few minutes", "Need VPN access for remote work"],
+    TicketCategory.HARDWARE: ["Laptop will not power on", "Docking station monitor flickers"],
+    TicketCategory.SOFTWARE: ["Excel crashes when opening reports", "Need a licence for the design suite"],
+    TicketCategory.NETWORK: ["Office wifi keeps dropping", "Shared drive is very slow"],
+    TicketCategory.EMAIL_ISSUES: ["Outlook not syncing new mail", "Mailbox is full and rejecting mail"],
+    TicketCategory.ACCESS_RIGHTS: ["Need access to the finance share", "Request admin rights for build tools"],
+    TicketCategory.OTHER: ["Question about the asset handover", "Desk phone needs to be moved"],
+}
+
+DETAILS = [
+    "It started after this morning's update and happens on every attempt.",
+    "Several people on my team see the same error since yesterday.",
+    "I have already restarted twice and the problem is still there.",
+    "This is blocking month-end work, please take a look soon.",
+]
+
+CHAT_MESSAGES = [
+    # Answered by the local classifier or a knowledge-base article without calling the model
+    "I forgot my password and need to reset it",
+    "How do I get VPN access from home?",
+    "My laptop battery drains within an hour, what should I check?",
+    # Sent to the model
+    "Outlook keeps asking for my credentials, how do I fix it?",
+    "Which form do I use to request a second monitor?",
+    "The shared drive is slow for everyone on floor three, is there an outage?",
+]
+
+SEARCH_KEYWORDS = ["password", "vpn", "laptop", "outlook", "wifi", "access", "excel", "monitor"]
+
+TICKET_STATUSES = ["open", "in_progress", "resolved"]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse "chat=30,create=15,..." into scenario weights"""
+    weights = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("Scenario mix needs at least one positive weight")
+    return weights
+
+
+def ticket_payload(rng: random.Random, index: int) -> dict:
+    """A valid TicketCreate body"""
+    category = rng.choice(list(TicketCategory))
+    return {
+        "title": f"{rng.choice(TITLES[category])} #{index}",
+        "description": rng.choice(DETAILS),
+        "category": category.value,
+        "priority": rng.choice(list(TicketPriority)).value,
+        "source": rng.choice([TicketSource.CHATBOT, TicketSource.EMAIL, TicketSource.MANUAL]).value,
+        "requester_email": f"user{index % 500}@example.com",
+        "requester_name": f"Bench User {index % 500}",
+        "department": rng.choice(["Finance", "Sales", "Engineering", None]),
+        "tags": rng.sample(["bench", "remote", "urgent", "vip"], k=rng.randint(0, 2)),
+    }
+
+
+class Scenarios:
+    """
+    The request each scenario name stands for.
+
+    Chats continue an earlier session some of the time and carry a random
+    detail otherwise, so the prompt cache sees a realistic mix of repeats
+    and new questions. The chat router needs a signed-in user, so chats carry
+    token as a bearer token.
+    """
+
+    def __init__(self, rng: random.Random, session_reuse: float = 0.3, token: Optional[str] = None):
+        self.rng = rng
+        self.session_reuse = session_reuse
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self._sessions: List[str] = []
+        self._created = 0
+
+    async def chat(self, client: httpx.AsyncClient) -> httpx.Response:
+        message = self.rng.choice(CHAT_MESSAGES)
+        if self.rng.random() < 0.5:
+            message += f" (asset LT-{self.rng.randint(1000, 9999)})"
+        session_id: Optional[str] = None
+        if self._sessions and self.rng.random() < self.session_reuse:
+            session_id = self.rng.choice(self._sessions)
+        response = await client.post(CHAT_PATH, json={"message": message, "session_id": session_id},
+                                     headers=self.headers)
+        if response.status_code == 200 and session_id is None and len(self._sessions) < 1000:
+            self._sessions.append(response.json()["session_id"])
+        return response
+
+    async def create(self, client: httpx.AsyncClient) -> httpx.Response:
+        self._created += 1
+        return await client.post(f"{TICKET_PATH}/", json=ticket_payload(self.rng, self._created))
+
+    async def list(self, client: httpx.AsyncClient) -> httpx.Response:
+        params = {"page_size": 20}
+        if self.rng.random() < 0.5:
+            params["status"] = self.rng.choice(TICKET_STATUSES)
+        return await client.get(f"{TICKET_PATH}/", params=params)
+
+    async def search(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get(f"{TICKET_PATH}/search/{self.rng.choice(SEARCH_KEYWORDS)}",
+                                params={"page_size": 20})
+
+    async def stats(self, client: httpx.AsyncClient) -> httpx.Response:
+        return await client.get(f"{TICKET_PATH}/stats/summary")
+
+    @staticmethod
+    def error(response: httpx.Response) -> Optional[str]:
+        """Why response counts as a failure, or None"""
+        if response.status_code >= 400:
+            return str(response.status_code)
+        if response.request.url.path == CHAT_PATH and response.json()["reply"].startswith(GEMINI_ERROR_PREFIX):
+            return "llm_error"
+        return None
+
+    def get(self, name: str) -> Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]:
+        return getattr(self, name)
+
+
+SCENARIOS = ("chat", "create", "list", "search", "stats")
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import math
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from metrics import CACHE_REQUESTS
+
+PROMPT_CACHE_BACKEND = os.getenv("PROMPT_CACHE_BACKEND", "memory")
+PROMPT_CACHE_TTL_SECONDS = float(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "5000"))
+# Cosine similarity needed for a near-duplicate hit, e.g. 0.97; 0 (default)
+# disables the semantic tier
+PROMPT_CACHE_SIMILARITY = float(os.getenv("PROMPT_CACHE_SIMILARITY", "0"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+_WHITESPACE = re.compile(r"\s+")
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Words a near-duplicate may add, drop or repeat; everything else must match
+_STOPWORDS = frozenset(
+    "a an and are as at be can could do does for from have how i in is it me my of on or please "
+    "should so the this to was what when where which why will with would you your".split()
+)
+
+
+class LRUCache:
+    """
+    Size-bounded LRU mapping with a per-entry TTL.
+
+    Not thread-safe; meant to be used from the event loop.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at and expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else 0.0
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Snapshot of live (key, value) pairs, oldest first"""
+        now = time.monotonic()
+        return [(key, value) for key, (expires_at, value) in self._data.items()
+                if not expires_at or expires_at >= now]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return entry[1] if entry else default
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return _WHITESPACE.sub(" ", text.strip().lower()).rstrip(" ?!.")
+
+
+def make_key(message: str, model: str, system_prompt: str = "") -> str:
+    """Cache key for a prompt, scoped to the model and system prompt"""
+    payload = "\x1f".join([model, system_prompt, normalize_prompt(message)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def content_words(text: str) -> List[str]:
+    """Sorted distinct non-stopword tokens of text"""
+    return sorted(set(_TOKEN.findall(text.lower())) - _STOPWORDS)
+
+
+def hashed_embedding(text: str, dim: int = 1024) -> Dict[int, float]:
+    """
+    Cheap bag-of-words embedding using the hashing trick.
+
+    Returns a sparse L2-normalised vector as {bucket: weight}.
+    """
+    vector: Dict[int, float] = {}
+    for token in _TOKEN.findall(text.lower()):
+        bucket = zlib.crc32(token.encode("utf-8")) % dim
+        vector[bucket] = vector.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(w * w for w in vector.values()))
+    if norm:
+        for bucket in vector:
+            vector[bucket] /= norm
+    return vector
+
+
+def cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b.get(bucket, 0.0) for bucket, w in a.items())
+
+
+class InMemoryBackend:
+    """Per-process backend; hits are not shared between workers"""
+
+    def __init__(self, max_entries: int = PROMPT_CACHE_MAX_ENTRIES):
+        self._cache = LRUCache(max_entries=max_entries)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        self._cache.set(key, value, ttl=ttl)
+
+    async def delete(self, key: str) -> None:
+        self._cache.pop(key)
+
+
+class RedisBackend:
+    """
+    Redis-compatible backend so every worker shares the same hits.
+
+    Size is bounded by the server's maxmemory/allkeys-lru policy.
+    """
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = "sahay:prompt:"):
+        import redis.asyncio as redis  # optional dependency
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(self.prefix + key)
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        await self._redis.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(self.prefix + key)
+
+
+class SimilarityIndex:
+    """
+    Near-duplicate lookups for the prompt cache.
+
+    A prompt only matches an earlier one with exactly the same content
+    words, so "reset my VPN password" never matches "reset my email
+    password"; the cosine of the two hashed bag-of-words vectors must then
+    reach threshold. Entries are stored in the cache's own backend under
+    their content words, so a lookup is one get and every worker sharing
+    the backend sees the same entries.
+    """
+
+    def __init__(self, backend, threshold: float, ttl: float,
+                 embed: Callable[[str], Dict[int, float]] = hashed_embedding):
+        self.backend = backend
+        self.threshold = threshold
+        self.ttl = ttl
+        self.embed = embed
+
+    @staticmethod
+    def _key(namespace: str, message: str) -> str:
+        payload = "\x1f".join([namespace, " ".join(content_words(message))])
+        return "similar:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def add(self, namespace: str, message: str, key: str) -> None:
+        entry = json.dumps([normalize_prompt(message), key])
+        await self.backend.set(self._key(namespace, message), entry, self.ttl)
+
+    async def lookup(self, namespace: str, message: str) -> Optional[str]:
+        entry = await self.backend.get(self._key(namespace, message))
+        if entry is None:
+            return None
+        indexed, key = json.loads(entry)
+        if cosine(self.embed(normalize_prompt(message)), self.embed(indexed)) < self.threshold:
+            return None
+        return key
+
+
+class ResponseCache:
+    """
+    Prompt -> response cache in front of the LLM.
+
+    Exact matches are looked up by normalised prompt; when enabled, a
+    similarity tier catches a recently answered question asked with other
+    filler words.
+    """
+
+    def __init__(self, backend=None, ttl: float = PROMPT_CACHE_TTL_SECONDS,
+                 similarity_threshold: float = PROMPT_CACHE_SIMILARITY):
+        self.backend = backend or InMemoryBackend()
+        self.ttl = ttl
+        self.similarity = (SimilarityIndex(self.backend, similarity_threshold, ttl)
+                           if similarity_threshold > 0 else None)
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    async def get(self, message: str, model: str, system_prompt: str = "") -> Optional[str]:
+        value = await self.backend.get(make_key(message, model, system_prompt))
+        result = "hit"
+        if value is None and self.similarity is not None:
+            similar_key = await self.similarity.lookup(_namespace(model, system_prompt), message)
+            if similar_key is not None:
+                value = await self.backend.get(similar_key)
+                if value is not None:
+                    self.semantic_hits += 1
+                    result = "semantic_hit"
+        if value is None:
+            self.misses += 1
+            result = "miss"
+        else:
+            self.hits += 1
+        CACHE_REQUESTS.labels("prompt", result).inc()
+        return value
+
+    async def set(self, message: str, model: str, response: str, system_prompt: str = "") -> None:
+        key = make_key(message, model, system_prompt)
+        await self.backend.set(key, response, self.ttl)
+        if self.similarity is not None:
+            await self.similarity.add(_namespace(model, system_prompt), message, key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _namespace(model: str, system_prompt: str) -> str:
+    return json.dumps([model, system_prompt])
+
+
+def build_response_cache() -> Optional[ResponseCache]:
+    """Build the cache configured by PROMPT_CACHE_BACKEND (memory, redis or off)"""
+    if PROMPT_CACHE_BACKEND == "off":
+        return None
+    if PROMPT_CACHE_BACKEND == "redis":
+        return ResponseCache(backend=RedisBackend())
+    return ResponseCache()
@@ -0,0 +1,277 @@
+import json
+import math
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cache import LRUCache
+from models import IntentClassification, TicketCategory
+from search import tokenize
+
+# Below this the chatbot escalates to the LLM and tickets keep their category
+CLASSIFIER_CONFIDENCE_THRESHOLD = float(os.getenv("CLASSIFIER_CONFIDENCE_THRESHOLD", "0.6"))
+# Optional JSONL of {"text": ..., "category": ...} examples added to the seed set
+CLASSIFIER_TRAINING_PATH = os.getenv("CLASSIFIER_TRAINING_PATH")
+CLASSIFIER_MAX_FEATURES = int(os.getenv("CLASSIFIER_MAX_FEATURES", "50000"))
+# Tickets learned from whose label is remembered, so recategorising one replaces it
+CLASSIFIER_LEARNED_MAX_ENTRIES = int(os.getenv("CLASSIFIER_LEARNED_MAX_ENTRIES", "100000"))
+# Additive smoothing for unseen (feature, category) pairs
+SMOOTHING = 0.1
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could do does for from has have hi hello how i im i'm in is it
+its me my no not of on or our please so that the this to was we what when where which with you your
+""".split())
+
+# Labelled examples the model starts from; extended by learn() and the training file
+SEED_EXAMPLES: Dict[TicketCategory, List[str]] = {
+    TicketCategory.PASSWORD_RESET: [
+        "I forgot my password",
+        "reset my password please",
+        "password expired cannot login",
+        "my account is locked after wrong password attempts",
+        "unlock my account",
+        "need to change my windows password",
+        "forgot SAP password",
+        "login password not working",
+        "password reset link not received",
+        "locked out of my account",
+    ],
+    TicketCategory.VPN_ACCESS: [
+        "VPN is not connecting",
+        "cannot connect to vpn from home",
+        "vpn keeps disconnecting",
+        "need vpn access for remote work",
+        "forticlient vpn error",
+        "remote access not working from home",
+        "vpn authentication failed",
+        "how do I set up the vpn client",
+        "vpn connected but cannot reach intranet",
+        "request vpn account",
+    ],
+    TicketCategory.HARDWARE: [
+        "my laptop is not turning on",
+        "printer is not printing",
+        "monitor screen is flickering",
+        "keyboard keys not working",
+        "mouse not responding",
+        "laptop battery drains fast",
+        "need a new laptop",
+        "desktop makes loud noise and overheats",
+        "printer paper jam",
+        "docking station not detecting monitor",
+    ],
+    TicketCategory.SOFTWARE: [
+        "need to install software",
+        "excel keeps crashing",
+        "application error when opening SAP",
+        "install microsoft office",
+        "software license expired",
+        "update antivirus",
+        "program not responding after update",
+        "need adobe acrobat installed",
+        "teams app crashes on startup",
+        "browser shows error installing plugin",
+    ],
+    TicketCategory.NETWORK: [
+        "internet is very slow",
+        "no internet connection in office",
+        "wifi not working",
+        "cannot connect to wifi network",
+        "network drive not accessible",
+        "lan cable connected but no network",
+        "website not loading in office network",
+        "wifi keeps dropping",
+        "ethernet port not working",
+        "shared folder on network unreachable",
+    ],
+    TicketCategory.EMAIL_ISSUES: [
+        "outlook not receiving emails",
+        "cannot send email",
+        "mailbox is full",
+        "email stuck in outbox",
+        "outlook keeps asking for password",
+        "not getting emails from external senders",
+        "email attachments not opening",
+        "set up email on my phone",
+        "distribution list email not delivered",
+        "outlook calendar not syncing",
+    ],
+    TicketCategory.ACCESS_RIGHTS: [
+        "need access to shared folder",
+        "request permission to database",
+        "grant me access to the portal",
+        "access denied to application",
+        "need admin rights on my laptop",
+        "add me to the project group",
+        "request access to SAP module",
+        "permission denied opening file",
+        "need read write access to drive",
+        "role access for new joiner",
+    ],
+    TicketCategory.OTHER: [
+        "general query",
+        "I have a question",
+        "need some information about policy",
+        "who do I contact for help",
+        "feedback about the service",
+        "office facility request",
+    ],
+}
+
+def ticket_text(ticket: dict) -> str:
+    return f"{ticket.get('title') or ''}\n{ticket.get('description') or ''}"
+
+def features(text: str) -> List[str]:
+    """Unigrams and bigrams of the non-stopword tokens in text"""
+    tokens = [token for token in tokenize(text) if token not in STOPWORDS]
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+class IntentClassifier:
+    """
+    Multinomial naive Bayes over unigram and bigram counts, CPU-only.
+
+    Maps free text to a TicketCategory with the posterior probability as its
+    confidence. Trains in milliseconds from SEED_EXAMPLES and keeps learning
+    from tickets an agent has categorised via learn_ticket(). Log-probabilities are computed
+    from the raw counts at lookup time, so learning from a ticket costs no
+    more than classifying it.
+    """
+
+    def __init__(self, threshold: float = CLASSIFIER_CONFIDENCE_THRESHOLD,
+                 max_features: int = CLASSIFIER_MAX_FEATURES):
+        self.threshold = threshold
+        self.max_features = max_features
+        self._categories = list(TicketCategory)
+        self._doc_counts = {category: 0 for category in self._categories}
+        self._feature_counts: Dict[TicketCategory, Dict[str, int]] = {c: {} for c in self._categories}
+        self._totals = {category: 0 for category in self._categories}
+        self._vocabulary: set = set()
+        self._model: Optional[Tuple[Dict, Dict]] = None
+        # ticket id -> (text, category) it was learned with
+        self._learned = LRUCache(max_entries=CLASSIFIER_LEARNED_MAX_ENTRIES)
+
+    def fit(self, examples: Iterable[Tuple[str, TicketCategory]]) -> "IntentClassifier":
+        for text, category in examples:
+            self.learn(text, category)
+        return self
+
+    def learn(self, text: str, category: TicketCategory) -> None:
+        category = TicketCategory(category)
+        counts = self._feature_counts[category]
+        for feature in features(text):
+            if feature not in self._vocabulary:
+                if len(self._vocabulary) >= self.max_features:
+                    continue
+                self._vocabulary.add(feature)
+            counts[feature] = counts.get(feature, 0) + 1
+            self._totals[category] += 1
+        self._doc_counts[category] += 1
+        self._model = None
+
+    def unlearn(self, text: str, category: TicketCategory) -> None:
+        """Undo an earlier learn(text, category)"""
+        category = TicketCategory(category)
+        counts = self._feature_counts[category]
+        for feature in features(text):
+            # Features dropped by learn() for a full vocabulary were never counted
+            if counts.get(feature, 0) > 0:
+                counts[feature] -= 1
+                self._totals[category] -= 1
+        self._doc_counts[category] = max(0, self._doc_counts[category] - 1)
+        self._model = None
+
+    def _compile(self) -> Tuple[Dict, Dict]:
+        # Only the per-category terms are precomputed, so learn() stays cheap
+        if self._model is None:
+            documents = sum(self._doc_counts.values())
+            size = len(self._vocabulary) or 1
+            priors, denominators = {}, {}
+            for category in self._categories:
+                priors[category] = math.log((self._doc_counts[category] + 1) / (documents + len(self._categories)))
+                denominators[category] = math.log(self._totals[category] + SMOOTHING * size)
+            self._model = (priors, denominators)
+        return self._model
+
+    def classify(self, text: str) -> IntentClassification:
+        return self.classify_batch([text])[0]
+
+    def classify_batch(self, texts: List[str]) -> List[IntentClassification]:
+        priors, denominators = self._compile()
+        results = []
+        for text in texts:
+            known = [feature for feature in features(text) if feature in self._vocabulary]
+            if not known:
+                # Nothing we have seen before: no basis for a guess
+                results.append(IntentClassification(category=TicketCategory.OTHER, confidence=0.0,
+                                                     confident=False))
+                continue
+            scores = {}
+            for category in self._categories:
+                counts, denominator = self._feature_counts[category], denominators[category]
+                scores[category] = priors[category] + sum(
+                    math.log(counts.get(feature, 0) + SMOOTHING) for feature in known
+                ) - denominator * len(known)
+            # Naive Bayes is overconfident on long texts; temper by feature count
+            temperature = math.sqrt(len(known))
+            top = max(scores.values())
+            weights = {c: math.exp((s - top) / temperature) for c, s in scores.items()}
+            total = sum(weights.values())
+            probabilities = {c.value: round(w / total, 4) for c, w in weights.items()}
+            best = max(scores, key=scores.get)
+            confidence = probabilities[best.value]
+            results.append(IntentClassification(
+                category=best, confidence=confidence,
+                confident=best != TicketCategory.OTHER and confidence >= self.threshold,
+                scores=probabilities,
+            ))
+        return results
+
+    def label_tickets(self, rows: List[dict]) -> None:
+        """
+        Set ai_classification_confidence on ticket rows about to be inserted.
+
+        Confidence is the model's probability for the category the ticket ends
+        up with. A ticket filed as OTHER takes the predicted category when the
+        model is confident. Nothing is learned here: the category a requester
+        picks is unchecked, so only learn_ticket() trains the model.
+        """
+        texts = [ticket_text(row) for row in rows]
+        for row, result in zip(rows, self.classify_batch(texts)):
+            category = TicketCategory(row.get('category') or TicketCategory.OTHER)
+            if category == TicketCategory.OTHER and result.confident:
+                category = row['category'] = result.category
+            row['ai_classification_confidence'] = result.scores.get(category.value, 0.0)
+
+    def learn_ticket(self, ticket: dict) -> None:
+        """
+        Learn from a ticket whose category an agent has just changed.
+
+        Each ticket counts once: learning it again with the same category is a
+        no-op, and a new category replaces the one it was learned with.
+        """
+        category = TicketCategory(ticket.get('category') or TicketCategory.OTHER)
+        ticket_id = str(ticket['id'])
+        learned = self._learned.get(ticket_id)
+        if learned is not None:
+            if learned[1] == category:
+                return
+            self.unlearn(*learned)
+            self._learned.pop(ticket_id)
+        if category != TicketCategory.OTHER:
+            text = ticket_text(ticket)
+            self.learn(text, category)
+            self._learned.set(ticket_id, (text, category))
+
+def _training_examples() -> Iterable[Tuple[str, TicketCategory]]:
+    for category, texts in SEED_EXAMPLES.items():
+        for text in texts:
+            yield text, category
+    if CLASSIFIER_TRAINING_PATH and os.path.exists(CLASSIFIER_TRAINING_PATH):
+        with open(CLASSIFIER_TRAINING_PATH) as f:
+            for line in f:
+                if line.strip():
+                    example = json.loads(line)
+                    yield example["text"], TicketCategory(example["category"])
+
+# Shared by the ticket and chat routers
+classifier = IntentClassifier().fit(_training_examples())
@@ -1,120 +1,435 @@
 from supabase import create_client
+import asyncio
+import contextvars
+import logging
 import os
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+import stats
+from metrics import instrument_methods
+from search import TicketSearchIndex, to_prefix_tsquery, tokenize
+from storage import data_path
 
+logger = logging.getLogger(__name__)
+
+# "postgres" uses the search_ticket_ids RPC; "local" uses an index built in each
+# worker from the whole table, for single-process setups
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "postgres")
+# "supabase" or "sqlite" (local stand-in for development and tests)
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "supabase")
+SQLITE_PATH = os.getenv("SQLITE_PATH") or data_path("sahayak.sqlite3")
+# Upper bound on concurrent database round-trips per worker
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))
+DB_QUERY_TIMEOUT_SECONDS = float(os.getenv("DB_QUERY_TIMEOUT_SECONDS", "10"))
+
+class DatabaseTimeout(Exception):
+    """Raised when a query does not complete within the per-query timeout"""
+
+@instrument_methods(exclude=("run",))
 class Database:
-    def __init__(self):
+    """
+    Async data-access layer shared by every router through get_db().
+
+    The supabase client is synchronous, so each round-trip runs on a bounded
+    thread pool: the event loop never blocks, at most pool_size queries are
+    in flight per worker and each one is subject to query_timeout.
+    """
+
+    def __init__(self, client=None, auth_client=None, pool_size: int = DB_POOL_SIZE,
+                 query_timeout: float = DB_QUERY_TIMEOUT_SECONDS):
         supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_KEY")
-        self.client = create_client(supabase_url, supabase_key)
-    
+        supabase_key = os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_ANON_KEY")
+        anon_key = os.getenv("SUPABASE_ANON_KEY") or supabase_key
+        self.client = client or create_client(supabase_url, supabase_key)
+        # Auth calls use the anon key, as the auth router always did
+        self.auth_client = auth_client or create_client(supabase_url, anon_key)
+        self._init_pool(pool_size, query_timeout)
+
+    def _init_pool(self, pool_size: int, query_timeout: float) -> None:
+        self.pool_size = pool_size
+        self.query_timeout = query_timeout
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db")
+        self._search_index: Optional[TicketSearchIndex] = None
+
+    @property
+    def auth(self):
+        return self.auth_client.auth
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """Run a blocking client call on the pool, bounded by the query timeout"""
+        loop = asyncio.get_running_loop()
+        # Carry the request id (and other context) into the pool thread
+        context = contextvars.copy_context()
+        future = loop.run_in_executor(self._executor, lambda: context.run(fn, *args))
+        try:
+            return await asyncio.wait_for(future, timeout=timeout or self.query_timeout)
+        except asyncio.TimeoutError:
+            raise DatabaseTimeout(f"Query exceeded {timeout or self.query_timeout:.0f}s")
+
+    async def _execute(self, query):
+        """Execute a PostgREST query builder off the event loop"""
+        return await self.run(query.execute)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _columns(columns: Optional[Sequence[str]]) -> str:
+        """PostgREST select list; None selects every column"""
+        return ','.join(columns) if columns else '*'
+
     async def create_ticket(self, ticket_data: dict) -> dict:
         """Create a new ticket in the database"""
         try:
-            result = self.client.table('tickets').insert(ticket_data).execute()
-            return result.data[0] if result.data else None
+            result = await self._execute(self.client.table('tickets').insert(ticket_data))
+            created = result.data[0] if result.data else None
+            if created and self._search_index is not None:
+                self._search_index.add(created)
+            return created
         except Exception as e:
-            print(f"Error creating ticket: {e}")
+            logger.error("Error creating ticket: %s", e)
             return None
-    
-    async def get_ticket(self, ticket_id: str) -> Optional[dict]:
-        """Retrieve a ticket by ID"""
+
+    async def create_tickets(self, rows: List[dict]) -> List[dict]:
+        """
+        Insert many tickets with one multi-row write.
+
+        Rows whose idempotency_key already exists are skipped rather than
+        failing the batch; only the rows actually inserted are returned.
+        Raises on failure so the caller can report it per item.
+        """
+        if not rows:
+            return []
+        result = await self._execute(
+            self.client.table('tickets').upsert(rows, on_conflict='idempotency_key', ignore_duplicates=True)
+        )
+        if self._search_index is not None:
+            for created in result.data:
+                self._search_index.add(created)
+        return result.data
+
+    async def get_tickets_by_idempotency_keys(self, keys: List[str],
+                                              columns: Optional[Sequence[str]] = None) -> List[dict]:
+        """Look up previously ingested tickets by idempotency key"""
+        if not keys:
+            return []
+        result = await self._execute(
+            self.client.table('tickets').select(self._columns(columns)).in_('idempotency_key', keys)
+        )
+        return result.data
+
+    async def reserve_ticket_numbers(self, day: str, count: int) -> int:
+        """Reserve count ticket numbers for day (YYMMDD) and return the first"""
+        result = await self._execute(self.client.rpc('reserve_ticket_numbers', {
+            'sequence_day': day,
+            'block_size': count,
+        }))
+        return int(result.data)
+
+    async def get_ticket(self, ticket_id: str, columns: Optional[Sequence[str]] = None,
+                         raise_errors: bool = False) -> Optional[dict]:
+        """Retrieve a ticket by ID; errors read as a missing ticket unless raise_errors"""
         try:
-            result = self.client.table('tickets').select('*').eq('id', ticket_id).execute()
+            result = await self._execute(
+                self.client.table('tickets').select(self._columns(columns)).eq('id', ticket_id)
+            )
             return result.data[0] if result.data else None
         except Exception as e:
-            print(f"Error fetching ticket: {e}")
+            if raise_errors:
+                raise
+            logger.error("Error fetching ticket: %s", e)
             return None
-    
-    async def get_ticket_by_number(self, ticket_number: str) -> Optional[dict]:
+
+    async def get_ticket_by_number(self, ticket_number: str,
+                                   columns: Optional[Sequence[str]] = None) -> Optional[dict]:
         """Retrieve a ticket by ticket number"""
         try:
-            result = self.client.table('tickets').select('*').eq('ticket_number', ticket_number).execute()
-            return result.data[0] if result.data else None
-        except Exception as e:
-            print(f"Error fetching ticket: {e}")
-            return None
-    
-    async def update_ticket(self, ticket_id: str, update_data: dict) -> Optional[dict]:
-        """Update a ticket"""
-        try:
-            update_data['updated_at'] = 'now()'
-            result = self.client.table('tickets').update(update_data).eq('id', ticket_id).execute()
+            result = await self._execute(
+                self.client.table('tickets').select(self._columns(columns)).eq('ticket_number', ticket_number)
+            )
             return result.data[0] if result.data else None
         except Exception as e:
-            print(f"Error updating ticket: {e}")
+            logger.error("Error fetching ticket: %s", e)
             return None
-    
-    async def get_tickets(self, filters: dict = None, page: int = 1, page_size: int = 50) -> list:
+
+    async def update_ticket(self, ticket_id: str, update_data: dict,
+                            only_if_null: Optional[str] = None) -> Optional[dict]:
+        """
+        Update a ticket in one round-trip; None when no ticket has this id, or
+        when only_if_null names a column that is already set
+        """
+        update_data['updated_at'] = 'now()'
+        query = self.client.table('tickets').update(update_data).eq('id', ticket_id)
+        if only_if_null:
+            query = query.is_(only_if_null, 'null')
+        result = await self._execute(query)
+        updated = result.data[0] if result.data else None
+        if updated and self._search_index is not None:
+            self._search_index.add(updated)
+        return updated
+
+    def _paginate(self, query, page: int, page_size: int, after: Optional[Tuple[str, str]] = None):
+        """
+        Order newest first and select one page.
+
+        With after=(created_at, id) this is a keyset page that seeks past the
+        last row the client saw, so cost does not grow with depth and rows
+        inserted meanwhile cannot shift the window. Otherwise falls back to
+        offset pagination.
+        """
+        if after:
+            created_at, ticket_id = after
+            query = query.or_(
+                f'created_at.lt."{created_at}",'
+                f'and(created_at.eq."{created_at}",id.lt."{ticket_id}")'
+            )
+            query = query.limit(page_size)
+        else:
+            start = (page - 1) * page_size
+            end = start + page_size - 1
+            query = query.range(start, end)
+
+        # id breaks ties between tickets created in the same instant
+        return query.order('created_at', desc=True).order('id', desc=True)
+
+    async def get_tickets(self, filters: dict = None, page: int = 1, page_size: int = 50,
+                          after: Optional[Tuple[str, str]] = None,
+                          columns: Optional[Sequence[str]] = None) -> list:
         """Retrieve tickets with optional filtering and pagination"""
         try:
-            query = self.client.table('tickets').select('*')
-            
+            query = self.client.table('tickets').select(self._columns(columns))
+
             # Apply filters
             if filters:
                 for key, value in filters.items():
                     if value is not None:
                         query = query.eq(key, value)
-            
-            # Apply pagination
-            start = (page - 1) * page_size
-            end = start + page_size - 1
-            query = query.range(start, end)
-            
-            # Order by creation date (newest first)
-            query = query.order('created_at', desc=True)
-            
-            result = query.execute()
+
+            result = await self._execute(self._paginate(query, page, page_size, after))
             return result.data
         except Exception as e:
-            print(f"Error fetching tickets: {e}")
+            logger.error("Error fetching tickets: %s", e)
             return []
-    
+
+    async def get_ticket_counts(self) -> dict:
+        """Count tickets per status, priority and category in one round-trip"""
+        counts = {'status': {}, 'priority': {}, 'category': {}}
+        try:
+            rows = (await self._execute(self.client.rpc('ticket_statistics'))).data
+            for row in rows:
+                for dimension in counts:
+                    if row.get(dimension) is not None:
+                        counts[dimension][row[dimension]] = row['ticket_count']
+        except DatabaseTimeout:
+            raise
+        except Exception as e:
+            # Migration not applied yet: fetch only the grouped columns and count here
+            logger.warning("ticket_statistics RPC unavailable, counting client-side: %s", e)
+            rows = await self._fetch_all('status,priority,category')
+            for row in rows:
+                for dimension in counts:
+                    value = row.get(dimension)
+                    counts[dimension][value] = counts[dimension].get(value, 0) + 1
+        return counts
+
     async def get_ticket_statistics(self) -> dict:
         """Get ticket statistics for dashboard"""
         try:
-            # This would typically be a database view or stored procedure
-            # For now, we'll simulate with multiple queries
-            total = self.client.table('tickets').select('*', count='exact').execute()
-            open_tickets = self.client.table('tickets').select('*', count='exact').eq('status', 'open').execute()
-            in_progress = self.client.table('tickets').select('*', count='exact').eq('status', 'in_progress').execute()
-            high_priority = self.client.table('tickets').select('*', count='exact').eq('priority', 'high').execute()
-            critical = self.client.table('tickets').select('*', count='exact').eq('priority', 'critical').execute()
-            
-            return {
-                'total_tickets': total.count or 0,
-                'open_tickets': open_tickets.count or 0,
-                'in_progress_tickets': in_progress.count or 0,
-                'high_priority_tickets': high_priority.count or 0,
-                'critical_tickets': critical.count or 0
-            }
+            return stats.summarize(await self.get_ticket_counts())
         except Exception as e:
-            print(f"Error fetching statistics: {e}")
+            logger.error("Error fetching statistics: %s", e)
             return {}
 
-    async def delete_ticket(self, ticket_id: str) -> bool:
-        """Delete a ticket by ID"""
-        try:
-            result = self.client.table('tickets').delete().eq('id', ticket_id).execute()
-            return len(result.data) > 0
-        except Exception as e:
-            print(f"Error deleting ticket: {e}")
-            return False
+    async def delete_ticket(self, ticket_id: str) -> Optional[dict]:
+        """Delete a ticket in one round-trip and return it; None when no ticket has this id"""
+        result = await self._execute(self.client.table('tickets').delete().eq('id', ticket_id))
+        if self._search_index is not None:
+            self._search_index.remove(ticket_id)
+        return result.data[0] if result.data else None
+
+    async def _fetch_all(self, columns: str, batch_size: int = 1000) -> list:
+        """Read every ticket in batches, since PostgREST caps rows per request"""
+        rows, start = [], 0
+        while True:
+            batch = (await self._execute(
+                self.client.table('tickets').select(columns).order('id').range(start, start + batch_size - 1)
+            )).data
+            rows.extend(batch)
+            if len(batch) < batch_size:
+                return rows
+            start += batch_size
+
+    async def _local_search_index(self) -> TicketSearchIndex:
+        """Build the in-process search index on first use"""
+        if self._search_index is None:
+            index = TicketSearchIndex()
+            for row in await self._fetch_all('id,title,description,status,priority'):
+                index.add(row)
+            self._search_index = index
+        return self._search_index
+
+    async def _search_ids(self, keyword: str, filters: dict, page: int, page_size: int,
+                          after: Optional[Tuple[float, str]]) -> List[Tuple[str, float]]:
+        """Ranked (id, rank) pairs for one page of search results"""
+        offset = 0 if after else (page - 1) * page_size
+        if SEARCH_BACKEND != 'local':
+            try:
+                result = await self._execute(self.client.rpc('search_ticket_ids', {
+                    'search_query': keyword,
+                    'prefix_query': to_prefix_tsquery(keyword),
+                    'filter_status': filters.get('status'),
+                    'filter_priority': filters.get('priority'),
+                    'result_limit': page_size,
+                    'result_offset': offset,
+                    'after_rank': after[0] if after else None,
+                    'after_id': after[1] if after else None,
+                }))
+                return [(row['id'], row['rank']) for row in result.data]
+            except DatabaseTimeout:
+                raise
+            except Exception as e:
+                logger.warning("search_ticket_ids RPC unavailable, using ilike: %s", e)
+                return await self._ilike_search_ids(keyword, filters, page_size, offset, after)
+        index = await self._local_search_index()
+        return index.search(keyword, filters, limit=page_size, offset=offset, after=after)
+
+    async def _ilike_search_ids(self, keyword: str, filters: dict, limit: int, offset: int,
+                                after: Optional[Tuple[float, str]]) -> List[Tuple[str, float]]:
+        """
+        One bounded page of unranked matches, highest id first, for when the
+        search RPC is unavailable. Every word must appear in the title or
+        description; all rows rank 0 so (rank, id) cursors still page by id.
+        """
+        # Tokens are word characters only, so safe inside the filter; the
+        # single-member or() wraps the and() PostgREST has no builder for
+        words = [f"or(title.ilike.*{token}*,description.ilike.*{token}*)" for token in tokenize(keyword)]
+        query = self.client.table('tickets').select('id').or_(f"and({','.join(words)})")
+        if filters.get('status'):
+            query = query.eq('status', filters['status'])
+        if filters.get('priority'):
+            query = query.eq('priority', filters['priority'])
+        if after:
+            query = query.lt('id', after[1])
+        result = await self._execute(query.order('id', desc=True).range(offset, offset + limit - 1))
+        return [(row['id'], 0.0) for row in result.data]
+
+    async def _get_tickets_by_ids(self, ticket_ids: List[str], columns: Optional[Sequence[str]]) -> list:
+        result = await self._execute(
+            self.client.table('tickets').select(self._columns(columns)).in_('id', ticket_ids)
+        )
+        return result.data
+
+    async def search_tickets(self, keyword: str, page: int = 1, page_size: int = 50,
+                             after: Optional[Tuple[float, str]] = None,
+                             columns: Optional[Sequence[str]] = None,
+                             filters: Optional[dict] = None) -> list:
+        """
+        Full-text search over title and description, best matches first.
 
-    async def search_tickets(self, keyword: str, page: int = 1, page_size: int = 50) -> list:
-        """Search tickets by keyword in title or description"""
+        Every word is prefix-matched. Rows carry a search_rank; pass the last
+        (search_rank, id) back as after for keyset paging.
+        """
         try:
-            start = (page - 1) * page_size
-            end = start + page_size - 1
-            
-            result = self.client.table('tickets')\
-                .select('*')\
-                .or_(f"title.ilike.%{keyword}%,description.ilike.%{keyword}%")\
-                .range(start, end)\
-                .order('created_at', desc=True)\
-                .execute()
-            
-            return result.data
+            if not to_prefix_tsquery(keyword):
+                return []
+            ranked = await self._search_ids(keyword, filters or {}, page, page_size, after)
+            if not ranked:
+                return []
+
+            found = await self._get_tickets_by_ids([ticket_id for ticket_id, _ in ranked], columns)
+            rows = {str(row['id']): row for row in found}
+
+            tickets = []
+            for ticket_id, rank in ranked:
+                row = rows.get(str(ticket_id))
+                if row is not None:
+                    tickets.append({**row, 'search_rank': rank})
+            return tickets
         except Exception as e:
-            print(f"Error searching tickets: {e}")
+            logger.error("Error searching tickets: %s", e)
             return []
+
+    async def get_profile(self, user_id: str) -> Optional[dict]:
+        """Retrieve a user's row from public.profiles"""
+        result = await self._execute(self.client.table('profiles').select('*').eq('id', user_id))
+        return result.data[0] if result.data else None
+
+    async def create_profile(self, profile_data: dict) -> Optional[dict]:
+        """Insert a user's row into public.profiles"""
+        result = await self._execute(self.client.table('profiles').insert(profile_data))
+        return result.data[0] if result.data else None
+
+    async def revoke_token(self, token_id: str, expires_at: float) -> None:
+        """Reject a token in every worker until expires_at (epoch seconds); drops lapsed entries"""
+        now = datetime.now(timezone.utc).isoformat()
+        await self._execute(self.client.table('revoked_tokens').upsert({
+            'token_id': token_id,
+            'expires_at': datetime.fromtimestamp(expires_at, timezone.utc).isoformat(),
+        }))
+        await self._execute(self.client.table('revoked_tokens').delete().lt('expires_at', now))
+
+    async def is_token_revoked(self, token_id: str) -> bool:
+        result = await self._execute(
+            self.client.table('revoked_tokens').select('token_id').eq('token_id', token_id)
+            .gt('expires_at', datetime.now(timezone.utc).isoformat()).limit(1)
+        )
+        return bool(result.data)
+
+    async def claim_outbox_events(self, limit: int, lease_seconds: float, min_age_seconds: float) -> List[dict]:
+        """
+        Lease up to limit pending notification events that have waited at
+        least min_age_seconds, oldest first; see migration 008.
+        """
+        result = await self._execute(self.client.rpc('claim_notification_events', {
+            'batch_size': limit,
+            'lease_seconds': lease_seconds,
+            'min_age_seconds': min_age_seconds,
+        }))
+        return result.data
+
+    async def complete_outbox_events(self, ids: List[int]) -> None:
+        """Remove events whose notifications went out"""
+        await self._execute(self.client.table('notification_outbox').delete().in_('id', ids))
+
+    async def fail_outbox_events(self, ids: List[int], error: str, backoff_seconds: float,
+                                 max_attempts: int) -> int:
+        """Schedule events for another attempt, or dead-letter them; returns how many were dead-lettered"""
+        result = await self._execute(self.client.rpc('fail_notification_events', {
+            'event_ids': ids,
+            'error': error,
+            'backoff_seconds': backoff_seconds,
+            'max_attempts': max_attempts,
+        }))
+        return int(result.data or 0)
+
+    async def get_outbox_events(self, status: str = 'dead', limit: int = 100) -> List[dict]:
+        """Outbox events in status, newest first"""
+        result = await self._execute(
+            self.client.table('notification_outbox').select('*').eq('status', status)
+            .order('id', desc=True).limit(limit)
+        )
+        return result.data
+
+    async def requeue_outbox_events(self, ids: Optional[List[int]] = None) -> int:
+        """Give dead-lettered events (all of them when ids is None) a fresh set of attempts"""
+        query = self.client.table('notification_outbox').update({
+            'status': 'pending', 'attempts': 0, 'available_at': 'now()', 'locked_until': None,
+        }).eq('status', 'dead')
+        if ids is not None:
+            query = query.in_('id', ids)
+        result = await self._execute(query)
+        return len(result.data)
+
+_db: Optional[Database] = None
+
+def get_db() -> Database:
+    """FastAPI dependency returning the worker's shared Database"""
+    global _db
+    if _db is None:
+        if DATABASE_BACKEND == "sqlite":
+            from local_database import LocalDatabase
+            _db = LocalDatabase(SQLITE_PATH)
+        else:
+            _db = Database()
+    return _db
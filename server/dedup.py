@@ -0,0 +1,175 @@
+import logging
+import os
+import time
+import zlib
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+
+from classifier import STOPWORDS, ticket_text
+from metrics import TICKET_DUPLICATES
+from search import tokenize
+
+logger = logging.getLogger(__name__)
+
+# How far back a new ticket is compared; older tickets drop out of the index
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "7200"))
+# Estimated Jaccard similarity of title + description at which a ticket joins an incident
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.5"))
+# Upper bound on indexed tickets, however busy the window
+DEDUP_MAX_TICKETS = int(os.getenv("DEDUP_MAX_TICKETS", "50000"))
+DEDUP = os.getenv("DEDUP", "on") != "off"
+
+# 32 bands of 2 hashes: a pair at similarity 0.5 shares a band 99.99% of the time, at 0.3 95%
+BANDS = 32
+ROWS = 2
+# Newest tickets kept per band bucket, so an incident storm cannot make a lookup scan all of it
+BUCKET_SIZE = 8
+SEED = 2718
+WARM_PAGE_SIZE = 500
+WARM_COLUMNS = ["id", "ticket_number", "title", "description", "status", "created_at", "parent_ticket_number"]
+# Incidents in these states collect no more duplicates
+FINISHED_STATUSES = ("resolved", "closed")
+
+
+def shingles(text: str) -> List[str]:
+    """
+    Words of text without stopwords or numbers. Reports of one outage share
+    their words more than their word order, and differ in times and asset tags.
+    """
+    return [token for token in tokenize(text) if token not in STOPWORDS and not any(ch.isdigit() for ch in token)]
+
+def _timestamp(value) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+class DuplicateDetector:
+    """
+    Links near-identical tickets to the first ticket of their incident.
+
+    Each ticket is reduced to a MinHash signature of BANDS * ROWS hashes over
+    the words of its title and description; the fraction of equal hashes
+    estimates the Jaccard similarity of two tickets. Signatures are indexed
+    by LSH band, so a new ticket is only compared with the few recent ones
+    sharing at least one band, at most BANDS * BUCKET_SIZE of them, and a
+    lookup costs the same with 10 or 50,000 tickets in the window.
+
+    The index lives in memory and covers the last `window` seconds; warm()
+    refills it from the database on startup. A duplicate points at the root
+    ticket of its incident, never at another duplicate, and a resolved
+    incident stops collecting new tickets.
+    """
+
+    def __init__(self, window: float = DEDUP_WINDOW_SECONDS, threshold: float = DEDUP_THRESHOLD,
+                 max_tickets: int = DEDUP_MAX_TICKETS):
+        self.window = window
+        self.threshold = threshold
+        self.max_tickets = max_tickets
+        rng = np.random.default_rng(SEED)
+        # Multiply-shift hashing: (a * x + b) mod 2**64, top 32 bits, with a odd
+        self._a = rng.integers(0, 1 << 63, size=(BANDS * ROWS, 1), dtype=np.uint64) * 2 + 1
+        self._b = rng.integers(0, 1 << 63, size=(BANDS * ROWS, 1), dtype=np.uint64)
+        # ticket number -> (added at, signature, root ticket number), oldest first
+        self._tickets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._buckets: Dict[bytes, Deque[str]] = {}
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in set(shingles(text))), dtype=np.uint64)
+        if not len(hashes):
+            return None
+        return ((self._a * hashes + self._b) >> 32).min(axis=1)
+
+    @staticmethod
+    def _keys(signature: np.ndarray) -> List[bytes]:
+        return [bytes([band]) + signature[band * ROWS:(band + 1) * ROWS].tobytes() for band in range(BANDS)]
+
+    def _expire(self, now: float) -> None:
+        while self._tickets:
+            number, (added, _, _) = next(iter(self._tickets.items()))
+            if added >= now - self.window and len(self._tickets) <= self.max_tickets:
+                break
+            self.discard(number)
+
+    def _add(self, number: str, signature: np.ndarray, root: str, added: float) -> None:
+        self._tickets[number] = (added, signature, root)
+        for key in self._keys(signature):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = deque(maxlen=BUCKET_SIZE)
+            bucket.append(number)
+
+    def match(self, signature: np.ndarray) -> Optional[str]:
+        """Root ticket number of the most similar indexed ticket at or over the threshold"""
+        candidates = {number for key in self._keys(signature) for number in self._buckets.get(key, ())}
+        candidates = [number for number in candidates if number in self._tickets]
+        if not candidates:
+            return None
+        others = np.stack([self._tickets[number][1] for number in candidates])
+        similarity = (others == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.threshold:
+            return None
+        return self._tickets[candidates[best]][2]
+
+    def link(self, row: dict, now: Optional[float] = None) -> Optional[str]:
+        """
+        Set parent_ticket_number on a ticket row about to be inserted, when it
+        duplicates a recent one, and index the row. Returns the parent's number.
+        """
+        number = row.get('ticket_number')
+        signature = self.signature(ticket_text(row))
+        if not number or signature is None:
+            return None
+        now = time.time() if now is None else now
+        self._expire(now)
+        parent = self.match(signature)
+        if parent:
+            row['parent_ticket_number'] = parent
+            TICKET_DUPLICATES.labels().inc()
+        self._add(number, signature, parent or number, now)
+        return parent
+
+    def discard(self, ticket_number: str) -> None:
+        """Drop a ticket from the index, e.g. one whose insert failed"""
+        entry = self._tickets.pop(ticket_number, None)
+        if entry is None:
+            return
+        for key in self._keys(entry[1]):
+            bucket = self._buckets.get(key)
+            if bucket is not None and ticket_number in bucket:
+                bucket.remove(ticket_number)
+                if not bucket:
+                    del self._buckets[key]
+
+    def resolve(self, ticket_number: str) -> None:
+        """Stop linking new tickets to the incident rooted at ticket_number"""
+        for number in [n for n, entry in self._tickets.items() if entry[2] == ticket_number]:
+            self.discard(number)
+
+    async def warm(self, db) -> None:
+        """Index the tickets created within the window, so a restart keeps linking to them"""
+        since = time.time() - self.window
+        rows, after = [], None
+        try:
+            while len(rows) < self.max_tickets:
+                page = await db.get_tickets(page_size=WARM_PAGE_SIZE, after=after, columns=WARM_COLUMNS)
+                recent = [row for row in page if _timestamp(row['created_at']) >= since]
+                rows.extend(recent)
+                if len(recent) < WARM_PAGE_SIZE:
+                    break
+                after = (page[-1]['created_at'], page[-1]['id'])
+        except Exception as e:
+            logger.warning("dedup.warm_failed", extra={"error": str(e)})
+        finished = {row['ticket_number'] for row in rows if row.get('status') in FINISHED_STATUSES}
+        for row in reversed(rows):
+            root = row.get('parent_ticket_number') or row.get('ticket_number')
+            signature = self.signature(ticket_text(row))
+            if signature is not None and root and root not in finished:
+                self._add(row['ticket_number'], signature, root, _timestamp(row['created_at']))
+        logger.info("dedup.warmed", extra={"tickets": len(self._tickets)})
+
+# Shared by the ticket router and startup
+duplicates = DuplicateDetector() if DEDUP else None
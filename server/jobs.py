@@ -0,0 +1,347 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from cache import LRUCache
+from logs import request_id_var
+from metrics import JOB_LATENCY, JOB_QUEUE_DEPTH, JOB_RUNS, REGISTRY
+from models import TicketPriority, WorkflowJob, WorkflowStatus
+from storage import connect, data_path
+
+JOB_BROKER = os.getenv("JOB_BROKER", "memory")
+JOB_BROKER_PATH = os.getenv("JOB_BROKER_PATH") or data_path("jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "10000"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "1"))
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "60"))
+# A claimed job whose worker has not finished it within this long is run again
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", str(2 * JOB_TIMEOUT_SECONDS)))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+BROKER_POLL_SECONDS = 0.2
+
+# Lower rank is drained first
+PRIORITY_RANK = {
+    TicketPriority.CRITICAL: 0,
+    TicketPriority.HIGH: 1,
+    TicketPriority.MEDIUM: 2,
+    TicketPriority.LOW: 3,
+}
+
+TERMINAL_STATUSES = (WorkflowStatus.SUCCEEDED, WorkflowStatus.FAILED)
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+# Registered workflow handlers, keyed by workflow type
+WORKFLOWS: Dict[str, Handler] = {}
+
+
+class QueueFull(Exception):
+    """Raised when the broker cannot accept more queued jobs"""
+
+
+class UnknownWorkflow(Exception):
+    """Raised when a job names a workflow type that is not registered"""
+
+
+def workflow(name: str) -> Callable[[Handler], Handler]:
+    """Register an async handler as a workflow type"""
+    def decorator(handler: Handler) -> Handler:
+        WORKFLOWS[name] = handler
+        return handler
+    return decorator
+
+
+class InProcessBroker:
+    """
+    asyncio priority queue plus an in-memory job table.
+
+    Jobs only live in this worker, so status must be polled on the same
+    process that accepted the job. Jobs still queued or running are kept
+    until they finish; only finished ones are evicted, oldest first.
+    """
+
+    def __init__(self, max_queued: int = JOB_QUEUE_MAX):
+        self.max_queued = max_queued
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._jobs: Dict[str, WorkflowJob] = {}
+        self._finished = LRUCache(max_entries=max_queued * 2, ttl=JOB_RETENTION_SECONDS)
+        self._seq = itertools.count()
+
+    @property
+    def queue(self) -> asyncio.PriorityQueue:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        return self._queue
+
+    async def put(self, job: WorkflowJob, delay: float = 0) -> None:
+        self._jobs[job.id] = job
+        if delay:
+            asyncio.get_running_loop().call_later(delay, self._enqueue, job)
+            return
+        if job.attempts == 0 and self.queue.qsize() >= self.max_queued:
+            raise QueueFull()
+        self._enqueue(job)
+
+    def _enqueue(self, job: WorkflowJob) -> None:
+        self.queue.put_nowait((PRIORITY_RANK[job.priority], next(self._seq), job.id))
+
+    async def get(self) -> WorkflowJob:
+        while True:
+            _, _, job_id = await self.queue.get()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job
+
+    async def save(self, job: WorkflowJob) -> None:
+        if job.status in TERMINAL_STATUSES:
+            self._jobs.pop(job.id, None)
+            self._finished.set(job.id, job)
+        else:
+            self._jobs[job.id] = job
+
+    async def load(self, job_id: str) -> Optional[WorkflowJob]:
+        return self._jobs.get(job_id) or self._finished.get(job_id)
+
+    async def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteBroker:
+    """
+    Local stand-in for an external broker, backed by a SQLite file.
+
+    Every worker process pointed at the same file shares one queue and one
+    job table, so a job can be accepted, run and polled on different workers.
+    Claims are made inside an immediate transaction so a job runs once, and
+    carry a lease: a job whose worker died before finishing it is claimed
+    again once the lease expires.
+    """
+
+    def __init__(self, path: str = JOB_BROKER_PATH, max_queued: int = JOB_QUEUE_MAX,
+                 lease: float = JOB_LEASE_SECONDS):
+        self.max_queued = max_queued
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, rank INTEGER NOT NULL, available_at REAL NOT NULL,"
+            " claimed INTEGER NOT NULL DEFAULT 0, lease_expires_at REAL, finished_at REAL,"
+            " data TEXT NOT NULL)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "lease_expires_at" not in columns:
+            # Files created before claims had leases
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lease_expires_at REAL")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (claimed, rank, available_at)"
+        )
+
+    def _run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._lock:
+            return fn(self._conn)
+
+    async def put(self, job: WorkflowJob, delay: float = 0) -> None:
+        def insert(conn: sqlite3.Connection) -> None:
+            now = time.time()
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - JOB_RETENTION_SECONDS,))
+            if job.attempts == 0:
+                (queued,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE claimed = 0").fetchone()
+                if queued >= self.max_queued:
+                    raise QueueFull()
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, rank, available_at, claimed, lease_expires_at, data)"
+                " VALUES (?, ?, ?, 0, NULL, ?)",
+                (job.id, PRIORITY_RANK[job.priority], now + delay, _dump(job)),
+            )
+        await asyncio.to_thread(self._run, insert)
+
+    async def get(self) -> WorkflowJob:
+        def claim(conn: sqlite3.Connection) -> Optional[str]:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Unfinished jobs whose lease ran out go back in the queue
+                conn.execute(
+                    "UPDATE jobs SET claimed = 0 WHERE claimed = 1 AND finished_at IS NULL"
+                    " AND COALESCE(lease_expires_at, 0) <= ?",
+                    (now,),
+                )
+                row = conn.execute(
+                    "SELECT id, data FROM jobs WHERE claimed = 0 AND available_at <= ?"
+                    " ORDER BY rank, available_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row:
+                    conn.execute("UPDATE jobs SET claimed = 1, lease_expires_at = ? WHERE id = ?",
+                                 (now + self.lease, row[0]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return row[1] if row else None
+
+        while True:
+            data = await asyncio.to_thread(self._run, claim)
+            if data is not None:
+                return _load(data)
+            await asyncio.sleep(BROKER_POLL_SECONDS)
+
+    async def save(self, job: WorkflowJob) -> None:
+        finished_at = time.time() if job.status in TERMINAL_STATUSES else None
+        await asyncio.to_thread(self._run, lambda conn: conn.execute(
+            "UPDATE jobs SET data = ?, finished_at = ? WHERE id = ?",
+            (_dump(job), finished_at, job.id),
+        ))
+
+    async def load(self, job_id: str) -> Optional[WorkflowJob]:
+        row = await asyncio.to_thread(self._run, lambda conn: conn.execute(
+            "SELECT data FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone())
+        return _load(row[0]) if row else None
+
+    async def depth(self) -> int:
+        (queued,) = await asyncio.to_thread(self._run, lambda conn: conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE claimed = 0"
+        ).fetchone())
+        return queued
+
+    async def close(self) -> None:
+        self._conn.close()
+
+
+def _dump(job: WorkflowJob) -> str:
+    return json.dumps(job.dict(), default=str)
+
+
+def _load(data: str) -> WorkflowJob:
+    return WorkflowJob(**json.loads(data))
+
+
+class WorkerPool:
+    """
+    Fixed number of asyncio workers draining a broker.
+
+    Failed jobs are retried with exponential backoff and jitter until
+    max_attempts is reached, after which they are marked failed.
+    """
+
+    def __init__(self, broker, concurrency: int = JOB_WORKERS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS,
+                 backoff: float = JOB_RETRY_BACKOFF_SECONDS,
+                 timeout: float = JOB_TIMEOUT_SECONDS):
+        self.broker = broker
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+        self._workers: List[asyncio.Task] = []
+
+    async def submit(self, workflow_type: str, payload: Dict[str, Any],
+                     priority: TicketPriority = TicketPriority.MEDIUM) -> WorkflowJob:
+        """Queue a job and return it immediately"""
+        if workflow_type not in WORKFLOWS:
+            raise UnknownWorkflow(workflow_type)
+        now = datetime.utcnow()
+        job = WorkflowJob(
+            id=str(uuid.uuid4()),
+            workflow_type=workflow_type,
+            payload=payload,
+            priority=priority,
+            request_id=request_id_var.get(),
+            created_at=now,
+            updated_at=now,
+        )
+        await self.broker.put(job)
+        return job
+
+    async def status(self, job_id: str) -> Optional[WorkflowJob]:
+        return await self.broker.load(job_id)
+
+    async def start(self) -> None:
+        for _ in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        await self.broker.close()
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.broker.get()
+            await self._run(job)
+
+    async def _run(self, job: WorkflowJob) -> None:
+        # Log records from the handler carry the id of the request that queued it
+        request_id_var.set(job.request_id or job.id)
+        if job.status == WorkflowStatus.RUNNING and job.attempts >= self.max_attempts:
+            # Reclaimed after its worker died on the last attempt
+            job.status = WorkflowStatus.FAILED
+            job.error = "Worker stopped while running the job"
+            job.updated_at = datetime.utcnow()
+            JOB_RUNS.labels(job.workflow_type, "failed").inc()
+            await self.broker.save(job)
+            return
+        job.attempts += 1
+        job.status = WorkflowStatus.RUNNING
+        job.updated_at = datetime.utcnow()
+        await self.broker.save(job)
+
+        start = time.perf_counter()
+        try:
+            handler = WORKFLOWS.get(job.workflow_type)
+            if handler is None:
+                raise UnknownWorkflow(job.workflow_type)
+            job.result = await asyncio.wait_for(handler(job.payload), timeout=self.timeout)
+            JOB_LATENCY.labels(job.workflow_type).observe(time.perf_counter() - start)
+            job.status = WorkflowStatus.SUCCEEDED
+            job.error = None
+            JOB_RUNS.labels(job.workflow_type, "succeeded").inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            JOB_LATENCY.labels(job.workflow_type).observe(time.perf_counter() - start)
+            JOB_RUNS.labels(job.workflow_type, "failed").inc()
+            if job.attempts < self.max_attempts and not isinstance(e, UnknownWorkflow):
+                job.status = WorkflowStatus.RETRYING
+                job.updated_at = datetime.utcnow()
+                delay = self.backoff * 2 ** (job.attempts - 1) + random.uniform(0, self.backoff)
+                await self.broker.put(job, delay=delay)
+                return
+            job.status = WorkflowStatus.FAILED
+
+        job.updated_at = datetime.utcnow()
+        await self.broker.save(job)
+
+
+def build_broker():
+    """Broker configured by JOB_BROKER (memory or sqlite)"""
+    if JOB_BROKER == "sqlite":
+        return SQLiteBroker()
+    return InProcessBroker()
+
+
+# Shared pool; started and stopped with the application
+pool = WorkerPool(build_broker())
+
+
+@REGISTRY.collector
+async def _queue_depth() -> None:
+    JOB_QUEUE_DEPTH.set(await pool.broker.depth())
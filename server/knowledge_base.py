@@ -0,0 +1,315 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from classifier import features, ticket_text
+from models import KnowledgeArticleMatch
+
+logger = logging.getLogger(__name__)
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+# Markdown or text articles, one per file, titled by their first "# " line
+KB_ARTICLES_DIR = os.getenv("KB_ARTICLES_DIR", os.path.join(_HERE, "kb_articles"))
+# Where the vector matrix is written; rebuilt whenever the articles change
+KB_INDEX_DIR = os.getenv("KB_INDEX_DIR", os.path.join(_HERE, "kb_index"))
+# Size of the hashed feature space; more dimensions mean fewer collisions and a bigger matrix
+KB_DIMENSIONS = int(os.getenv("KB_DIMENSIONS", "4096"))
+KB_TOP_K = int(os.getenv("KB_TOP_K", "3"))
+# Articles less similar than this are not suggested on tickets
+KB_SUGGEST_THRESHOLD = float(os.getenv("KB_SUGGEST_THRESHOLD", "0.1"))
+# The chatbot answers from the best article, without the LLM, from this similarity up
+KB_ANSWER_THRESHOLD = float(os.getenv("KB_ANSWER_THRESHOLD", "0.18"))
+# Up to this many articles a lookup scans the whole matrix; beyond it the articles are clustered
+KB_EXACT_SEARCH_MAX = int(os.getenv("KB_EXACT_SEARCH_MAX", "20000"))
+# Clusters scanned per lookup once clustered; more is slower and misses fewer neighbours
+KB_PROBES = int(os.getenv("KB_PROBES", "8"))
+
+ARTICLE_SUFFIXES = (".md", ".txt")
+# Title features count this many times over body features
+TITLE_WEIGHT = 3
+SUMMARY_CHARS = 700
+# k-means runs on this many sampled rows per cluster, from a fixed seed so every worker agrees
+KMEANS_SAMPLE_PER_CLUSTER = 32
+KMEANS_ITERATIONS = 10
+KMEANS_SEED = 1821
+# Rows copied or assigned per step while building, bounding the memory a build needs
+BUILD_CHUNK_ROWS = 4096
+INDEX_FILES = ("vectors.npy", "idf.npy", "centroids.npy", "offsets.npy", "articles.json", "manifest.json")
+# Part of the fingerprint; bump when the weighting or the files written change
+INDEX_VERSION = 1
+
+
+def summarize(body: str, limit: int = SUMMARY_CHARS) -> str:
+    """Leading paragraphs of body, whole ones while they fit in limit characters"""
+    summary = ""
+    for paragraph in filter(None, (p.strip() for p in body.split("\n\n"))):
+        if summary and len(summary) + len(paragraph) + 2 > limit:
+            break
+        summary = f"{summary}\n\n{paragraph}" if summary else paragraph
+    return summary[:limit]
+
+def read_article(path: str, root: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    article_id = os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, "/")
+    title, _, body = text.partition("\n")
+    if title.startswith("#"):
+        title = title.lstrip("#").strip()
+    else:
+        title, body = os.path.basename(article_id).replace("-", " ").replace("_", " ").capitalize(), text
+    body = body.strip()
+    return {"id": article_id, "title": title, "summary": summarize(body), "text": body}
+
+def article_paths(root: str) -> List[str]:
+    paths = []
+    for directory, _, names in os.walk(root):
+        paths.extend(os.path.join(directory, name) for name in names
+                     if name.endswith(ARTICLE_SUFFIXES) and name.lower() != "readme.md")
+    return sorted(paths)
+
+def term_counts(text: str, dimensions: int, weight: float = 1.0,
+                counts: Optional[Dict[int, float]] = None) -> Dict[int, float]:
+    """The classifier's unigram and bigram features of text, counted into hashed buckets"""
+    counts = {} if counts is None else counts
+    for feature in features(text):
+        bucket = zlib.crc32(feature.encode("utf-8")) % dimensions
+        counts[bucket] = counts.get(bucket, 0.0) + weight
+    return counts
+
+def _weigh(row: np.ndarray, counts: Dict[int, float], idf: np.ndarray) -> None:
+    """Fill row with the unit-length TF-IDF vector of counts"""
+    if not counts:
+        return
+    buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    weights = (1 + np.log(tf)) * idf[buckets]
+    row[buckets] = weights / np.linalg.norm(weights)
+
+class KnowledgeBase:
+    """
+    Nearest-neighbour lookup of help articles, CPU-only.
+
+    Articles are embedded as hashed TF-IDF vectors over the classifier's
+    unigram and bigram features: every feature lands in one of `dimensions`
+    buckets, weighted by 1 + log(count) times its inverse document
+    frequency, and each vector is scaled to unit length so a dot product is
+    the cosine similarity. The vectors live in a float32 matrix memory-mapped
+    from index_dir, so workers share one copy through the page cache and a
+    restart with unchanged articles opens the index without re-embedding.
+
+    Up to exact_search_max articles a lookup is one matrix-vector product.
+    Beyond that the index is an inverted file: spherical k-means splits the
+    articles into about sqrt(n) clusters, stored as contiguous row ranges,
+    and a lookup scores only the articles in the `probes` clusters whose
+    centroids are closest to the query.
+    """
+
+    def __init__(self, articles_dir: str = KB_ARTICLES_DIR, index_dir: str = KB_INDEX_DIR,
+                 dimensions: int = KB_DIMENSIONS, exact_search_max: int = KB_EXACT_SEARCH_MAX,
+                 probes: int = KB_PROBES):
+        self.articles_dir = articles_dir
+        self.index_dir = index_dir
+        self.dimensions = dimensions
+        self.exact_search_max = exact_search_max
+        self.probes = probes
+        self.articles: List[dict] = []
+        self._by_id: Dict[str, dict] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._idf: Optional[np.ndarray] = None
+        self._centroids: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.articles)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _fingerprint(self, paths: List[str]) -> str:
+        digest = hashlib.sha1(json.dumps([INDEX_VERSION, self.dimensions, self.exact_search_max]).encode())
+        for path in paths:
+            stat = os.stat(path)
+            digest.update(f"\0{os.path.relpath(path, self.articles_dir)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    def load(self) -> "KnowledgeBase":
+        """Open the index of the current articles, building it first if they changed"""
+        paths = article_paths(self.articles_dir) if os.path.isdir(self.articles_dir) else []
+        if not paths:
+            self.articles, self._by_id = [], {}
+            self._vectors, self._idf, self._centroids, self._offsets = None, None, None, None
+            return self
+        fingerprint = self._fingerprint(paths)
+        try:
+            with open(self._path("manifest.json")) as f:
+                if json.load(f).get("fingerprint") == fingerprint:
+                    self._open()
+                    return self
+        except (OSError, ValueError):
+            pass
+        self.build(paths, fingerprint)
+        return self
+
+    def _open(self) -> None:
+        with open(self._path("articles.json"), encoding="utf-8") as f:
+            self.articles = json.load(f)
+        self._by_id = {article["id"]: article for article in self.articles}
+        self._vectors = np.load(self._path("vectors.npy"), mmap_mode="r")
+        self._idf = np.load(self._path("idf.npy"))
+        self._centroids = np.load(self._path("centroids.npy"))
+        self._offsets = np.load(self._path("offsets.npy"))
+
+    def build(self, paths: List[str], fingerprint: str) -> None:
+        """
+        Embed the articles at paths and write the index.
+
+        Every file goes to a temporary name first and the manifest is replaced
+        last, so a worker starting meanwhile sees either the old index or the
+        new one. Workers building at once write identical files.
+        """
+        articles = [read_article(path, self.articles_dir) for path in paths]
+        counts = []
+        for article in articles:
+            article_counts = term_counts(article["title"], self.dimensions, TITLE_WEIGHT)
+            counts.append(term_counts(article["text"], self.dimensions, counts=article_counts))
+        document_frequency = np.zeros(self.dimensions, dtype=np.float32)
+        for article_counts in counts:
+            document_frequency[list(article_counts)] += 1
+        idf = (np.log((1 + len(articles)) / (1 + document_frequency)) + 1).astype(np.float32)
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        suffix = f".{os.getpid()}.tmp"
+        shape = (len(articles), self.dimensions)
+        unsorted = np.lib.format.open_memmap(self._path("unsorted.npy" + suffix), mode="w+",
+                                             dtype=np.float32, shape=shape)
+        for row, article_counts in zip(unsorted, counts):
+            _weigh(row, article_counts, idf)
+        centroids, assignment = self._cluster(unsorted)
+
+        # Rows are stored grouped by cluster, so probing one is a contiguous read
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        vectors = np.lib.format.open_memmap(self._path("vectors.npy" + suffix), mode="w+",
+                                            dtype=np.float32, shape=shape)
+        for start in range(0, len(order), BUILD_CHUNK_ROWS):
+            vectors[start:start + BUILD_CHUNK_ROWS] = unsorted[order[start:start + BUILD_CHUNK_ROWS]]
+        vectors.flush()
+        del vectors, unsorted
+        os.unlink(self._path("unsorted.npy" + suffix))
+
+        for name, array in (("idf.npy", idf), ("centroids.npy", centroids), ("offsets.npy", offsets)):
+            with open(self._path(name + suffix), "wb") as f:
+                np.save(f, array)
+        with open(self._path("articles.json" + suffix), "w", encoding="utf-8") as f:
+            json.dump([articles[i] for i in order], f)
+        with open(self._path("manifest.json" + suffix), "w") as f:
+            json.dump({"fingerprint": fingerprint, "articles": len(articles), "clusters": len(centroids),
+                       "dimensions": self.dimensions}, f)
+        for name in INDEX_FILES:
+            os.replace(self._path(name + suffix), self._path(name))
+        logger.info("kb.index_built", extra={"articles": len(articles), "clusters": len(centroids)})
+        self._open()
+
+    def _cluster(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(centroids, cluster of each row) from spherical k-means over a sample of the rows"""
+        if len(vectors) <= self.exact_search_max:
+            return np.asarray(vectors).mean(axis=0, keepdims=True), np.zeros(len(vectors), dtype=np.int64)
+        clusters = int(math.sqrt(len(vectors)))
+        rng = np.random.default_rng(KMEANS_SEED)
+        sample = min(len(vectors), KMEANS_SAMPLE_PER_CLUSTER * clusters)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample, replace=False))])
+        centroids = sample[rng.choice(len(sample), clusters, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            members = np.zeros((clusters, len(sample)), dtype=np.float32)
+            members[labels, np.arange(len(sample))] = 1
+            sums = members @ sample
+            norms = np.linalg.norm(sums, axis=1)
+            # An empty cluster restarts from a random sample row
+            empty = norms == 0
+            sums[empty], norms[empty] = sample[rng.choice(len(sample), int(empty.sum()))], 1
+            centroids = sums / norms[:, None]
+        assignment = np.concatenate([
+            np.argmax(np.asarray(vectors[start:start + BUILD_CHUNK_ROWS]) @ centroids.T, axis=1)
+            for start in range(0, len(vectors), BUILD_CHUNK_ROWS)
+        ])
+        return centroids.astype(np.float32), assignment
+
+    def _candidates(self, query: np.ndarray) -> List[Tuple[int, int]]:
+        """Row ranges of the probes clusters whose centroids are most similar to query"""
+        similarity = self._centroids @ query
+        nearest = np.argpartition(-similarity, self.probes)[:self.probes] \
+            if len(similarity) > self.probes else np.arange(len(similarity))
+        return [(int(self._offsets[c]), int(self._offsets[c + 1])) for c in nearest]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        queries = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in zip(queries, texts):
+            _weigh(row, term_counts(text, self.dimensions), self._idf)
+        return queries
+
+    def _top(self, scores: np.ndarray, rows: Optional[np.ndarray], k: int,
+             min_score: float) -> List[KnowledgeArticleMatch]:
+        best = np.argpartition(-scores, k)[:k] if len(scores) > k else np.arange(len(scores))
+        matches = []
+        for i in best[np.argsort(-scores[best], kind="stable")]:
+            if scores[i] < min_score or scores[i] <= 0:
+                break
+            article = self.articles[int(rows[i] if rows is not None else i)]
+            matches.append(KnowledgeArticleMatch(id=article["id"], title=article["title"],
+                                                 score=round(float(scores[i]), 4), summary=article["summary"]))
+        return matches
+
+    def search(self, text: str, k: int = KB_TOP_K, min_score: float = 0.0) -> List[KnowledgeArticleMatch]:
+        return self.search_batch([text], k, min_score)[0]
+
+    def search_batch(self, texts: Sequence[str], k: int = KB_TOP_K,
+                     min_score: float = 0.0) -> List[List[KnowledgeArticleMatch]]:
+        """Up to k articles per text, most similar first"""
+        if not self.articles or not texts or k <= 0:
+            return [[] for _ in texts]
+        queries = self.embed(texts)
+        if len(self._centroids) <= self.probes:
+            scores = queries @ self._vectors.T
+            return [self._top(row, None, k, min_score) for row in scores]
+        results = []
+        for query in queries:
+            ranges = self._candidates(query)
+            rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+            scores = np.concatenate([self._vectors[start:end] @ query for start, end in ranges])
+            results.append(self._top(scores, rows, k, min_score))
+        return results
+
+    def article(self, article_id: str) -> Optional[dict]:
+        """id, title, summary and full text of an article"""
+        return self._by_id.get(article_id)
+
+    def answer(self, message: str) -> Optional[KnowledgeArticleMatch]:
+        """The article that answers message well enough to skip the LLM, if any"""
+        matches = self.search(message, k=1, min_score=KB_ANSWER_THRESHOLD)
+        return matches[0] if matches else None
+
+    def suggest(self, rows: List[dict], k: int = KB_TOP_K, min_score: float = KB_SUGGEST_THRESHOLD) -> None:
+        """Set suggested_knowledge_base_articles on ticket rows about to be inserted"""
+        if not self.articles:
+            return
+        for row, matches in zip(rows, self.search_batch([ticket_text(row) for row in rows], k, min_score)):
+            row['suggested_knowledge_base_articles'] = [match.id for match in matches]
+
+def _load() -> KnowledgeBase:
+    knowledge_base = KnowledgeBase()
+    try:
+        return knowledge_base.load()
+    except OSError:
+        # An unwritable index directory turns suggestions off rather than failing startup
+        logger.exception("kb.index_failed", extra={"index_dir": KB_INDEX_DIR})
+        return knowledge_base
+
+# Shared by the ticket and chat routers
+knowledge_base = _load()
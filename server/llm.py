@@ -0,0 +1,297 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import time
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, TypeVar
+
+import google.generativeai as genai
+
+from cache import ResponseCache, build_response_cache, make_key
+from metrics import (LLM_COALESCED, LLM_ERRORS, LLM_FAILOVERS, LLM_FIRST_CHUNK, LLM_LATENCY,
+                     LLM_MODEL_ERROR_RATE, LLM_MODEL_LATENCY, LLM_TOKENS, REGISTRY)
+from model_router import ModelRouter
+from singleflight import SingleFlight
+
+T = TypeVar("T")
+
+DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "gemini-2.5-flash")
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Share one upstream call between concurrent identical prompts
+LLM_COALESCE = os.getenv("LLM_COALESCE", "on") != "off"
+DISCONNECT_POLL_SECONDS = 0.5
+# host:port of a Gemini-compatible gRPC endpoint (e.g. bench/fake_gemini.py); unset for the real API
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+
+class LLMError(Exception):
+    """Raised when the upstream model call fails"""
+
+
+class LLMTimeoutError(LLMError):
+    """Raised when the upstream model call exceeds its timeout"""
+
+
+class ClientDisconnected(Exception):
+    """Raised when the HTTP client went away before the call finished"""
+
+
+class LLMClient:
+    """
+    Shared async Gemini client.
+
+    Uses the SDK's native async generate so calls never block the event loop,
+    caps the number of in-flight upstream calls with a semaphore and applies a
+    per-call timeout. Model objects are built once and reused, answers are
+    served from the response cache when one is configured, and concurrent
+    identical prompts that miss the cache share a single upstream call.
+
+    Calls that do not name a model are routed by the ModelRouter, which
+    picks a model from the request kind and prompt length and fails over or
+    hedges to another model when the first one errors or is slow.
+    """
+
+    def __init__(self, default_model: str = DEFAULT_MODEL,
+                 timeout: float = LLM_TIMEOUT_SECONDS,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 cache: Optional[ResponseCache] = None,
+                 coalesce: bool = LLM_COALESCE,
+                 router: Optional[ModelRouter] = None):
+        self.default_model = default_model
+        self.cache = cache
+        self.singleflight = SingleFlight(on_coalesce=LLM_COALESCED.labels().inc) if coalesce else None
+        self.router = router
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        for name in router.models if router is not None else [default_model]:
+            self._get_model(name)
+
+    def _get_model(self, name: str) -> genai.GenerativeModel:
+        model = self._models.get(name)
+        if model is None:
+            model = genai.GenerativeModel(name)
+            self._models[name] = model
+        return model
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _candidates(self, kind: str, prompt: str, model: Optional[str]) -> List[str]:
+        """Models to try, preferred first; a named model is used on its own"""
+        if model or self.router is None:
+            return [model or self.default_model]
+        return self.router.route(kind, prompt)
+
+    async def generate(self, message: str, system_prompt: str = "",
+                       model: Optional[str] = None,
+                       timeout: Optional[float] = None,
+                       kind: str = "chat", history: str = "") -> str:
+        """
+        Generate a reply to message without blocking the event loop.
+
+        history is the conversation so far; it is sent ahead of message but
+        only scopes the cache, which is keyed on message alone.
+        """
+        prompt = build_prompt(message, system_prompt, history)
+        models = self._candidates(kind, prompt, model)
+        # Cached under the preferred model, whichever one ends up answering
+        model_name = models[0]
+        scope = cache_scope(system_prompt, history)
+
+        if self.cache is not None:
+            cached = await self.cache.get(message, model_name, scope)
+            if cached is not None:
+                return cached
+
+        async def call() -> str:
+            if len(models) == 1:
+                reply = await self._call(prompt, model_name, timeout)
+            else:
+                reply = await self.router.call(models, lambda name: self._call(prompt, name, timeout))
+            if self.cache is not None:
+                await self.cache.set(message, model_name, reply, scope)
+            return reply
+
+        if self.singleflight is None:
+            return await call()
+        # Same normalisation as the cache, so rephrasings that would hit it also coalesce
+        return await self.singleflight.do(make_key(message, model_name, scope), call)
+
+    async def _call(self, prompt: str, model_name: str, timeout: Optional[float]) -> str:
+        timeout = self.timeout if timeout is None else timeout
+
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    self._get_model(model_name).generate_content_async(prompt),
+                    timeout=timeout,
+                )
+            except asyncio.TimeoutError:
+                LLM_ERRORS.labels(model_name, "timeout").inc()
+                raise LLMTimeoutError(f"{model_name} did not respond within {timeout:.0f}s")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LLM_ERRORS.labels(model_name, "error").inc()
+                raise LLMError(str(e)) from e
+            LLM_LATENCY.labels(model_name, "generate").observe(time.perf_counter() - start)
+
+        _record_usage(model_name, response)
+        return getattr(response, "text", str(response))
+
+
+    async def stream(self, message: str, system_prompt: str = "",
+                     model: Optional[str] = None,
+                     timeout: Optional[float] = None,
+                     kind: str = "chat", history: str = "") -> AsyncIterator[str]:
+        """
+        Yield the reply to message chunk by chunk as the model produces it.
+
+        timeout bounds the wait for each chunk rather than the whole reply.
+        The concurrency slot is held until the generator is exhausted or closed.
+        A routed call moves to the next model if one fails before its first
+        chunk; once text has been sent, errors are raised to the caller.
+        history scopes the cache as it does in generate.
+        """
+        prompt = build_prompt(message, system_prompt, history)
+        models = self._candidates(kind, prompt, model)
+        model_name = models[0]
+        scope = cache_scope(system_prompt, history)
+        timeout = self.timeout if timeout is None else timeout
+
+        if self.cache is not None:
+            cached = await self.cache.get(message, model_name, scope)
+            if cached is not None:
+                yield cached
+                return
+
+        routed = len(models) > 1
+        if routed:
+            models = self.router.order(models)
+        parts = []
+        for index, name in enumerate(models):
+            try:
+                async with contextlib.aclosing(self._stream(prompt, name, timeout)) as chunks:
+                    async for text in chunks:
+                        parts.append(text)
+                        yield text
+            except LLMError:
+                if routed:
+                    self.router.record(name, None, ok=False)
+                if parts or index == len(models) - 1:
+                    raise
+                LLM_FAILOVERS.labels(name).inc()
+                continue
+            if routed:
+                self.router.record(name, None, ok=True)
+            break
+
+        if self.cache is not None and parts:
+            await self.cache.set(message, model_name, "".join(parts), scope)
+
+    async def _stream(self, prompt: str, model_name: str, timeout: float) -> AsyncIterator[str]:
+        first = True
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    self._get_model(model_name).generate_content_async(prompt, stream=True),
+                    timeout=timeout,
+                )
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+                    except StopAsyncIteration:
+                        break
+                    text = getattr(chunk, "text", "")
+                    if text:
+                        if first:
+                            LLM_FIRST_CHUNK.labels(model_name).observe(time.perf_counter() - start)
+                            first = False
+                        yield text
+            except asyncio.TimeoutError:
+                LLM_ERRORS.labels(model_name, "timeout").inc()
+                raise LLMTimeoutError(f"{model_name} stalled for more than {timeout:.0f}s")
+            except (asyncio.CancelledError, GeneratorExit):
+                raise
+            except Exception as e:
+                LLM_ERRORS.labels(model_name, "error").inc()
+                raise LLMError(str(e)) from e
+            LLM_LATENCY.labels(model_name, "stream").observe(time.perf_counter() - start)
+            # Usage is reported on the aggregated response once the stream is done
+            _record_usage(model_name, response)
+
+
+def configure(api_key: str) -> None:
+    """Configure the Gemini SDK, pointing it at GEMINI_API_ENDPOINT when set"""
+    client_options = {"api_endpoint": GEMINI_API_ENDPOINT} if GEMINI_API_ENDPOINT else None
+    genai.configure(api_key=api_key, client_options=client_options)
+
+
+def _record_usage(model_name: str, response) -> None:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    LLM_TOKENS.labels(model_name, "prompt").inc(getattr(usage, "prompt_token_count", 0) or 0)
+    LLM_TOKENS.labels(model_name, "completion").inc(getattr(usage, "candidates_token_count", 0) or 0)
+
+
+def build_prompt(message: str, system_prompt: str = "", history: str = "") -> str:
+    if history:
+        message = f"{history}\n{message}"
+    return f"{system_prompt}\n\n{message}" if system_prompt else message
+
+
+def cache_scope(system_prompt: str, history: str = "") -> str:
+    """
+    Namespace for cached replies: the system prompt plus a digest of the
+    conversation so far, so a reply is only reused within the same history
+    """
+    if not history:
+        return system_prompt
+    return f"{system_prompt}\x1f{hashlib.sha256(history.encode()).hexdigest()}"
+
+
+async def cancel_on_disconnect(request, awaitable: Awaitable[T],
+                               poll_interval: float = DISCONNECT_POLL_SECONDS) -> T:
+    """
+    Await awaitable, cancelling it if the HTTP client disconnects first.
+
+    Raises ClientDisconnected when the request was abandoned so the upstream
+    call (and its concurrency slot) is released straight away.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+# Shared client used by every chatbot endpoint
+client = LLMClient(cache=build_response_cache(), router=ModelRouter(DEFAULT_MODEL))
+
+
+@REGISTRY.collector
+async def _model_health_metrics() -> None:
+    if client.router is None:
+        return
+    for model, health in client.router.stats().items():
+        if health["latency_s"] is not None:
+            LLM_MODEL_LATENCY.labels(model).set(health["latency_s"])
+        LLM_MODEL_ERROR_RATE.labels(model).set(health["error_rate"])
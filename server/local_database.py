@@ -0,0 +1,391 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from database import Database, DB_POOL_SIZE, DB_QUERY_TIMEOUT_SECONDS, SQLITE_PATH
+from metrics import instrument_methods
+from notifications import NOTIFY, ticket_events
+from storage import connect
+
+logger = logging.getLogger(__name__)
+
+# Defaults the Supabase table fills in for a new ticket
+TICKET_DEFAULTS = {
+    'status': 'open',
+    'suggested_knowledge_base_articles': [],
+    'is_self_service_resolved': False,
+    'chat_history': [],
+}
+
+OUTBOX_COLUMNS = "id, ticket_id, event, payload, status, attempts, last_error, created_at"
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def _transaction(conn: sqlite3.Connection, fn: Callable[[], Any]) -> Any:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn()
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return result
+
+def _outbox_event(row: tuple) -> dict:
+    event_id, ticket_id, event, payload, status, attempts, last_error, created_at = row
+    return {'id': event_id, 'ticket_id': ticket_id, 'event': event, 'payload': json.loads(payload),
+            'status': status, 'attempts': attempts, 'last_error': last_error, 'created_at': created_at}
+
+def _project(row: dict, columns: Optional[Sequence[str]]) -> dict:
+    if not columns:
+        return row
+    return {column: row.get(column) for column in columns}
+
+@instrument_methods(exclude=("run",))
+class LocalDatabase(Database):
+    """
+    SQLite implementation of the Database interface.
+
+    Used with DATABASE_BACKEND=sqlite for local development, tests and the
+    benchmark harness. Tickets are stored as JSON documents with the keyset
+    and lookup columns broken out and indexed. Search always uses the
+    in-process index. Supabase auth is not available.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH, pool_size: int = DB_POOL_SIZE,
+                 query_timeout: float = DB_QUERY_TIMEOUT_SECONDS):
+        self.client = None
+        self.auth_client = None
+        self._init_pool(pool_size, query_timeout)
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tickets (
+                id TEXT PRIMARY KEY,
+                ticket_number TEXT UNIQUE,
+                idempotency_key TEXT,
+                created_at TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tickets_created_at_id ON tickets (created_at DESC, id DESC);
+            CREATE UNIQUE INDEX IF NOT EXISTS tickets_idempotency_key ON tickets (idempotency_key);
+            CREATE TABLE IF NOT EXISTS ticket_number_sequences (
+                day TEXT PRIMARY KEY,
+                last_value INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS profiles (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                token_id TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS notification_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ticket_id TEXT NOT NULL,
+                event TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                locked_until REAL,
+                last_error TEXT,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS notification_outbox_due ON notification_outbox (status, available_at, id);
+        """)
+
+    @property
+    def auth(self):
+        raise RuntimeError("Supabase auth is not available with DATABASE_BACKEND=sqlite")
+
+    async def _sql(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        def locked():
+            with self._lock:
+                return fn(self._conn)
+        return await self.run(locked)
+
+    def close(self) -> None:
+        super().close()
+        self._conn.close()
+
+    @staticmethod
+    def _new_ticket(ticket_data: dict) -> dict:
+        now = _now()
+        ticket = {**TICKET_DEFAULTS, **ticket_data, 'id': str(uuid.uuid4()),
+                  'created_at': now, 'updated_at': now}
+        return json.loads(json.dumps(ticket, default=str))
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, ticket: dict) -> bool:
+        """Insert one ticket; False when its idempotency key already exists"""
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO tickets (id, ticket_number, idempotency_key, created_at, data)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (ticket['id'], ticket.get('ticket_number'), ticket.get('idempotency_key'),
+             ticket['created_at'], json.dumps(ticket)),
+        )
+        if cursor.rowcount:
+            LocalDatabase._record_events(conn, None, ticket)
+            return True
+        key = ticket.get('idempotency_key')
+        if key and conn.execute("SELECT 1 FROM tickets WHERE idempotency_key = ?", (key,)).fetchone():
+            return False
+        raise sqlite3.IntegrityError(f"Duplicate ticket_number {ticket.get('ticket_number')}")
+
+    @staticmethod
+    def _record_events(conn: sqlite3.Connection, old: Optional[dict], new: dict) -> None:
+        """Add the notifications for a ticket change to the outbox, in the caller's transaction"""
+        if not NOTIFY:
+            return
+        now, created_at = time.time(), _now()
+        conn.executemany(
+            "INSERT INTO notification_outbox (ticket_id, event, payload, available_at, created_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            [(new['id'], event, json.dumps(payload), now, created_at) for event, payload in ticket_events(old, new)],
+        )
+
+    async def create_ticket(self, ticket_data: dict) -> dict:
+        """Create a new ticket in the database"""
+        try:
+            ticket = self._new_ticket(ticket_data)
+            await self._sql(lambda conn: _transaction(conn, lambda: self._insert(conn, ticket)))
+            if self._search_index is not None:
+                self._search_index.add(ticket)
+            return ticket
+        except Exception as e:
+            logger.error("Error creating ticket: %s", e)
+            return None
+
+    async def create_tickets(self, rows: List[dict]) -> List[dict]:
+        """Insert many tickets in one transaction, skipping known idempotency keys"""
+        tickets = [self._new_ticket(row) for row in rows]
+
+        def insert_all(conn: sqlite3.Connection) -> List[dict]:
+            return [ticket for ticket in tickets if self._insert(conn, ticket)]
+
+        created = await self._sql(lambda conn: _transaction(conn, lambda: insert_all(conn)))
+        if self._search_index is not None:
+            for ticket in created:
+                self._search_index.add(ticket)
+        return created
+
+    async def get_tickets_by_idempotency_keys(self, keys: List[str],
+                                              columns: Optional[Sequence[str]] = None) -> List[dict]:
+        if not keys:
+            return []
+        placeholders = ",".join("?" * len(keys))
+        rows = await self._sql(lambda conn: conn.execute(
+            f"SELECT data FROM tickets WHERE idempotency_key IN ({placeholders})", keys
+        ).fetchall())
+        return [_project(json.loads(row[0]), columns) for row in rows]
+
+    async def reserve_ticket_numbers(self, day: str, count: int) -> int:
+        """Reserve count ticket numbers for day (YYMMDD) and return the first"""
+        row = await self._sql(lambda conn: conn.execute(
+            "INSERT INTO ticket_number_sequences (day, last_value) VALUES (?, ?)"
+            " ON CONFLICT (day) DO UPDATE SET last_value = last_value + excluded.last_value"
+            " RETURNING last_value",
+            (day, count),
+        ).fetchone())
+        return row[0] - count + 1
+
+    async def _load_one(self, column: str, value: str) -> Optional[dict]:
+        row = await self._sql(lambda conn: conn.execute(
+            f"SELECT data FROM tickets WHERE {column} = ?", (value,)
+        ).fetchone())
+        return json.loads(row[0]) if row else None
+
+    async def get_ticket(self, ticket_id: str, columns: Optional[Sequence[str]] = None,
+                         raise_errors: bool = False) -> Optional[dict]:
+        """Retrieve a ticket by ID; errors are always raised here"""
+        ticket = await self._load_one('id', ticket_id)
+        return _project(ticket, columns) if ticket else None
+
+    async def get_ticket_by_number(self, ticket_number: str,
+                                   columns: Optional[Sequence[str]] = None) -> Optional[dict]:
+        """Retrieve a ticket by ticket number"""
+        ticket = await self._load_one('ticket_number', ticket_number)
+        return _project(ticket, columns) if ticket else None
+
+    async def update_ticket(self, ticket_id: str, update_data: dict,
+                            only_if_null: Optional[str] = None) -> Optional[dict]:
+        """
+        Update a ticket in one transaction; None when no ticket has this id, or
+        when only_if_null names a field that is already set
+        """
+        def update(conn: sqlite3.Connection) -> Optional[dict]:
+            row = conn.execute("SELECT data FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+            if not row:
+                return None
+            old = json.loads(row[0])
+            if only_if_null and old.get(only_if_null) is not None:
+                return None
+            ticket = json.loads(json.dumps({**old, **update_data, 'updated_at': _now()}, default=str))
+            conn.execute("UPDATE tickets SET data = ? WHERE id = ?", (json.dumps(ticket), ticket_id))
+            self._record_events(conn, old, ticket)
+            return ticket
+
+        updated = await self._sql(lambda conn: _transaction(conn, lambda: update(conn)))
+        if updated and self._search_index is not None:
+            self._search_index.add(updated)
+        return updated
+
+    async def get_tickets(self, filters: dict = None, page: int = 1, page_size: int = 50,
+                          after: Optional[Tuple[str, str]] = None,
+                          columns: Optional[Sequence[str]] = None) -> list:
+        """Retrieve tickets with optional filtering and pagination"""
+        clauses, params = [], []
+        for key, value in (filters or {}).items():
+            if value is not None:
+                clauses.append("json_extract(data, ?) = ?")
+                params.extend([f"$.{key}", value])
+        if after:
+            created_at, ticket_id = after
+            clauses.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params.extend([created_at, created_at, ticket_id])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        offset = 0 if after else (page - 1) * page_size
+
+        rows = await self._sql(lambda conn: conn.execute(
+            f"SELECT data FROM tickets {where} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+            (*params, page_size, offset),
+        ).fetchall())
+        return [_project(json.loads(row[0]), columns) for row in rows]
+
+    async def get_ticket_counts(self) -> dict:
+        """Count tickets per status, priority and category"""
+        def count(conn: sqlite3.Connection) -> dict:
+            counts = {}
+            for dimension in ('status', 'priority', 'category'):
+                counts[dimension] = dict(conn.execute(
+                    "SELECT json_extract(data, ?), COUNT(*) FROM tickets GROUP BY 1",
+                    (f"$.{dimension}",),
+                ).fetchall())
+            return counts
+        return await self._sql(count)
+
+    async def delete_ticket(self, ticket_id: str) -> Optional[dict]:
+        """Delete a ticket and return it; None when no ticket has this id"""
+        row = await self._sql(lambda conn: conn.execute(
+            "DELETE FROM tickets WHERE id = ? RETURNING data", (ticket_id,)
+        ).fetchone())
+        if self._search_index is not None:
+            self._search_index.remove(ticket_id)
+        return json.loads(row[0]) if row else None
+
+    async def _fetch_all(self, columns: str, batch_size: int = 1000) -> list:
+        rows = await self._sql(lambda conn: conn.execute("SELECT data FROM tickets").fetchall())
+        return [_project(json.loads(row[0]), columns.split(',')) for row in rows]
+
+    async def _search_ids(self, keyword: str, filters: dict, page: int, page_size: int,
+                          after: Optional[Tuple[float, str]]) -> List[Tuple[str, float]]:
+        offset = 0 if after else (page - 1) * page_size
+        index = await self._local_search_index()
+        return index.search(keyword, filters, limit=page_size, offset=offset, after=after)
+
+    async def _get_tickets_by_ids(self, ticket_ids: List[str], columns: Optional[Sequence[str]]) -> list:
+        placeholders = ",".join("?" * len(ticket_ids))
+        rows = await self._sql(lambda conn: conn.execute(
+            f"SELECT data FROM tickets WHERE id IN ({placeholders})", ticket_ids
+        ).fetchall())
+        return [_project(json.loads(row[0]), columns) for row in rows]
+
+    async def get_profile(self, user_id: str) -> Optional[dict]:
+        """Retrieve a user's profile"""
+        row = await self._sql(lambda conn: conn.execute(
+            "SELECT data FROM profiles WHERE id = ?", (user_id,)
+        ).fetchone())
+        return json.loads(row[0]) if row else None
+
+    async def create_profile(self, profile_data: dict) -> Optional[dict]:
+        """Insert a user's profile"""
+        await self._sql(lambda conn: conn.execute(
+            "INSERT INTO profiles (id, data) VALUES (?, ?)",
+            (profile_data['id'], json.dumps(profile_data, default=str)),
+        ))
+        return profile_data
+
+    async def revoke_token(self, token_id: str, expires_at: float) -> None:
+        """Reject a token in every worker until expires_at (epoch seconds); drops lapsed entries"""
+        def revoke(conn: sqlite3.Connection) -> None:
+            conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (time.time(),))
+            conn.execute("INSERT OR REPLACE INTO revoked_tokens (token_id, expires_at) VALUES (?, ?)",
+                         (token_id, expires_at))
+        await self._sql(lambda conn: _transaction(conn, lambda: revoke(conn)))
+
+    async def is_token_revoked(self, token_id: str) -> bool:
+        row = await self._sql(lambda conn: conn.execute(
+            "SELECT 1 FROM revoked_tokens WHERE token_id = ? AND expires_at > ?", (token_id, time.time())
+        ).fetchone())
+        return row is not None
+
+    async def claim_outbox_events(self, limit: int, lease_seconds: float, min_age_seconds: float) -> List[dict]:
+        """Lease up to limit pending notification events that have waited at least min_age_seconds"""
+        def claim(conn: sqlite3.Connection) -> List[dict]:
+            now = time.time()
+            rows = conn.execute(
+                f"SELECT {OUTBOX_COLUMNS} FROM notification_outbox WHERE status = 'pending'"
+                " AND available_at <= ? AND (locked_until IS NULL OR locked_until < ?)"
+                " ORDER BY available_at, id LIMIT ?",
+                (now - min_age_seconds, now, limit),
+            ).fetchall()
+            conn.executemany("UPDATE notification_outbox SET locked_until = ? WHERE id = ?",
+                             [(now + lease_seconds, row[0]) for row in rows])
+            return [_outbox_event(row) for row in rows]
+        return await self._sql(lambda conn: _transaction(conn, lambda: claim(conn)))
+
+    async def complete_outbox_events(self, ids: List[int]) -> None:
+        """Remove events whose notifications went out"""
+        placeholders = ",".join("?" * len(ids))
+        await self._sql(lambda conn: conn.execute(
+            f"DELETE FROM notification_outbox WHERE id IN ({placeholders})", ids
+        ))
+
+    async def fail_outbox_events(self, ids: List[int], error: str, backoff_seconds: float,
+                                 max_attempts: int) -> int:
+        """Schedule events for another attempt, or dead-letter them; returns how many were dead-lettered"""
+        placeholders = ",".join("?" * len(ids))
+
+        def fail(conn: sqlite3.Connection) -> int:
+            conn.execute(
+                "UPDATE notification_outbox SET attempts = attempts + 1,"
+                " status = CASE WHEN attempts + 1 >= ? THEN 'dead' ELSE 'pending' END,"
+                " available_at = ? + ? * (1 << attempts), locked_until = NULL, last_error = ?"
+                f" WHERE id IN ({placeholders})",
+                (max_attempts, time.time(), backoff_seconds, error, *ids),
+            )
+            (dead,) = conn.execute(
+                f"SELECT COUNT(*) FROM notification_outbox WHERE status = 'dead' AND id IN ({placeholders})", ids
+            ).fetchone()
+            return dead
+        return await self._sql(lambda conn: _transaction(conn, lambda: fail(conn)))
+
+    async def get_outbox_events(self, status: str = 'dead', limit: int = 100) -> List[dict]:
+        """Outbox events in status, newest first"""
+        rows = await self._sql(lambda conn: conn.execute(
+            f"SELECT {OUTBOX_COLUMNS} FROM notification_outbox WHERE status = ? ORDER BY id DESC LIMIT ?",
+            (status, limit),
+        ).fetchall())
+        return [_outbox_event(row) for row in rows]
+
+    async def requeue_outbox_events(self, ids: Optional[List[int]] = None) -> int:
+        """Give dead-lettered events (all of them when ids is None) a fresh set of attempts"""
+        where, params = "status = 'dead'", []
+        if ids is not None:
+            where += f" AND id IN ({','.join('?' * len(ids))})"
+            params = list(ids)
+        cursor = await self._sql(lambda conn: conn.execute(
+            "UPDATE notification_outbox SET status = 'pending', attempts = 0, available_at = ?,"
+            f" locked_until = NULL WHERE {where}",
+            (time.time(), *params),
+        ))
+        return cursor.rowcount
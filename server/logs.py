@@ -0,0 +1,199 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from metrics import REGISTRY, route_template
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Records buffered for the writer thread; beyond this they are dropped, never waited on
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of records kept per event, e.g. "http.request=0.1,chatbot.request=0.5".
+# Warnings and errors are always kept.
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "http.request=0.1")
+# Message and reply text is replaced by its length unless this is set
+LOG_INCLUDE_BODIES = os.getenv("LOG_INCLUDE_BODIES", "false").lower() == "true"
+
+REQUEST_ID_HEADER = "X-Request-Id"
+# Extra fields that carry user content or secrets
+REDACTED_FIELDS = frozenset({"user_message", "reply", "prompt", "response", "password", "token", "access_token"})
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+# Attributes every LogRecord has; anything else was passed through extra=
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id"}
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+DROPPED = REGISTRY.counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+
+def parse_level(name: str) -> int:
+    """Level for a name such as "warning" or "DEBUG"; INFO for unknown names"""
+    level = logging.getLevelName(name.strip().upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        event, _, rate = part.partition("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Stamp records with the current request id and drop sampled-out events"""
+
+    def __init__(self, sample_rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.sample_rates.get(record.msg) if isinstance(record.msg, str) else None
+        if rate is not None and record.levelno < logging.WARNING and random.random() >= rate:
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge args here; JSON encoding happens on the writer thread
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with extra= fields inlined and bodies redacted"""
+
+    def __init__(self, include_bodies: bool = LOG_INCLUDE_BODIES):
+        super().__init__()
+        self.include_bodies = include_bodies
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key in _STANDARD_ATTRS:
+                continue
+            if key in REDACTED_FIELDS and not self.include_bodies:
+                value = f"[redacted {len(str(value))} chars]"
+            entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(level: str = LOG_LEVEL, stream=None) -> None:
+    """
+    Route every logger through a bounded queue to a JSON writer thread.
+
+    Call once at startup, and stop_logging() at shutdown to flush.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    records: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonFormatter())
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(ContextFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(parse_level(level))
+    _listener = logging.handlers.QueueListener(records, writer, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """Reuse a well-formed id from the caller (e.g. a proxy), otherwise make one"""
+    if incoming and _REQUEST_ID_PATTERN.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware giving every request an id and one access log record.
+
+    The id is taken from X-Request-Id when present, stored in a contextvar
+    so every record logged while handling the request carries it, and echoed
+    back in the response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("http")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                incoming = value.decode("latin-1")
+                break
+        request_id = new_request_id(incoming)
+        token = request_id_var.set(request_id)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.lower().encode(), request_id.encode())
+                ]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            level = logging.WARNING if status >= 500 else logging.INFO
+            self.logger.log(level, "http.request", extra={
+                "method": scope["method"],
+                "route": route_template(scope),
+                "status": status,
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+            })
+            request_id_var.reset(token)
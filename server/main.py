@@ -1,15 +1,33 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import google.generativeai as genai
+from typing import Optional
+import logging
 import os
 from dotenv import load_dotenv
 from pathlib import Path
 
-# Load environment variables
+# Load environment variables before importing modules that read them
 env_path = Path('.') / '.env'
 load_dotenv(dotenv_path=env_path)
 
+from logs import RequestContextMiddleware, configure_logging, stop_logging
+
+# JSON logs through a background writer; set up before other modules log anything
+configure_logging()
+logger = logging.getLogger("main")
+
+import llm
+import jobs
+from database import get_db
+from dedup import duplicates
+import sla
+import notifications
+import ticket_feed
+from streaming import sse_response, text_chunks
+from metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware
+
 app = FastAPI()
 
 # Configure CORS
@@ -19,20 +37,52 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Session-Id", "X-Request-Id"],
 )
 
+# Request count and latency per route, exposed on /metrics
+app.add_middleware(MetricsMiddleware)
+# Outermost, so the request id is set for everything below it
+app.add_middleware(RequestContextMiddleware)
+
 # Get API key
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY not found")
 
 # Configure Gemini
-genai.configure(api_key=GEMINI_API_KEY)
+llm.configure(GEMINI_API_KEY)
+
+# Shared async client - model objects are built once and calls are routed between them
+logger.info("Using models %s", ", ".join(llm.client.router.models))
 
-# Initialize model - TRY EACH ONE UNTIL IT WORKS
-model = genai.GenerativeModel('gemini-2.5-flash')  # Try this first
+# Routers are imported after Gemini is configured
+from routers import api, chats
 
-print(f"✓ Using model: gemini-2.5-flash")
+app.include_router(api.router, prefix="/api/v1")
+app.include_router(chats.router)
+
+@app.on_event("startup")
+async def start_workers():
+    await jobs.pool.start()
+    if duplicates:
+        await duplicates.warm(get_db())
+    if sla.scheduler:
+        await sla.scheduler.start(get_db())
+    if notifications.dispatcher:
+        await notifications.dispatcher.start(get_db())
+    await ticket_feed.hub.start(get_db())
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await jobs.pool.stop()
+    if sla.scheduler:
+        await sla.scheduler.stop()
+    if notifications.dispatcher:
+        await notifications.dispatcher.stop()
+    await ticket_feed.hub.stop()
+    get_db().close()
+    stop_logging()
 
 # Models
 class ChatRequest(BaseModel):
@@ -40,26 +90,50 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     response: str
+    intent: Optional[str] = None
+    confidence: Optional[float] = None
 
 @app.get("/")
 async def root():
     return {"message": "Gemini Chatbot API is running", "status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint for this worker"""
+    return PlainTextResponse(await REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.post("/api/v1/chatbot", response_model=ChatResponse)
-async def chatbot(request: ChatRequest):
+async def chatbot(request: ChatRequest, http_request: Request):
     try:
-        print(f"Received message: {request.message}")
+        logger.info("chatbot.request", extra={"user_message": request.message})
         
-        response = model.generate_content(request.message)
-        bot_response = response.text
+        reply, intent = chats.local_reply(request.message)
+        if reply:
+            return ChatResponse(response=reply, intent=intent.category.value, confidence=intent.confidence)
         
-        print(f"Bot response: {bot_response}")
-        return ChatResponse(response=bot_response)
+        bot_response = await llm.cancel_on_disconnect(
+            http_request, llm.client.generate(request.message)
+        )
         
+        logger.info("chatbot.reply", extra={"reply": bot_response})
+        return ChatResponse(response=bot_response, intent=intent.category.value, confidence=intent.confidence)
+        
+    except llm.ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except llm.LLMTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception("chatbot.error")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/v1/chatbot/stream")
+async def chatbot_stream(request: ChatRequest, http_request: Request):
+    """Stream the reply as Server-Sent Events while the model generates it"""
+    reply, _ = chats.local_reply(request.message)
+    if reply:
+        return sse_response(http_request, text_chunks(reply))
+    return sse_response(http_request, llm.client.stream(request.message))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
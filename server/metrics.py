@@ -0,0 +1,320 @@
+import bisect
+import functools
+import inspect
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers cache hits (sub-millisecond) up to slow LLM replies
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values) -> object:
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        # Counts are per bucket here and made cumulative when rendered
+        index = bisect.bisect_left(self.bounds, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _render_child(self, values: Tuple[str, ...], child: _Buckets) -> List[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(child.bounds, child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values, 'le="+Inf"')
+        lines.append(f"{self.name}_bucket{labels} {child.count}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """
+    Process-local metric registry rendered in the Prometheus text format.
+
+    Metrics are updated from the event loop without locks, so recording a
+    sample is a dict lookup and an addition. Values that are cheaper to read
+    on demand (queue depth, cache counters kept elsewhere) are refreshed by
+    collectors that run on each scrape. Every worker process exposes its own
+    numbers; Prometheus aggregates across them.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Awaitable[None]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, fn: Callable[[], Awaitable[None]]) -> Callable[[], Awaitable[None]]:
+        """Register an async function that refreshes gauges before each scrape"""
+        self._collectors.append(fn)
+        return fn
+
+    async def render(self) -> str:
+        for collect in self._collectors:
+            try:
+                await collect()
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", collect.__name__, e)
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by route template, method and status", ("method", "route", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to send the full response, streaming included", ("method", "route"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "Requests being handled by this worker")
+
+DB_LATENCY = REGISTRY.histogram(
+    "db_query_duration_seconds", "Database method latency, including pool wait", ("method",))
+DB_ERRORS = REGISTRY.counter("db_query_errors_total", "Database method calls that raised", ("method",))
+
+LLM_LATENCY = REGISTRY.histogram(
+    "llm_request_duration_seconds", "Upstream model call latency; streams until the last chunk", ("model", "mode"))
+LLM_FIRST_CHUNK = REGISTRY.histogram(
+    "llm_stream_first_chunk_seconds", "Time to the first streamed chunk", ("model",))
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "Tokens reported by the model, by direction (prompt or completion)", ("model", "direction"))
+LLM_ERRORS = REGISTRY.counter("llm_errors_total", "Failed upstream model calls", ("model", "kind"))
+LLM_COALESCED = REGISTRY.counter(
+    "llm_coalesced_calls_total", "Calls that shared an in-flight identical prompt instead of calling upstream")
+LLM_HEDGES = REGISTRY.counter("llm_hedged_calls_total", "Hedge requests sent because a model was slow", ("model",))
+LLM_FAILOVERS = REGISTRY.counter("llm_failovers_total", "Calls moved to another model after a failure", ("from_model",))
+LLM_MODEL_LATENCY = REGISTRY.gauge(
+    "llm_model_latency_smoothed_seconds", "Moving average of successful call latency per model", ("model",))
+LLM_MODEL_ERROR_RATE = REGISTRY.gauge("llm_model_error_rate", "Moving average of the error rate per model", ("model",))
+
+TICKET_DUPLICATES = REGISTRY.counter(
+    "tickets_linked_to_incident_total", "New tickets detected as near-duplicates and linked to a parent ticket")
+
+SLA_BREACHES = REGISTRY.counter("sla_breaches_total", "Tickets that passed their SLA due date", ("priority",))
+SLA_TRACKED = REGISTRY.gauge("sla_tracked_tickets", "Open tickets scheduled for an SLA breach in this worker")
+
+NOTIFICATIONS_SENT = REGISTRY.counter(
+    "notifications_sent_total", "Notifications handed to a channel, by outcome (sent, failed)", ("channel", "outcome"))
+NOTIFICATION_SEND_LATENCY = REGISTRY.histogram(
+    "notification_batch_send_seconds", "Time to send one batch of notifications", ("channel",))
+NOTIFICATION_DEAD_LETTERS = REGISTRY.counter(
+    "notification_dead_letters_total", "Outbox events given up on after their last attempt")
+
+REALTIME_SUBSCRIBERS = REGISTRY.gauge("realtime_subscribers", "Open WebSocket and SSE ticket feeds in this worker")
+REALTIME_EVENTS = REGISTRY.counter("realtime_events_published_total", "Ticket changes published to feeds", ("type",))
+REALTIME_DROPPED = REGISTRY.counter(
+    "realtime_slow_consumers_total", "Feeds that fell behind, by action taken (resync, disconnected)", ("action",))
+
+CACHE_REQUESTS = REGISTRY.counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit, semantic_hit, miss)", ("cache", "result"))
+
+JOB_QUEUE_DEPTH = REGISTRY.gauge("workflow_queue_depth", "Workflow jobs waiting for a worker")
+JOB_RUNS = REGISTRY.counter("workflow_job_runs_total", "Workflow job attempts by outcome", ("workflow", "outcome"))
+JOB_LATENCY = REGISTRY.histogram("workflow_job_duration_seconds", "Workflow handler run time", ("workflow",))
+
+
+def instrument_methods(exclude: Sequence[str] = ()) -> Callable[[type], type]:
+    """
+    Class decorator timing every public coroutine method of the class.
+
+    Used on the Database implementations so each method gets its own
+    db_query_duration_seconds series.
+    """
+    def decorator(cls: type) -> type:
+        for name, fn in list(vars(cls).items()):
+            if name.startswith("_") or name in exclude or not inspect.iscoroutinefunction(fn):
+                continue
+            setattr(cls, name, _timed(name, fn))
+        return cls
+    return decorator
+
+
+def _timed(name: str, fn: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    latency, errors = DB_LATENCY.labels(name), DB_ERRORS.labels(name)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - start)
+    return wrapper
+
+
+def route_template(scope) -> str:
+    """Path template of the route that matched, e.g. /api/v1/ticket/{ticket_id}"""
+    template = getattr(scope.get("route"), "path", None)
+    if template is None:
+        return "unmatched"
+    # Newer FastAPI reports a nested router's route without its include
+    # prefixes; those are literal, so take them from the request path
+    segments = scope["path"].split("/")
+    return "/".join(segments[:len(segments) - template.count("/")]) + template
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request count and latency per route template.
+
+    Labels use the matched route's path (/api/v1/ticket/{ticket_id}), not
+    the raw URL, so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        HTTP_IN_FLIGHT.labels().inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.labels().dec()
+            template = route_template(scope)
+            HTTP_LATENCY.labels(scope["method"], template).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(scope["method"], template, status).inc()
@@ -0,0 +1,15 @@
+-- Ticket counts for the dashboard in a single scan.
+-- One row per (status), (priority) and (category) group; the unused
+-- dimensions are NULL. Called through Database.get_ticket_counts().
+
+create or replace function ticket_statistics()
+returns table (status text, priority text, category text, ticket_count bigint)
+language sql
+stable
+as $$
+    select status::text, priority::text, category::text, count(*)
+    from tickets
+    group by grouping sets ((status), (priority), (category));
+$$;
+
+grant execute on function ticket_statistics() to anon, authenticated, service_role;
@@ -0,0 +1,5 @@
+-- Index backing keyset pagination on (created_at, id), newest first.
+-- Database._paginate seeks with created_at < x OR (created_at = x AND id < y).
+
+create index if not exists tickets_created_at_id_idx
+    on tickets (created_at desc, id desc);
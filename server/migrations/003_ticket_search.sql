@@ -0,0 +1,53 @@
+-- Full-text and trigram search over tickets, replacing ILIKE scans.
+-- Database.search_tickets calls search_ticket_ids() and then fetches the
+-- projected columns for the returned ids.
+
+create extension if not exists pg_trgm;
+
+alter table tickets
+    add column if not exists search_vector tsvector
+    generated always as (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) stored;
+
+create index if not exists tickets_search_vector_idx on tickets using gin (search_vector);
+create index if not exists tickets_title_trgm_idx on tickets using gin (title gin_trgm_ops);
+
+-- prefix_query is a sanitised tsquery such as 'vpn:* & reset:*' (see search.to_prefix_tsquery).
+-- Results are ordered by (rank, id) descending; pass the last pair back as
+-- after_rank/after_id for the next page.
+create or replace function search_ticket_ids(
+    search_query text,
+    prefix_query text,
+    filter_status text default null,
+    filter_priority text default null,
+    result_limit int default 50,
+    result_offset int default 0,
+    after_rank real default null,
+    after_id text default null
+)
+returns table (id text, rank real)
+language sql
+stable
+as $$
+    with matches as (
+        select
+            t.id::text as id,
+            (ts_rank_cd(t.search_vector, to_tsquery('english', prefix_query))
+                + 0.5 * similarity(t.title, search_query))::real as rank
+        from tickets t
+        where (t.search_vector @@ to_tsquery('english', prefix_query) or t.title % search_query)
+          and (filter_status is null or t.status::text = filter_status)
+          and (filter_priority is null or t.priority::text = filter_priority)
+    )
+    select m.id, m.rank
+    from matches m
+    where after_rank is null or (m.rank, m.id) < (after_rank, after_id)
+    order by m.rank desc, m.id desc
+    limit result_limit
+    offset result_offset;
+$$;
+
+grant execute on function search_ticket_ids(text, text, text, text, int, int, real, text)
+    to anon, authenticated, service_role;
@@ -0,0 +1,7 @@
+-- Idempotency keys for POST /ticket/bulk so retried syncs do not duplicate tickets.
+-- NULL keys never conflict, so tickets created without a key are unaffected.
+
+alter table tickets add column if not exists idempotency_key text;
+
+create unique index if not exists tickets_idempotency_key_idx
+    on tickets (idempotency_key);
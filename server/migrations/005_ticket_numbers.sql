@@ -0,0 +1,26 @@
+-- Per-day ticket number sequences, handed out to API workers in blocks.
+-- Called through Database.reserve_ticket_numbers(); see ticket_numbers.py.
+
+create table if not exists ticket_number_sequences (
+    day text primary key,
+    last_value bigint not null
+);
+
+-- Reserves block_size numbers for sequence_day and returns the first one.
+-- The upsert takes a row lock, so concurrent callers get disjoint blocks.
+create or replace function reserve_ticket_numbers(sequence_day text, block_size integer)
+returns bigint
+language sql
+volatile
+as $$
+    insert into ticket_number_sequences as s (day, last_value)
+    values (sequence_day, block_size)
+    on conflict (day) do update set last_value = s.last_value + excluded.last_value
+    returning last_value - block_size + 1;
+$$;
+
+grant execute on function reserve_ticket_numbers(text, integer) to anon, authenticated, service_role;
+
+-- get_ticket_by_number lookups, and a hard guarantee against duplicates
+create unique index if not exists tickets_ticket_number_idx
+    on tickets (ticket_number);
@@ -0,0 +1,9 @@
+-- Near-duplicate tickets point at the first ticket of their incident; see dedup.py.
+-- NULL for tickets that are not part of a larger incident.
+
+alter table tickets add column if not exists parent_ticket_number text;
+
+-- Listing the duplicates of an incident: GET /ticket/?parent_ticket_number=
+create index if not exists tickets_parent_ticket_number_idx
+    on tickets (parent_ticket_number)
+    where parent_ticket_number is not null;
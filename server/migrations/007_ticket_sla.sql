@@ -0,0 +1,8 @@
+-- SLA breaches, set once by the scheduler in sla.py when sla_due_date passes.
+-- Tickets with a breach recorded are not rescheduled when a worker restarts.
+
+alter table tickets add column if not exists sla_breached_at timestamptz;
+
+-- Startup rebuild: open and in-progress tickets, newest first, a page at a time
+create index if not exists tickets_status_recency_idx
+    on tickets (status, created_at desc, id desc);
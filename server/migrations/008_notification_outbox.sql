@@ -0,0 +1,119 @@
+-- Transactional outbox for ticket notifications.
+-- The trigger records status changes, assignments, SLA breaches and
+-- resolutions in the same transaction as the ticket write, mirroring
+-- notifications.ticket_events(); the dispatcher in notifications.py claims,
+-- coalesces and sends them.
+
+create table if not exists notification_outbox (
+    id bigserial primary key,
+    ticket_id uuid not null,
+    event text not null,
+    payload jsonb not null,
+    status text not null default 'pending',
+    attempts integer not null default 0,
+    available_at timestamptz not null default now(),
+    locked_until timestamptz,
+    last_error text,
+    created_at timestamptz not null default now()
+);
+
+-- Claims scan pending events in due order; dead letters are listed newest first
+create index if not exists notification_outbox_due_idx
+    on notification_outbox (available_at, id) where status = 'pending';
+create index if not exists notification_outbox_status_idx
+    on notification_outbox (status, id desc);
+
+create or replace function record_ticket_events()
+returns trigger
+language plpgsql
+as $$
+declare
+    snapshot jsonb := jsonb_build_object(
+        'id', new.id, 'ticket_number', new.ticket_number, 'title', new.title,
+        'status', new.status, 'priority', new.priority,
+        'requester_name', new.requester_name, 'requester_email', new.requester_email,
+        'contact_number', new.contact_number, 'assigned_to', new.assigned_to,
+        'assigned_team', new.assigned_team, 'resolution_notes', new.resolution_notes,
+        'sla_due_date', new.sla_due_date
+    );
+    old_status text := case when tg_op = 'UPDATE' then old.status::text end;
+    old_assignee text := case when tg_op = 'UPDATE' then old.assigned_to end;
+    old_breach timestamptz := case when tg_op = 'UPDATE' then old.sla_breached_at end;
+begin
+    if tg_op = 'UPDATE' and new.status::text is distinct from old_status then
+        insert into notification_outbox (ticket_id, event, payload) values (
+            new.id,
+            case when new.status::text in ('resolved', 'closed')
+                      and old_status not in ('resolved', 'closed')
+                 then 'resolution' else 'status_change' end,
+            jsonb_build_object('ticket', snapshot, 'from', old_status, 'to', new.status::text)
+        );
+    end if;
+    if new.assigned_to is not null and new.assigned_to is distinct from old_assignee then
+        insert into notification_outbox (ticket_id, event, payload) values (
+            new.id, 'assignment',
+            jsonb_build_object('ticket', snapshot, 'from', old_assignee, 'to', new.assigned_to)
+        );
+    end if;
+    if new.sla_breached_at is not null and old_breach is null then
+        insert into notification_outbox (ticket_id, event, payload) values (
+            new.id, 'sla_breach',
+            jsonb_build_object('ticket', snapshot, 'breached_at', new.sla_breached_at)
+        );
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists tickets_record_events on tickets;
+create trigger tickets_record_events
+    after insert or update on tickets
+    for each row execute function record_ticket_events();
+
+-- Leases up to batch_size pending events that have waited min_age_seconds.
+-- skip locked lets every API worker claim from the outbox at once.
+create or replace function claim_notification_events(batch_size integer, lease_seconds double precision,
+                                                     min_age_seconds double precision)
+returns setof notification_outbox
+language sql
+volatile
+as $$
+    update notification_outbox o
+    set locked_until = now() + make_interval(secs => lease_seconds)
+    where o.id in (
+        select id from notification_outbox
+        where status = 'pending'
+          and available_at <= now() - make_interval(secs => min_age_seconds)
+          and (locked_until is null or locked_until < now())
+        order by available_at, id
+        limit batch_size
+        for update skip locked
+    )
+    returning o.*;
+$$;
+
+-- Schedules failed events for another attempt with exponential backoff,
+-- dead-lettering those out of attempts. Returns the number dead-lettered.
+create or replace function fail_notification_events(event_ids bigint[], error text,
+                                                    backoff_seconds double precision, max_attempts integer)
+returns integer
+language sql
+volatile
+as $$
+    with failed as (
+        update notification_outbox
+        set attempts = attempts + 1,
+            status = case when attempts + 1 >= max_attempts then 'dead' else 'pending' end,
+            available_at = now() + make_interval(secs => backoff_seconds * power(2, attempts)),
+            locked_until = null,
+            last_error = error
+        where id = any(event_ids)
+        returning status
+    )
+    select count(*)::integer from failed where status = 'dead';
+$$;
+
+grant execute on function claim_notification_events(integer, double precision, double precision)
+    to anon, authenticated, service_role;
+grant execute on function fail_notification_events(bigint[], text, double precision, integer)
+    to anon, authenticated, service_role;
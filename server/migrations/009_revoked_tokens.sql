@@ -0,0 +1,13 @@
+-- Access tokens revoked by logout, checked by every API worker until the
+-- token would have expired anyway. Written and read through
+-- Database.revoke_token() / is_token_revoked(); see tokens.py. token_id is
+-- the verified token's jti, or a hash of the token when it has none.
+
+create table if not exists revoked_tokens (
+    token_id text primary key,
+    expires_at timestamptz not null
+);
+
+-- Lapsed entries are deleted by expiry on each revocation
+create index if not exists revoked_tokens_expires_at_idx
+    on revoked_tokens (expires_at);
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from metrics import LLM_FAILOVERS, LLM_HEDGES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Cheaper, faster model for short requests; empty to send everything to the default model
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gemini-2.5-flash-lite")
+# Tried in order when the preferred model fails or is degraded
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "gemini-2.0-flash").split(",") if m.strip()]
+# Request kinds whose short prompts go to the fast model
+LLM_FAST_KINDS = frozenset(k.strip() for k in os.getenv("LLM_FAST_KINDS", "chat").split(",") if k.strip())
+LLM_SHORT_PROMPT_CHARS = int(os.getenv("LLM_SHORT_PROMPT_CHARS", "600"))
+# Send a second request to the next model when the first is slower than usual
+LLM_HEDGE = os.getenv("LLM_HEDGE", "on") != "off"
+# The hedge goes out once a call is slower than usual for its model, within these bounds
+LLM_HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "1"))
+LLM_HEDGE_MAX_SECONDS = float(os.getenv("LLM_HEDGE_MAX_SECONDS", "8"))
+# Long-run fraction of calls that may be hedged, so a slow model cannot double the load
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+# A model whose smoothed error rate crosses this, or whose latency grows past
+# LLM_MODEL_SLOW_RATIO times its own baseline, is skipped for a cooldown. A
+# model that many times slower than the next one in its route is tried after it.
+LLM_MODEL_ERROR_THRESHOLD = float(os.getenv("LLM_MODEL_ERROR_THRESHOLD", "0.5"))
+LLM_MODEL_SLOW_RATIO = float(os.getenv("LLM_MODEL_SLOW_RATIO", "2"))
+# Also how long latency figures are trusted without new calls
+LLM_MODEL_COOLDOWN_SECONDS = float(os.getenv("LLM_MODEL_COOLDOWN_SECONDS", "30"))
+
+# Calls needed before a model can be judged degraded
+MIN_CALLS = 5
+# Unused hedges saved up for a burst of slow calls
+MAX_HEDGE_CREDIT = 10.0
+
+
+class ModelHealth:
+    """
+    Rolling latency and error rate of one model.
+
+    Latency is tracked like TCP's round-trip estimate: a fast moving average
+    and mean deviation, with average + 4 * deviation as the point past which
+    a call counts as slow. A slow moving average is kept as the baseline
+    that "degraded" is measured against.
+    """
+
+    __slots__ = ("latency", "deviation", "baseline", "error_rate", "calls", "cooldown_until", "reason",
+                 "measured_at")
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.deviation = 0.0
+        self.baseline: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.cooldown_until = 0.0
+        self.reason: Optional[str] = None
+        self.measured_at = 0.0
+
+    def record(self, seconds: Optional[float], ok: bool) -> None:
+        self.calls += 1
+        self.error_rate += 0.1 * ((0.0 if ok else 1.0) - self.error_rate)
+        if seconds is None:
+            return
+        self.measured_at = time.monotonic()
+        if self.latency is None:
+            self.latency, self.deviation, self.baseline = seconds, seconds / 2, seconds
+            return
+        self.deviation += 0.25 * (abs(seconds - self.latency) - self.deviation)
+        self.latency += 0.125 * (seconds - self.latency)
+        self.baseline += (seconds - self.baseline) / 64
+
+    @property
+    def slow_after(self) -> Optional[float]:
+        return None if self.latency is None else self.latency + 4 * self.deviation
+
+    def recent_latency(self, now: float, max_age: float) -> Optional[float]:
+        """Smoothed latency, or None when it is unknown or too old to go by"""
+        return self.latency if now - self.measured_at <= max_age else None
+
+    def degraded(self) -> Optional[str]:
+        """Why this model should be skipped for a while, or None"""
+        if self.calls < MIN_CALLS:
+            return None
+        if self.error_rate >= LLM_MODEL_ERROR_THRESHOLD:
+            return "errors"
+        if self.baseline and self.latency > LLM_MODEL_SLOW_RATIO * self.baseline:
+            return "latency"
+        return None
+
+    def usable(self, now: float) -> bool:
+        """False during a cooldown; ends an expired one"""
+        if self.reason is None:
+            return True
+        if now < self.cooldown_until:
+            return False
+        # Give it a fresh chance: the next few calls decide whether it recovered
+        self.reason = None
+        self.error_rate = min(self.error_rate, LLM_MODEL_ERROR_THRESHOLD / 2)
+        self.latency = self.baseline
+        return True
+
+
+class ModelRouter:
+    """
+    Picks the model for each call and fails over or hedges between models.
+
+    route() maps a request kind and prompt length to an ordered list of
+    models: short chat prompts prefer the fast model, everything else the
+    default one, with the fallbacks after them. call() tries that list in
+    order of health, moving a model that is erroring or much slower than its
+    own baseline to the back for a cooldown. When the first model fails the
+    next one is tried straight away; when it is merely slower than usual a
+    hedge request goes to the next model and whichever answers first wins.
+    Hedges draw on a budget refilled by every call, so at most
+    LLM_HEDGE_BUDGET of calls are duplicated over time.
+    """
+
+    def __init__(self, default_model: str, fast_model: str = LLM_FAST_MODEL,
+                 fallbacks: Sequence[str] = LLM_FALLBACK_MODELS,
+                 fast_kinds: Sequence[str] = LLM_FAST_KINDS,
+                 short_prompt_chars: int = LLM_SHORT_PROMPT_CHARS,
+                 hedge: bool = LLM_HEDGE, hedge_budget: float = LLM_HEDGE_BUDGET,
+                 cooldown: float = LLM_MODEL_COOLDOWN_SECONDS):
+        self.default_model = default_model
+        self.fast_model = fast_model
+        self.fallbacks = list(fallbacks)
+        self.fast_kinds = frozenset(fast_kinds)
+        self.short_prompt_chars = short_prompt_chars
+        self.hedge = hedge
+        self.hedge_budget = hedge_budget
+        self.cooldown = cooldown
+        self._health: Dict[str, ModelHealth] = {}
+        self._hedge_credit = MAX_HEDGE_CREDIT
+
+    @property
+    def models(self) -> List[str]:
+        return _unique([self.default_model, self.fast_model, *self.fallbacks])
+
+    def route(self, kind: str, prompt: str) -> List[str]:
+        """Models to try for this request, preferred first"""
+        if self.fast_model and kind in self.fast_kinds and len(prompt) <= self.short_prompt_chars:
+            return _unique([self.fast_model, self.default_model, *self.fallbacks])
+        return _unique([self.default_model, *self.fallbacks, self.fast_model])
+
+    def health(self, model: str) -> ModelHealth:
+        health = self._health.get(model)
+        if health is None:
+            health = self._health[model] = ModelHealth()
+        return health
+
+    def order(self, models: Sequence[str]) -> List[str]:
+        """
+        models in the order to try them.
+
+        Those in a cooldown go to the back, and a model much slower than the
+        one after it swaps places with it, so a model that was slow from the
+        start loses its preference as soon as the fallback has been measured.
+        """
+        now = time.monotonic()
+        usable = [m for m in models if self.health(m).usable(now)]
+        for i in range(len(usable) - 1):
+            current = self.health(usable[i]).recent_latency(now, self.cooldown)
+            following = self.health(usable[i + 1]).recent_latency(now, self.cooldown)
+            if current is not None and following is not None and current > LLM_MODEL_SLOW_RATIO * following:
+                usable[i], usable[i + 1] = usable[i + 1], usable[i]
+        return usable + [m for m in models if m not in usable]
+
+    def record(self, model: str, seconds: Optional[float], ok: bool) -> None:
+        health = self.health(model)
+        health.record(seconds, ok)
+        reason = health.degraded() if health.reason is None else None
+        if reason:
+            health.reason = reason
+            health.cooldown_until = time.monotonic() + self.cooldown
+            logger.warning("llm.model_degraded", extra={
+                "model": model, "reason": reason, "error_rate": round(health.error_rate, 3),
+                "latency_s": round(health.latency or 0, 3), "baseline_s": round(health.baseline or 0, 3),
+            })
+
+    def _hedge_delay(self, model: str, started: float) -> Optional[float]:
+        if not self.hedge or self._hedge_credit < 1:
+            return None
+        slow_after = self.health(model).slow_after or LLM_HEDGE_MAX_SECONDS
+        hedge_at = started + min(max(slow_after, LLM_HEDGE_MIN_SECONDS), LLM_HEDGE_MAX_SECONDS)
+        return max(0.0, hedge_at - time.monotonic())
+
+    async def call(self, models: Sequence[str], attempt: Callable[[str], Awaitable[T]]) -> T:
+        """Return the first successful attempt(model), failing over and hedging down models"""
+        order = self.order(models)
+        self._hedge_credit = min(MAX_HEDGE_CREDIT, self._hedge_credit + self.hedge_budget)
+        pending: Dict["asyncio.Future[T]", Tuple[str, float]] = {}
+        untried = list(order)
+        last_error: Optional[BaseException] = None
+
+        def launch() -> str:
+            model = untried.pop(0)
+            pending[asyncio.ensure_future(attempt(model))] = (model, time.monotonic())
+            return model
+
+        launch()
+        won = False
+        try:
+            while pending:
+                timeout = None
+                if len(pending) == 1 and untried:
+                    (model, started), = pending.values()
+                    timeout = self._hedge_delay(model, started)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self._hedge_credit -= 1
+                    LLM_HEDGES.labels(launch()).inc()
+                    continue
+                for task in done:
+                    model, started = pending.pop(task)
+                    if task.cancelled() or task.exception() is not None:
+                        # Failures say nothing about how fast the model answers
+                        self.record(model, None, ok=False)
+                        last_error = asyncio.CancelledError() if task.cancelled() else task.exception()
+                        continue
+                    self.record(model, time.monotonic() - started, ok=True)
+                    won = True
+                    return task.result()
+                if not pending and untried:
+                    LLM_FAILOVERS.labels(model).inc()
+                    launch()
+            raise last_error
+        finally:
+            now = time.monotonic()
+            for task, (model, started) in pending.items():
+                task.cancel()
+                if won:
+                    # It lost a hedge race, so it took at least this long
+                    self.record(model, now - started, ok=True)
+
+    def stats(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        return {
+            model: {
+                "latency_s": round(health.latency, 4) if health.latency is not None else None,
+                "baseline_s": round(health.baseline, 4) if health.baseline is not None else None,
+                "error_rate": round(health.error_rate, 4),
+                "calls": health.calls,
+                "cooling_down": health.reason if now < health.cooldown_until else None,
+            }
+            for model, health in self._health.items()
+        }
+
+
+def _unique(models: Sequence[str]) -> List[str]:
+    return list(dict.fromkeys(m for m in models if m))
@@ -1,23 +1,55 @@
 from .pydantic.ticket import (
     TicketCreate,
+    BulkTicketItem,
+    BulkItemStatus,
+    BulkItemResult,
+    BulkTicketResponse,
     TicketUpdate,
     TicketResponse,
+    TicketListItem,
+    TICKET_LIST_FIELDS,
     TicketSummary,
     TicketStatus,
     TicketPriority,
     TicketSource,
     TicketCategory,
-    NotificationConfig
+    NotificationConfig,
+    NotificationEvent,
+    RequeueRequest,
+    RequeueResponse
+)
+from .pydantic.classification import IntentClassification
+from .pydantic.knowledge import KnowledgeArticleMatch
+from .pydantic.workflow import (
+    WorkflowStatus,
+    WorkflowTrigger,
+    WorkflowJob,
+    WorkflowAccepted
 )
 
 __all__ = [
     "TicketCreate",
-    "TicketUpdate", 
+    "BulkTicketItem",
+    "BulkItemStatus",
+    "BulkItemResult",
+    "BulkTicketResponse",
+    "TicketUpdate",
     "TicketResponse",
+    "TicketListItem",
+    "TICKET_LIST_FIELDS",
     "TicketSummary",
     "TicketStatus",
     "TicketPriority",
     "TicketSource", 
     "TicketCategory",
-    "NotificationConfig"
+    "NotificationConfig",
+    "NotificationEvent",
+    "RequeueRequest",
+    "RequeueResponse",
+    "IntentClassification",
+    "KnowledgeArticleMatch",
+    "WorkflowStatus",
+    "WorkflowTrigger",
+    "WorkflowJob",
+    "WorkflowAccepted"
 ]
@@ -0,0 +1,10 @@
+from pydantic import BaseModel, Field
+from typing import Dict
+
+from .ticket import TicketCategory
+
+class IntentClassification(BaseModel):
+    category: TicketCategory
+    confidence: float = Field(..., ge=0, le=1, description="Probability of category under the local model")
+    confident: bool = Field(..., description="Whether confidence clears the threshold, so no LLM is needed")
+    scores: Dict[str, float] = Field(default_factory=dict)
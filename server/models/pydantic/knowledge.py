@@ -0,0 +1,7 @@
+from pydantic import BaseModel, Field
+
+class KnowledgeArticleMatch(BaseModel):
+    id: str = Field(..., description="Path of the article under the knowledge base directory, without extension")
+    title: str
+    score: float = Field(..., description="Cosine similarity between the query and the article")
+    summary: str = Field("", description="Opening paragraphs of the article, used as a self-service answer")
@@ -51,14 +51,42 @@ class TicketCreate(TicketBase):
     department: Optional[str] = None
     contact_number: Optional[str] = None
     related_assets: Optional[List[str]] = None
+    chat_session_id: Optional[str] = Field(None, description="Chat session whose conversation is attached as chat_history")
+
+class BulkTicketItem(TicketCreate):
+    idempotency_key: Optional[str] = Field(None, max_length=200, description="Retries with the same key return the original ticket")
+
+class BulkItemStatus(str, Enum):
+    CREATED = "created"
+    DUPLICATE = "duplicate"
+    INVALID = "invalid"
+    FAILED = "failed"
+
+class BulkItemResult(BaseModel):
+    index: int
+    status: BulkItemStatus
+    id: Optional[str] = None
+    ticket_number: Optional[str] = None
+    parent_ticket_number: Optional[str] = None
+    errors: List[str] = Field(default_factory=list)
+
+class BulkTicketResponse(BaseModel):
+    created: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    failed: int = 0
+    results: List[BulkItemResult] = Field(default_factory=list)
 
 class TicketUpdate(BaseModel):
     status: Optional[TicketStatus] = None
     priority: Optional[TicketPriority] = None
+    category: Optional[TicketCategory] = Field(None, description="Set or confirmed by an agent; trains the classifier")
     assigned_team: Optional[str] = None
     assigned_to: Optional[str] = None
     resolution_notes: Optional[str] = None
     tags: Optional[List[str]] = None
+    is_self_service_resolved: Optional[bool] = None
+    parent_ticket_number: Optional[str] = Field(None, description="Link to a parent incident; null unlinks")
 
 class TicketInDB(TicketBase):
     id: str
@@ -74,14 +102,41 @@ class TicketInDB(TicketBase):
     updated_at: datetime
     resolved_at: Optional[datetime] = None
     sla_due_date: Optional[datetime] = None
+    sla_breached_at: Optional[datetime] = None
     ai_classification_confidence: Optional[float] = None
     suggested_knowledge_base_articles: List[str] = Field(default_factory=list)
     is_self_service_resolved: bool = False
     chat_history: Optional[List[Dict[str, Any]]] = Field(default_factory=list)
+    parent_ticket_number: Optional[str] = Field(None, description="First ticket of the incident this one duplicates")
 
 class TicketResponse(TicketInDB):
     pass
 
+class TicketListItem(BaseModel):
+    """Compact ticket for list and search views; only selected fields are set"""
+    id: Optional[str] = None
+    ticket_number: Optional[str] = None
+    title: Optional[str] = None
+    status: Optional[TicketStatus] = None
+    priority: Optional[TicketPriority] = None
+    category: Optional[TicketCategory] = None
+    source: Optional[TicketSource] = None
+    assigned_team: Optional[str] = None
+    assigned_to: Optional[str] = None
+    requester_name: Optional[str] = None
+    department: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    sla_due_date: Optional[datetime] = None
+    parent_ticket_number: Optional[str] = None
+    search_rank: Optional[float] = None
+
+# Columns selected for list views when the client does not pass fields=
+TICKET_LIST_FIELDS = (
+    "id", "ticket_number", "title", "status", "priority", "category",
+    "assigned_team", "assigned_to", "created_at", "updated_at",
+)
+
 class TicketSummary(BaseModel):
     total_tickets: int
     open_tickets: int
@@ -89,6 +144,9 @@ class TicketSummary(BaseModel):
     resolved_tickets: int
     high_priority_tickets: int
     critical_tickets: int
+    by_status: Dict[str, int] = Field(default_factory=dict)
+    by_priority: Dict[str, int] = Field(default_factory=dict)
+    by_category: Dict[str, int] = Field(default_factory=dict)
 
 class NotificationConfig(BaseModel):
     email_alerts: bool = True
@@ -97,3 +155,20 @@ class NotificationConfig(BaseModel):
     notify_on_assignment: bool = True
     notify_on_sla_breach: bool = True
     notify_on_resolution: bool = True
+
+class NotificationEvent(BaseModel):
+    """A ticket change recorded in the notification outbox"""
+    id: int
+    ticket_id: str
+    event: str = Field(..., description="status_change, assignment, sla_breach or resolution")
+    payload: Dict[str, Any] = Field(default_factory=dict)
+    status: str = Field("pending", description="pending, or dead once every attempt has failed")
+    attempts: int = 0
+    last_error: Optional[str] = None
+    created_at: datetime
+
+class RequeueRequest(BaseModel):
+    ids: Optional[List[int]] = Field(None, description="Dead letters to retry; omitted retries all of them")
+
+class RequeueResponse(BaseModel):
+    requeued: int
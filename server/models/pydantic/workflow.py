@@ -0,0 +1,36 @@
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any
+from datetime import datetime
+from enum import Enum
+
+from .ticket import TicketPriority
+
+class WorkflowStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    RETRYING = "retrying"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+class WorkflowTrigger(BaseModel):
+    workflow_type: str = Field(..., description="Name of a registered workflow, see GET /workflows")
+    payload: Dict[str, Any] = Field(default_factory=dict)
+    priority: TicketPriority = TicketPriority.MEDIUM
+
+class WorkflowJob(BaseModel):
+    id: str
+    workflow_type: str
+    payload: Dict[str, Any] = Field(default_factory=dict)
+    priority: TicketPriority = TicketPriority.MEDIUM
+    status: WorkflowStatus = WorkflowStatus.QUEUED
+    attempts: int = 0
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    request_id: Optional[str] = Field(None, description="Request that submitted the job, for log correlation")
+    created_at: datetime
+    updated_at: datetime
+
+class WorkflowAccepted(BaseModel):
+    job_id: str
+    status: WorkflowStatus
+    status_url: str
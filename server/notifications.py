@@ -0,0 +1,372 @@
+import asyncio
+import logging
+import os
+import smtplib
+import time
+from email.message import EmailMessage
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlparse
+
+import httpx
+
+from dedup import FINISHED_STATUSES
+from metrics import NOTIFICATION_DEAD_LETTERS, NOTIFICATION_SEND_LATENCY, NOTIFICATIONS_SENT
+from models import NotificationConfig
+
+logger = logging.getLogger(__name__)
+
+# Record ticket changes in the outbox (SQLite backend) and dispatch them from this worker
+NOTIFY = os.getenv("NOTIFY", "off") == "on"
+# NotificationConfig as JSON: which channels are used and which changes are announced
+NOTIFY_CONFIG = os.getenv("NOTIFY_CONFIG", "{}")
+# smtp://[user:password@]host:port, or smtps:// for implicit TLS
+NOTIFY_SMTP_URL = os.getenv("NOTIFY_SMTP_URL", "smtp://127.0.0.1:1025")
+NOTIFY_FROM = os.getenv("NOTIFY_FROM", "servicedesk@sahayak.local")
+# SMS gateway accepting a JSON batch of {"to", "body"} messages
+NOTIFY_SMS_URL = os.getenv("NOTIFY_SMS_URL", "http://127.0.0.1:1026/messages")
+NOTIFY_SMS_TOKEN = os.getenv("NOTIFY_SMS_TOKEN", "")
+# Also told about SLA breaches, e.g. the service desk lead
+NOTIFY_ESCALATION_EMAIL = os.getenv("NOTIFY_ESCALATION_EMAIL", "")
+# Events wait this long before they are sent, so a burst of changes to a ticket becomes one message
+NOTIFY_COALESCE_SECONDS = float(os.getenv("NOTIFY_COALESCE_SECONDS", "5"))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "200"))
+NOTIFY_POLL_SECONDS = float(os.getenv("NOTIFY_POLL_SECONDS", "1"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "6"))
+NOTIFY_RETRY_BACKOFF_SECONDS = float(os.getenv("NOTIFY_RETRY_BACKOFF_SECONDS", "30"))
+# A claimed event is handed to another worker if its batch is not settled by then
+NOTIFY_LEASE_SECONDS = float(os.getenv("NOTIFY_LEASE_SECONDS", "120"))
+NOTIFY_SEND_TIMEOUT_SECONDS = float(os.getenv("NOTIFY_SEND_TIMEOUT_SECONDS", "30"))
+
+STATUS_CHANGE = "status_change"
+ASSIGNMENT = "assignment"
+SLA_BREACH = "sla_breach"
+RESOLUTION = "resolution"
+
+# NotificationConfig switch for each event
+EVENT_SETTINGS = {
+    STATUS_CHANGE: "notify_on_status_change",
+    ASSIGNMENT: "notify_on_assignment",
+    SLA_BREACH: "notify_on_sla_breach",
+    RESOLUTION: "notify_on_resolution",
+}
+
+# Copied into each event, so sending never reads the ticket back
+SNAPSHOT_FIELDS = ("id", "ticket_number", "title", "status", "priority", "requester_name", "requester_email",
+                   "contact_number", "assigned_to", "assigned_team", "resolution_notes", "sla_due_date")
+
+SMS_MAX_CHARS = 320
+
+
+def ticket_events(old: Optional[dict], new: dict) -> List[Tuple[str, dict]]:
+    """
+    (event, payload) pairs announcing the change from old to new; old is
+    None for a new ticket. Migration 008 records the same events in SQL.
+    """
+    old = old or {}
+    ticket = {field: new.get(field) for field in SNAPSHOT_FIELDS}
+    events = []
+    if old and new.get('status') != old.get('status'):
+        resolved = new.get('status') in FINISHED_STATUSES and old.get('status') not in FINISHED_STATUSES
+        events.append((RESOLUTION if resolved else STATUS_CHANGE,
+                       {'ticket': ticket, 'from': old.get('status'), 'to': new.get('status')}))
+    if new.get('assigned_to') and new.get('assigned_to') != old.get('assigned_to'):
+        events.append((ASSIGNMENT, {'ticket': ticket, 'from': old.get('assigned_to'), 'to': new['assigned_to']}))
+    if new.get('sla_breached_at') and not old.get('sla_breached_at'):
+        events.append((SLA_BREACH, {'ticket': ticket, 'breached_at': new['sla_breached_at']}))
+    return events
+
+
+def coalesce(events: Sequence[dict]) -> List[Tuple[str, dict]]:
+    """
+    The net changes of one ticket's events, oldest first: status changes
+    and reassignments collapse into one from-to change each, which is
+    dropped when it ends where it started.
+    """
+    merged: Dict[str, Tuple[str, dict]] = {}
+    for event in events:
+        kind = event['event']
+        change = {key: value for key, value in event['payload'].items() if key != 'ticket'}
+        group = 'status' if kind in (STATUS_CHANGE, RESOLUTION) else kind
+        if group in merged and 'from' in change:
+            change['from'] = merged[group][1]['from']
+        merged.pop(group, None)
+        merged[group] = (kind, change)
+    return [(kind, change) for kind, change in merged.values()
+            if 'from' not in change or change['from'] != change['to']]
+
+
+def describe(kind: str, change: dict, ticket: dict) -> str:
+    if kind == RESOLUTION:
+        notes = ticket.get('resolution_notes')
+        return f"Resolved.{' ' + notes if notes else ''}"
+    if kind == STATUS_CHANGE:
+        return f"Status changed from {_label(change['from'])} to {_label(change['to'])}."
+    if kind == ASSIGNMENT:
+        return f"Assigned to {change['to']}."
+    return f"SLA breached: it was due by {ticket.get('sla_due_date')}."
+
+
+def _label(status: Optional[str]) -> str:
+    return (status or "none").replace("_", " ")
+
+
+class Notification:
+    """One message to one recipient on one channel, covering the events it came from"""
+
+    __slots__ = ("channel", "to", "ticket", "lines", "event_ids")
+
+    def __init__(self, channel: str, to: str, ticket: dict):
+        self.channel = channel
+        self.to = to
+        self.ticket = ticket
+        self.lines: List[str] = []
+        self.event_ids: List[int] = []
+
+    @property
+    def subject(self) -> str:
+        return f"[{self.ticket.get('ticket_number')}] {self.ticket.get('title')}"
+
+    @property
+    def body(self) -> str:
+        if self.channel == "sms":
+            return f"{self.ticket.get('ticket_number')}: {' '.join(self.lines)}"[:SMS_MAX_CHARS]
+        return "\n".join([
+            f"Ticket {self.ticket.get('ticket_number')}: {self.ticket.get('title')}", "",
+            *self.lines, "",
+            f"Status: {_label(self.ticket.get('status'))}. Priority: {self.ticket.get('priority')}.",
+        ])
+
+
+class EmailChannel:
+    """Sends a batch of notifications over one SMTP session"""
+
+    name = "email"
+
+    def __init__(self, url: str = NOTIFY_SMTP_URL, sender: str = NOTIFY_FROM,
+                 timeout: float = NOTIFY_SEND_TIMEOUT_SECONDS):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or (465 if parsed.scheme == "smtps" else 25)
+        self.tls = parsed.scheme == "smtps"
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.sender = sender
+        self.timeout = timeout
+
+    @staticmethod
+    def recipients(kind: str, ticket: dict) -> List[str]:
+        addresses = []
+        if kind != SLA_BREACH:
+            addresses.append(ticket.get('requester_email'))
+        if kind in (ASSIGNMENT, SLA_BREACH) and "@" in (ticket.get('assigned_to') or ""):
+            addresses.append(ticket['assigned_to'])
+        if kind == SLA_BREACH:
+            addresses.append(NOTIFY_ESCALATION_EMAIL)
+        return [address for address in addresses if address]
+
+    def _send_all(self, notifications: Sequence[Notification]) -> List[Optional[str]]:
+        smtp_class = smtplib.SMTP_SSL if self.tls else smtplib.SMTP
+        with smtp_class(self.host, self.port, timeout=self.timeout) as smtp:
+            smtp.ehlo()
+            if not self.tls and self.username and smtp.has_extn("starttls"):
+                smtp.starttls()
+                smtp.ehlo()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            errors = []
+            for notification in notifications:
+                message = EmailMessage()
+                message["From"] = self.sender
+                message["To"] = notification.to
+                message["Subject"] = notification.subject
+                message.set_content(notification.body)
+                try:
+                    smtp.send_message(message)
+                    errors.append(None)
+                except smtplib.SMTPException as e:
+                    errors.append(str(e) or type(e).__name__)
+            return errors
+
+    async def send(self, notifications: Sequence[Notification]) -> List[Optional[str]]:
+        """An error, or None, per notification"""
+        return await asyncio.to_thread(self._send_all, notifications)
+
+
+class SMSChannel:
+    """Posts a batch of notifications to an SMS gateway in one request"""
+
+    name = "sms"
+
+    def __init__(self, url: str = NOTIFY_SMS_URL, token: str = NOTIFY_SMS_TOKEN,
+                 timeout: float = NOTIFY_SEND_TIMEOUT_SECONDS):
+        self.url = url
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.timeout = timeout
+
+    @staticmethod
+    def recipients(kind: str, ticket: dict) -> List[str]:
+        # Breaches are for the service desk, which reads email
+        if kind == SLA_BREACH or not ticket.get('contact_number'):
+            return []
+        return [ticket['contact_number']]
+
+    async def send(self, notifications: Sequence[Notification]) -> List[Optional[str]]:
+        """
+        An error, or None, per notification. The gateway may answer with
+        {"results": [{"error": ...}, ...]} in request order to fail single messages.
+        """
+        messages = [{"to": n.to, "body": n.body} for n in notifications]
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.post(self.url, json={"messages": messages}, headers=self.headers)
+        response.raise_for_status()
+        results = response.json().get("results") if response.content else None
+        if not isinstance(results, list) or len(results) != len(messages):
+            return [None] * len(messages)
+        return [result.get("error") if isinstance(result, dict) else None for result in results]
+
+
+def build_channels(config: NotificationConfig) -> list:
+    channels = []
+    if config.email_alerts and NOTIFY_SMTP_URL:
+        channels.append(EmailChannel())
+    if config.sms_alerts and NOTIFY_SMS_URL:
+        channels.append(SMSChannel())
+    return channels
+
+
+class NotificationDispatcher:
+    """
+    Sends the ticket changes recorded in the notification outbox.
+
+    Ticket writes add events to the outbox in the same transaction as the
+    change itself (a trigger on Supabase, see migration 008, and
+    LocalDatabase for SQLite), so a change is announced if and only if it
+    was committed, and no request waits on a mail server.
+
+    Each worker runs one loop that claims due events in batches under a
+    lease, so workers share the outbox and the events of a worker that dies
+    are claimed again once the lease runs out. Events are held for
+    `coalesce` seconds, then all events of a ticket in a batch become one
+    message per recipient and channel, and each channel sends its messages
+    together. Events whose message failed are retried with exponential
+    backoff and dead-lettered after max_attempts. Delivery is at least
+    once: a retried event is sent again on every channel it was meant for.
+    """
+
+    def __init__(self, channels: Sequence, config: NotificationConfig,
+                 batch_size: int = NOTIFY_BATCH_SIZE, coalesce: float = NOTIFY_COALESCE_SECONDS,
+                 poll: float = NOTIFY_POLL_SECONDS, max_attempts: int = NOTIFY_MAX_ATTEMPTS,
+                 backoff: float = NOTIFY_RETRY_BACKOFF_SECONDS, lease: float = NOTIFY_LEASE_SECONDS):
+        self.channels = {channel.name: channel for channel in channels}
+        self.config = config
+        self.batch_size = batch_size
+        self.coalesce = coalesce
+        self.poll = poll
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self._task: Optional[asyncio.Task] = None
+
+    def enabled(self, kind: str) -> bool:
+        return getattr(self.config, EVENT_SETTINGS[kind], False)
+
+    def compose(self, events: Sequence[dict]) -> List[Notification]:
+        """Messages for a batch of events: one per ticket, channel and recipient"""
+        by_ticket: Dict[str, List[dict]] = {}
+        for event in sorted(events, key=lambda e: e['id']):
+            by_ticket.setdefault(str(event['ticket_id']), []).append(event)
+
+        notifications: List[Notification] = []
+        for group in by_ticket.values():
+            ticket = group[-1]['payload'].get('ticket') or {}
+            ids = [event['id'] for event in group]
+            messages: Dict[Tuple[str, str], Notification] = {}
+            for kind, change in coalesce(group):
+                if kind not in EVENT_SETTINGS or not self.enabled(kind):
+                    continue
+                line = describe(kind, change, ticket)
+                for channel in self.channels.values():
+                    for to in channel.recipients(kind, ticket):
+                        notification = messages.get((channel.name, to))
+                        if notification is None:
+                            notification = messages[(channel.name, to)] = Notification(channel.name, to, ticket)
+                            notification.event_ids = ids
+                        notification.lines.append(line)
+            notifications.extend(messages.values())
+        return notifications
+
+    async def _send(self, channel, batch: List[Notification]) -> List[Optional[str]]:
+        start = time.perf_counter()
+        try:
+            errors = await asyncio.wait_for(channel.send(batch), timeout=NOTIFY_SEND_TIMEOUT_SECONDS)
+        except Exception as e:
+            errors = [str(e) or type(e).__name__] * len(batch)
+        NOTIFICATION_SEND_LATENCY.labels(channel.name).observe(time.perf_counter() - start)
+        failed = sum(1 for error in errors if error)
+        NOTIFICATIONS_SENT.labels(channel.name, "sent").inc(len(batch) - failed)
+        if failed:
+            NOTIFICATIONS_SENT.labels(channel.name, "failed").inc(failed)
+            logger.warning("notify.send_failed", extra={
+                "channel": channel.name, "failed": failed, "batch": len(batch),
+                "error": next(error for error in errors if error),
+            })
+        return errors
+
+    async def dispatch(self, db) -> int:
+        """Claim, send and settle one batch of events; returns how many were claimed"""
+        events = await db.claim_outbox_events(self.batch_size, self.lease, self.coalesce)
+        if not events:
+            return 0
+        by_channel: Dict[str, List[Notification]] = {}
+        for notification in self.compose(events):
+            by_channel.setdefault(notification.channel, []).append(notification)
+        results = await asyncio.gather(*(
+            self._send(self.channels[name], batch) for name, batch in by_channel.items()
+        ))
+
+        failed: Dict[str, List[int]] = {}
+        failed_ids = set()
+        for batch, errors in zip(by_channel.values(), results):
+            for notification, error in zip(batch, errors):
+                if error:
+                    for event_id in notification.event_ids:
+                        if event_id not in failed_ids:
+                            failed_ids.add(event_id)
+                            failed.setdefault(error, []).append(event_id)
+        done = [event['id'] for event in events if event['id'] not in failed_ids]
+        if done:
+            await db.complete_outbox_events(done)
+        for error, ids in failed.items():
+            dead = await db.fail_outbox_events(ids, error, self.backoff, self.max_attempts)
+            if dead:
+                NOTIFICATION_DEAD_LETTERS.labels().inc(dead)
+                logger.error("notify.dead_lettered", extra={"events": dead, "error": error})
+        return len(events)
+
+    async def start(self, db) -> None:
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, db) -> None:
+        while True:
+            try:
+                claimed = await self.dispatch(db)
+            except Exception:
+                logger.exception("notify.dispatch_failed")
+                claimed = 0
+            # A full batch means more are waiting
+            if claimed < self.batch_size:
+                await asyncio.sleep(self.poll)
+
+
+# Shared by startup; None when this worker does not send notifications
+config = NotificationConfig.parse_raw(NOTIFY_CONFIG)
+dispatcher = NotificationDispatcher(build_channels(config), config) if NOTIFY else None
@@ -0,0 +1,46 @@
+import base64
+import json
+from typing import List, Optional, Sequence, Tuple
+
+# Response header carrying the cursor for the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Sort keys of the default listing order, newest first
+RECENCY_KEYS = ("created_at", "id")
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def encode_cursor(*values) -> str:
+    """Opaque cursor pointing just after the row with these sort-key values"""
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int = 2) -> Tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise InvalidCursor("Invalid pagination cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor("Invalid pagination cursor")
+    for value in values:
+        # Values are embedded in PostgREST filters, so refuse anything that could break quoting
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise InvalidCursor("Invalid pagination cursor")
+        if isinstance(value, str) and ('"' in value or '\\' in value):
+            raise InvalidCursor("Invalid pagination cursor")
+    return tuple(values)
+
+
+def next_cursor(rows: List[dict], page_size: int,
+                keys: Sequence[str] = RECENCY_KEYS) -> Optional[str]:
+    """Cursor for the page after rows, or None when this was the last page"""
+    if len(rows) < page_size:
+        return None
+    last = rows[-1]
+    return encode_cursor(*(last[key] if isinstance(last[key], (int, float)) else str(last[key])
+                           for key in keys))
@@ -1,9 +1,27 @@
 from typing import List
-from fastapi import APIRouter # pylint: disable=import-error
+from fastapi import APIRouter, Depends, Query # pylint: disable=import-error
 from pydantic import BaseModel
+from database import Database, get_db
+from models import NotificationEvent, RequeueRequest, RequeueResponse
 
 router = APIRouter()
 
 @router.get("/")
 async def get_users():
     return "Admin"
+
+# Notifications that ran out of attempts
+@router.get("/notifications/dead-letters", response_model=List[NotificationEvent])
+async def get_dead_letters(limit: int = Query(100, ge=1, le=1000), db: Database = Depends(get_db)):
+    """
+    Outbox events whose notifications failed on every attempt, newest first, with the last error
+    """
+    return await db.get_outbox_events(status='dead', limit=limit)
+
+# Retry dead letters
+@router.post("/notifications/dead-letters/requeue", response_model=RequeueResponse)
+async def requeue_dead_letters(request: RequeueRequest, db: Database = Depends(get_db)):
+    """
+    Put dead-lettered events back in the outbox with a fresh set of attempts
+    """
+    return RequeueResponse(requeued=await db.requeue_outbox_events(request.ids))
@@ -3,9 +3,13 @@ from fastapi import APIRouter # pylint: disable=import-error
 from pydantic import BaseModel
 from .admin import index as admin
 from .auth import index as auth
+from .knowledge import index as knowledge
 from .ticket import index as ticket
+from .workflow import index as workflow
 
 router = APIRouter()
 router.include_router(auth.router, prefix="/auth", tags=["AUTHENTICATION"])
 router.include_router(admin.router, prefix="/admin", tags=["ADMIN"])
 router.include_router(ticket.router, prefix="/ticket", tags=["TICKETS"])
+router.include_router(knowledge.router, prefix="/knowledge", tags=["KNOWLEDGE BASE"])
+router.include_router(workflow.router, tags=["WORKFLOWS"])
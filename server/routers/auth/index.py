@@ -1,27 +1,25 @@
+import logging
 import os
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
-from supabase import create_client, Client
+from database import Database, get_db
+from tokens import token_verifier, profile_cache
 from dotenv import load_dotenv
 from typing import Optional
 from pathlib import Path
 
 # Fix: Go three levels up to reach project root
 env_path = Path(__file__).resolve().parent.parent.parent / '.env'
-print(f"Looking for .env at: {env_path}")  # Debug line
+logging.getLogger(__name__).debug("Looking for .env at: %s", env_path)
 load_dotenv(dotenv_path=env_path)
 
-# Debug: Print environment variables to verify
-
-# Supabase Configuration
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Supabase clients are owned by the shared Database (see database.get_db)
 
 router = APIRouter()
 security = HTTPBearer()
+# For routes that also serve anonymous callers
+optional_security = HTTPBearer(auto_error=False)
 
 # Pydantic Models
 class UserRegister(BaseModel):
@@ -53,28 +51,25 @@ class UserResponse(BaseModel):
     username: Optional[str] = None
 
 # Helper Functions
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Database = Depends(get_db)
+):
     """Verify JWT token and get current user"""
     token = credentials.credentials
     
     try:
-        # Verify token with Supabase
-        user = supabase.auth.get_user(token)
-        
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-            )
+        # Verify signature and expiry locally; only falls back to Supabase without a key
+        claims = await token_verifier.verify(token, db)
         
-        # Get user profile from public.profiles table
-        profile = supabase.table('profiles').select('*').eq('id', user.user.id).single().execute()
+        # Get user profile from public.profiles table (cached)
+        profile = await profile_cache.get(claims['sub'], db)
         
         return {
-            "id": user.user.id,
-            "email": user.user.email,
-            "name": profile.data.get('name') if profile.data else None,
-            "username": profile.data.get('username') if profile.data else None,
+            "id": claims['sub'],
+            "email": claims.get('email'),
+            "name": profile.get('name') if profile else None,
+            "username": profile.get('username') if profile else None,
         }
     except Exception as e:
         raise HTTPException(
@@ -82,13 +77,22 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail=f"Could not validate credentials: {str(e)}",
         )
 
+async def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: Database = Depends(get_db)
+):
+    """Current user when a token is sent, None for anonymous callers"""
+    if credentials is None:
+        return None
+    return await get_current_user(credentials, db)
+
 # Routes
 @router.post("/register", response_model=Token)
-async def register(user: UserRegister):
+async def register(user: UserRegister, db: Database = Depends(get_db)):
     """Register a new user with Supabase"""
     try:
         # Sign up user with Supabase Auth
-        auth_response = supabase.auth.sign_up({
+        auth_response = await db.run(db.auth.sign_up, {
             "email": user.email,
             "password": user.password,
         })
@@ -107,7 +111,8 @@ async def register(user: UserRegister):
             "username": user.username,
         }
         
-        supabase.table('profiles').insert(profile_data).execute()
+        await db.create_profile(profile_data)
+        profile_cache.invalidate(auth_response.user.id)
         
         return {
             "access_token": auth_response.session.access_token,
@@ -134,11 +139,11 @@ async def register(user: UserRegister):
         )
 
 @router.post("/login", response_model=Token)
-async def login(user: UserLogin):
+async def login(user: UserLogin, db: Database = Depends(get_db)):
     """Login with email and password using Supabase"""
     try:
         # Sign in with Supabase Auth
-        auth_response = supabase.auth.sign_in_with_password({
+        auth_response = await db.run(db.auth.sign_in_with_password, {
             "email": user.email,
             "password": user.password,
         })
@@ -150,7 +155,7 @@ async def login(user: UserLogin):
             )
         
         # Get user profile
-        profile = supabase.table('profiles').select('*').eq('id', auth_response.user.id).single().execute()
+        profile = await db.get_profile(auth_response.user.id)
         
         return {
             "access_token": auth_response.session.access_token,
@@ -159,8 +164,8 @@ async def login(user: UserLogin):
             "user": {
                 "id": auth_response.user.id,
                 "email": auth_response.user.email,
-                "name": profile.data.get('name') if profile.data else None,
-                "username": profile.data.get('username') if profile.data else None,
+                "name": profile.get('name') if profile else None,
+                "username": profile.get('username') if profile else None,
             }
         }
         
@@ -171,10 +176,10 @@ async def login(user: UserLogin):
         )
 
 @router.post("/refresh")
-async def refresh_token(refresh_token: str):
+async def refresh_token(refresh_token: str, db: Database = Depends(get_db)):
     """Refresh access token using refresh token"""
     try:
-        auth_response = supabase.auth.refresh_session(refresh_token)
+        auth_response = await db.run(db.auth.refresh_session, refresh_token)
         
         if not auth_response.session:
             raise HTTPException(
@@ -194,10 +199,10 @@ async def refresh_token(refresh_token: str):
         )
 
 @router.post("/forgot-password")
-async def forgot_password(request: PasswordResetRequest):
+async def forgot_password(request: PasswordResetRequest, db: Database = Depends(get_db)):
     """Send password reset email via Supabase"""
     try:
-        supabase.auth.reset_password_email(request.email)
+        await db.run(db.auth.reset_password_email, request.email)
         return {
             "message": "If the email exists, a password reset link has been sent"
         }
@@ -210,14 +215,16 @@ async def forgot_password(request: PasswordResetRequest):
 @router.post("/reset-password")
 async def reset_password(
     reset: PasswordReset,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Database = Depends(get_db)
 ):
     """Reset password (requires valid reset token)"""
     try:
         token = credentials.credentials
         
         # Update password
-        supabase.auth.update_user(
+        await db.run(
+            db.auth.update_user,
             token,
             {"password": reset.new_password}
         )
@@ -235,11 +242,19 @@ async def get_me(current_user: dict = Depends(get_current_user)):
     return current_user
 
 @router.post("/logout")
-async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Database = Depends(get_db)
+):
     """Logout user (invalidate session)"""
+    token = credentials.credentials
+    # Not swallowed below: other workers keep accepting the token if this fails.
+    # Tokens that do not verify are not recorded, and return no user id
+    user_id = await token_verifier.revoke(token, db)
+    if user_id:
+        profile_cache.invalidate(user_id)
     try:
-        token = credentials.credentials
-        supabase.auth.sign_out(token)
+        await db.run(db.auth.sign_out, token)
         return {"message": "Logged out successfully"}
     except Exception as e:
         # Even if it fails, consider it logged out on client side
@@ -1,45 +1,197 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from typing import AsyncIterator, Optional
 import os
-import google.generativeai as genai
+import re
+import uuid
+import llm
+from classifier import classifier
+from knowledge_base import KB_SUGGEST_THRESHOLD, knowledge_base
+from models import IntentClassification, KnowledgeArticleMatch, TicketCategory
+from sessions import SessionStore, sessions, turn
+from streaming import sse_response, text_chunks
+from .auth.index import get_current_user
 
 # Load API key from .env
 load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
 
 if not GOOGLE_API_KEY:
     raise RuntimeError("GOOGLE_API_KEY missing in .env file!")
 
 # Configure Gemini
-genai.configure(api_key=GOOGLE_API_KEY)
+llm.configure(GOOGLE_API_KEY)
 
 router = APIRouter(prefix="/api/chat", tags=["Chatbot"])
 
 class ChatInput(BaseModel):
     message: str
+    session_id: Optional[str] = None
 
-def ask_gemini(prompt: str, model: str = "gemini-1.5-flash"):
+# Returned with streamed replies, whose body has no room for it
+SESSION_HEADER = "X-Session-Id"
+
+GEMINI_ERROR_PREFIX = "Error contacting Gemini API"
+
+# Classifier confidence needed before a canned self-service reply stands in for the LLM
+SELF_SERVICE_CONFIDENCE = float(os.getenv("SELF_SERVICE_CONFIDENCE", "0.9"))
+
+async def ask_gemini(message: str, system_prompt: str = "", kind: str = "chat", history: str = ""):
     
     try:
-        model_obj = genai.GenerativeModel(model)
-        response = model_obj.generate_content(prompt)
-        return getattr(response, "text", str(response))
-    except Exception as e:
-        return f"Error contacting Gemini API: {e}"
+        return await llm.client.generate(message, system_prompt=system_prompt, kind=kind, history=history)
+    except llm.LLMError as e:
+        return f"{GEMINI_ERROR_PREFIX}: {e}"
+
+SYSTEM_PROMPT = (
+    "You are SAHAY, a helpful assistant for POWERGRID employees. "
+    "Answer in a polite, clear, and concise way. "
+    "Do not use technical jargon unless necessary."
+)
+
+def build_message(user_message: str) -> str:
+    return f"Employee: {user_message.strip()}\nSahay:"
+
+def build_history(session: Optional[dict] = None) -> str:
+    """
+    Conversation before the latest message; sent separately so replies are
+    cached on the latest message within this history
+    """
+    lines = []
+    if session:
+        if session["summary"]:
+            lines.append(f"Earlier in this conversation:\n{session['summary']}\n")
+        for t in session["turns"]:
+            speaker = "Employee" if t["role"] == "user" else "Sahay"
+            lines.append(f"{speaker}: {t['content'].strip()}")
+    return "\n".join(lines)
+
+# Answered without the LLM when a conversation opens by asking how to do one of these
+SELF_SERVICE_REPLIES = {
+    TicketCategory.PASSWORD_RESET: (
+        "You can reset your password yourself from the self-service password portal: "
+        "choose \"Forgot password\", verify with the OTP sent to your registered mobile "
+        "number and set a new password. If your account is locked, it unlocks automatically "
+        "after 30 minutes, or raise a ticket and the IT helpdesk will unlock it for you."
+    ),
+    TicketCategory.VPN_ACCESS: (
+        "For VPN problems, please check that you are connected to the internet, then "
+        "restart the VPN client and sign in again with your domain credentials. If it still "
+        "fails, note the error message shown and raise a ticket so the network team can check "
+        "your VPN access."
+    ),
+}
+
+# Questions a canned reply answers; reports, follow-ups and requests for policy go to the LLM
+HOW_TO = re.compile(
+    r"^\s*(how\b|where (do|can|should) i\b|what (do|should) i do\b|steps to\b|i (forgot|can'?t remember)\b)",
+    re.IGNORECASE,
+)
+
+def article_reply(article: KnowledgeArticleMatch) -> str:
+    return f"{article.summary}\n\n(From the help article \"{article.title}\")"
+
+def local_reply(message: str, session: Optional[dict] = None):
+    """
+    Canned or knowledge-base reply and the message's classification, or
+    (None, classification) to ask the LLM.
+
+    Only a how-to question that opens a conversation is answered locally, so
+    follow-ups such as "that didn't work" after a canned reply reach the LLM
+    with the history.
+    """
+    intent = classifier.classify(message)
+    first_turn = not session or not (session["turns"] or session["summary"])
+    if not first_turn or not HOW_TO.match(message):
+        return None, intent
+    if intent.category in SELF_SERVICE_REPLIES and intent.confidence >= SELF_SERVICE_CONFIDENCE:
+        return SELF_SERVICE_REPLIES[intent.category], intent
+    article = knowledge_base.answer(message)
+    if article:
+        return article_reply(article), intent
+    return None, intent
+
+def _intent_fields(intent: IntentClassification, reply_source: str) -> dict:
+    return {"intent": intent.category.value, "confidence": intent.confidence, "reply_source": reply_source}
+
+async def _own_session(session_id: str, user: dict) -> Optional[dict]:
+    """The caller's session, None for a new one; 404 if it belongs to someone else"""
+    session = await sessions.get(session_id)
+    if session and session.get("user_id") != user["id"]:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+async def _record(session_id: str, user: dict, message: str, reply: str) -> None:
+    await sessions.append(session_id, turn("user", message), turn("assistant", reply), user_id=user["id"])
+
+async def _recorded(session_id: str, user: dict, message: str, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Pass chunks through, then save the exchange once the reply is complete"""
+    parts = []
+    async for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    await _record(session_id, user, message, "".join(parts))
 
 @router.post("/")
-async def chatbot_response(input: ChatInput):
-    user_message = input.message.strip()
+async def chatbot_response(input: ChatInput, request: Request, current_user: dict = Depends(get_current_user)):
+    session_id = input.session_id or str(uuid.uuid4())
+    session = await _own_session(session_id, current_user)
+    # Offered alongside any reply, so the employee can help themselves before filing a ticket
+    articles = [article.dict() for article in knowledge_base.search(input.message, min_score=KB_SUGGEST_THRESHOLD)]
+    reply, intent = local_reply(input.message, session)
+    if reply:
+        await _record(session_id, current_user, input.message, reply)
+        return {"reply": reply, "session_id": session_id, "articles": articles,
+                **_intent_fields(intent, "local")}
+
+    history = build_history(session)
+    try:
+        reply = await llm.cancel_on_disconnect(
+            request, ask_gemini(build_message(input.message), SYSTEM_PROMPT, history=history)
+        )
+    except llm.ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client closed request")
+
+    if not reply.startswith(GEMINI_ERROR_PREFIX):
+        await _record(session_id, current_user, input.message, reply)
+    return {"reply": reply, "session_id": session_id, "articles": articles,
+            **_intent_fields(intent, "llm")}
 
-    system_prompt = (
-        "You are SAHAY, a helpful assistant for POWERGRID employees. "
-        "Answer in a polite, clear, and concise way. "
-        "Do not use technical jargon unless necessary."
-    )
+@router.post("/stream")
+async def chatbot_stream(input: ChatInput, request: Request, current_user: dict = Depends(get_current_user)):
+    """Stream the reply as Server-Sent Events while the model generates it"""
+    session_id = input.session_id or str(uuid.uuid4())
+    session = await _own_session(session_id, current_user)
+    reply, _ = local_reply(input.message, session)
+    if reply:
+        chunks = text_chunks(reply)
+    else:
+        history = build_history(session)
+        chunks = llm.client.stream(build_message(input.message), system_prompt=SYSTEM_PROMPT, history=history)
+    response = sse_response(request, _recorded(session_id, current_user, input.message, chunks))
+    response.headers[SESSION_HEADER] = session_id
+    return response
 
-    prompt = f"{system_prompt}\n\nEmployee: {user_message}\nSahay:"
-    reply = ask_gemini(prompt)
+@router.get("/sessions/{session_id}")
+async def get_session(session_id: str, current_user: dict = Depends(get_current_user)):
+    """Conversation so far: the summary of older turns and the recent ones"""
+    session = await sessions.get_owned(session_id, current_user["id"])
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, "history": SessionStore.history(session)}
 
-    return {"reply": reply}
+@router.delete("/sessions/{session_id}")
+async def delete_session(session_id: str, current_user: dict = Depends(get_current_user)):
+    if not await sessions.get_owned(session_id, current_user["id"]):
+        raise HTTPException(status_code=404, detail="Session not found")
+    await sessions.delete(session_id)
+    return {"message": "Session deleted"}
 
+@router.get("/cache/stats")
+async def cache_stats():
+    """Prompt cache hit/miss and request coalescing counters for this worker"""
+    coalescing = llm.client.singleflight.stats() if llm.client.singleflight else None
+    if llm.client.cache is None:
+        return {"enabled": False, "coalescing": coalescing}
+    return {"enabled": True, **llm.client.cache.stats(), "coalescing": coalescing}
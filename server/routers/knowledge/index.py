@@ -0,0 +1,25 @@
+from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from knowledge_base import knowledge_base
+from models import KnowledgeArticleMatch
+
+router = APIRouter()
+
+# Search the knowledge base
+@router.get("/search", response_model=List[KnowledgeArticleMatch])
+async def search_articles(q: str = Query(..., min_length=2), k: int = Query(5, ge=1, le=50)):
+    """
+    Articles most similar to q, best first
+    """
+    return knowledge_base.search(q, k=k)
+
+# Get one article
+@router.get("/articles/{article_id:path}")
+async def get_article(article_id: str):
+    """
+    Full text of an article, by the id that search and ticket suggestions return
+    """
+    article = knowledge_base.article(article_id)
+    if article is None:
+        raise HTTPException(status_code=404, detail="Article not found")
+    return article
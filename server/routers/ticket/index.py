@@ -1,58 +1,289 @@
-from typing import List, Optional
-from fastapi import APIRouter, HTTPException, Depends, Query
-from pydantic import BaseModel
-import database
-from models import TicketCreate, TicketUpdate, TicketResponse, TicketSummary
+import json
+import os
+from typing import AsyncIterator, List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response, WebSocket
+from pydantic import BaseModel, ValidationError
+from database import Database, get_db
+from stats import ticket_stats
+from ticket_numbers import ticket_numbers
+from ticket_cache import ticket_cache
+from classifier import classifier
+from dedup import FINISHED_STATUSES, duplicates
+import sla
+import ticket_feed
+from knowledge_base import knowledge_base
+from sessions import SessionStore, sessions
+from pagination import NEXT_CURSOR_HEADER, RECENCY_KEYS, InvalidCursor, decode_cursor, next_cursor
+from ..auth.index import get_optional_user
+from models import (
+    TicketCreate, TicketUpdate, TicketResponse, TicketSummary, TicketListItem, TICKET_LIST_FIELDS,
+    BulkTicketItem, BulkItemStatus, BulkItemResult, BulkTicketResponse
+)
 
 router = APIRouter()
 
+# Items validated and written per multi-row insert
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "50000"))
+
 # Response models
 class MessageResponse(BaseModel):
     message: str
 
+# Keyset pagination needs these on every row, whatever the client asked for
+_CURSOR_FIELDS = ("id", "created_at")
+
+# Search results are ordered, and paged, by relevance
+SEARCH_KEYS = ("search_rank", "id")
+
+def _list_columns(fields: Optional[str]) -> List[str]:
+    """Validate a fields= query parameter and turn it into a select list"""
+    if not fields:
+        return list(TICKET_LIST_FIELDS)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in TicketListItem.__fields__]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # search_rank is computed by the search, not a column
+    columns = [f for f in requested if f != "search_rank"]
+    return columns + [f for f in _CURSOR_FIELDS if f not in columns]
+
+def _set_next_cursor(response: Response, tickets: list, page_size: int,
+                     keys=RECENCY_KEYS) -> None:
+    cursor = next_cursor(tickets, page_size, keys)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+
+async def _attach_chat_history(ticket_data: dict, user: Optional[dict]) -> None:
+    """Replace chat_session_id with the conversation it refers to, if it is the user's"""
+    session_id = ticket_data.pop('chat_session_id', None)
+    if session_id:
+        session = await sessions.get(session_id)
+        if session and session.get('user_id') != (user['id'] if user else None):
+            raise HTTPException(status_code=404, detail="Chat session not found")
+        if session:
+            ticket_data['chat_history'] = SessionStore.history(session)
+
 # Create ticket
 @router.post("/", response_model=TicketResponse)
-async def create_ticket(ticket: TicketCreate):
+async def create_ticket(ticket: TicketCreate, db: Database = Depends(get_db),
+                        current_user: Optional[dict] = Depends(get_optional_user)):
     """
     Create a new ticket
     """
+    # Convert Pydantic model to dict
+    ticket_data = ticket.dict()
+    await _attach_chat_history(ticket_data, current_user)
+
     try:
-        # Convert Pydantic model to dict
-        ticket_data = ticket.dict()
-        
         # Generate ticket number if not provided
         if 'ticket_number' not in ticket_data:
-            import datetime
-            import random
-            timestamp = datetime.datetime.now().strftime("%y%m%d")
-            random_num = str(random.randint(1000, 9999))
-            ticket_data['ticket_number'] = f"TKT-{timestamp}-{random_num}"
+            ticket_data['ticket_number'] = await ticket_numbers.next(db)
+        
+        # Confidence score, and a category for tickets filed as "other"
+        classifier.label_tickets([ticket_data])
+        knowledge_base.suggest([ticket_data])
+        sla.policy.apply([ticket_data])
+        
+        # Link to the incident it repeats, if any; indexed before the insert so
+        # a burst of identical tickets all find the first one
+        if duplicates:
+            duplicates.link(ticket_data)
         
         # Create ticket in database
-        created_ticket = await database.db.create_ticket(ticket_data)
+        created_ticket = None
+        try:
+            created_ticket = await db.create_ticket(ticket_data)
+        finally:
+            if duplicates and not created_ticket:
+                duplicates.discard(ticket_data['ticket_number'])
         
         if not created_ticket:
             raise HTTPException(status_code=500, detail="Failed to create ticket")
         
+        ticket_stats.record_create(created_ticket)
+        ticket_cache.put(created_ticket)
+        if sla.scheduler:
+            sla.scheduler.track(created_ticket)
+        ticket_feed.hub.publish(ticket_feed.CREATED, created_ticket)
         return created_ticket
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating ticket: {str(e)}")
 
+# Bulk ingestion helpers
+async def _json_items(request: Request) -> AsyncIterator[Tuple[int, object]]:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of tickets")
+    if not isinstance(body, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of tickets")
+    for index, item in enumerate(body):
+        yield index, item
+
+async def _ndjson_items(request: Request) -> AsyncIterator[Tuple[int, object]]:
+    """Parse one ticket per line as the body streams in, without buffering it whole"""
+    index, buffer = 0, b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield index, _parse_line(line)
+                index += 1
+    if buffer.strip():
+        yield index, _parse_line(buffer)
+
+def _parse_line(line: bytes) -> object:
+    # Bad lines are reported per item instead of failing the whole stream
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+async def _ingest_chunk(chunk: List[Tuple[int, object]], request_key: Optional[str],
+                        db: Database, user: Optional[dict]) -> List[BulkItemResult]:
+    """Validate one chunk, insert the valid tickets in a single write and report per item"""
+    results = {}
+    rows, row_indexes, row_index = [], [], {}
+    for index, item in chunk:
+        if isinstance(item, Exception):
+            results[index] = BulkItemResult(index=index, status=BulkItemStatus.INVALID,
+                                            errors=[f"Invalid JSON: {item}"])
+            continue
+        try:
+            ticket = BulkTicketItem.parse_obj(item)
+        except ValidationError as e:
+            errors = [f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()]
+            results[index] = BulkItemResult(index=index, status=BulkItemStatus.INVALID, errors=errors)
+            continue
+        row = ticket.dict(exclude={'idempotency_key'})
+        try:
+            await _attach_chat_history(row, user)
+        except HTTPException as e:
+            results[index] = BulkItemResult(index=index, status=BulkItemStatus.INVALID,
+                                            errors=[f"chat_session_id: {e.detail}"])
+            continue
+        row['idempotency_key'] = ticket.idempotency_key or (f"{request_key}:{index}" if request_key else None)
+        row_indexes.append(index)
+        rows.append(row)
+
+    classifier.label_tickets(rows)
+    knowledge_base.suggest(rows)
+    sla.policy.apply(rows)
+
+    # One allocator call numbers the whole chunk
+    for row, index, number in zip(rows, row_indexes, await ticket_numbers.allocate(db, len(rows))):
+        row['ticket_number'] = number
+        row_index[number] = index
+        if duplicates:
+            duplicates.link(row)
+
+    try:
+        created = await db.create_tickets(rows)
+        for ticket in created:
+            ticket_stats.record_create(ticket)
+            if sla.scheduler:
+                sla.scheduler.track(ticket)
+            ticket_feed.hub.publish(ticket_feed.CREATED, ticket)
+            index = row_index[ticket['ticket_number']]
+            results[index] = BulkItemResult(index=index, status=BulkItemStatus.CREATED,
+                                            id=str(ticket['id']), ticket_number=ticket['ticket_number'],
+                                            parent_ticket_number=ticket.get('parent_ticket_number'))
+
+        # Rows the database skipped already exist under their idempotency key
+        skipped = {row['idempotency_key']: row_index[row['ticket_number']]
+                   for row in rows if row_index[row['ticket_number']] not in results}
+        existing = await db.get_tickets_by_idempotency_keys(
+            [key for key in skipped if key], columns=['id', 'ticket_number', 'idempotency_key']
+        )
+        by_key = {ticket['idempotency_key']: ticket for ticket in existing}
+        for row in rows:
+            index = row_index[row['ticket_number']]
+            if index in results:
+                continue
+            original = by_key.get(row['idempotency_key'])
+            if original:
+                results[index] = BulkItemResult(index=index, status=BulkItemStatus.DUPLICATE,
+                                                id=str(original['id']), ticket_number=original['ticket_number'])
+            else:
+                results[index] = BulkItemResult(index=index, status=BulkItemStatus.FAILED,
+                                                errors=["Ticket was not inserted"])
+    except Exception as e:
+        for row in rows:
+            index = row_index[row['ticket_number']]
+            results[index] = BulkItemResult(index=index, status=BulkItemStatus.FAILED, errors=[str(e)])
+
+    if duplicates:
+        # Tickets that were not inserted cannot be anyone's parent
+        for row in rows:
+            if results[row_index[row['ticket_number']]].status != BulkItemStatus.CREATED:
+                duplicates.discard(row['ticket_number'])
+
+    return [results[index] for index, _ in chunk]
+
+# Bulk create tickets
+@router.post("/bulk", response_model=BulkTicketResponse)
+async def bulk_create_tickets(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, description="Derives a per-item key for items that have none"),
+    db: Database = Depends(get_db),
+    current_user: Optional[dict] = Depends(get_optional_user)
+):
+    """
+    Create many tickets from a JSON array or an NDJSON stream (application/x-ndjson)
+    """
+    if "ndjson" in request.headers.get("content-type", ""):
+        items = _ndjson_items(request)
+    else:
+        items = _json_items(request)
+
+    response = BulkTicketResponse()
+    chunk = []
+    async for index, item in items:
+        if index >= BULK_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ITEMS} tickets per request")
+        chunk.append((index, item))
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            response.results.extend(await _ingest_chunk(chunk, idempotency_key, db, current_user))
+            chunk = []
+    if chunk:
+        response.results.extend(await _ingest_chunk(chunk, idempotency_key, db, current_user))
+
+    for result in response.results:
+        if result.status == BulkItemStatus.CREATED:
+            response.created += 1
+        elif result.status == BulkItemStatus.DUPLICATE:
+            response.duplicates += 1
+        elif result.status == BulkItemStatus.INVALID:
+            response.invalid += 1
+        else:
+            response.failed += 1
+    return response
+
 # Get all tickets with optional filtering and pagination
-@router.get("/", response_model=List[TicketResponse])
+@router.get("/", response_model=List[TicketListItem], response_model_exclude_unset=True)
 async def get_tickets(
+    response: Response,
     status: Optional[str] = Query(None, description="Filter by status"),
     priority: Optional[str] = Query(None, description="Filter by priority"),
     category: Optional[str] = Query(None, description="Filter by category"),
     assigned_to: Optional[str] = Query(None, description="Filter by assigned person"),
+    parent_ticket_number: Optional[str] = Query(None, description="Duplicates linked to this incident"),
     page: int = Query(1, ge=1, description="Page number"),
-    page_size: int = Query(50, ge=1, le=100, description="Items per page")
+    page_size: int = Query(50, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description=f"Cursor from the {NEXT_CURSOR_HEADER} header; overrides page"),
+    fields: Optional[str] = Query(None, description="Comma-separated ticket fields to return"),
+    db: Database = Depends(get_db)
 ):
     """
     Get all tickets with optional filtering and pagination
     """
     try:
+        after = decode_cursor(cursor) if cursor else None
+        columns = _list_columns(fields)
+        
         # Build filters
         filters = {}
         if status:
@@ -63,21 +294,68 @@ async def get_tickets(
             filters['category'] = category
         if assigned_to:
             filters['assigned_to'] = assigned_to
+        if parent_ticket_number:
+            filters['parent_ticket_number'] = parent_ticket_number
         
-        tickets = await database.db.get_tickets(filters=filters, page=page, page_size=page_size)
+        tickets = await db.get_tickets(
+            filters=filters, page=page, page_size=page_size, after=after, columns=columns
+        )
+        _set_next_cursor(response, tickets, page_size)
         return tickets
         
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching tickets: {str(e)}")
 
+# Realtime feed of ticket changes, over Server-Sent Events
+@router.get("/stream")
+async def stream_tickets(
+    request: Request,
+    status: Optional[str] = Query(None, description="Comma-separated statuses"),
+    priority: Optional[str] = Query(None, description="Comma-separated priorities"),
+    category: Optional[str] = Query(None, description="Comma-separated categories"),
+    assigned_to: Optional[str] = Query(None, description="Comma-separated assignees"),
+    assigned_team: Optional[str] = Query(None, description="Comma-separated teams"),
+    stats: bool = Query(False, description="Also push the stats summary after changes"),
+):
+    """
+    Created, updated and deleted tickets in a filtered view, as they happen.
+    Each event carries the ticket's list fields; a resync event means
+    events were dropped and the view should be fetched again.
+    """
+    view = ticket_feed.parse_view(status=status, priority=priority, category=category,
+                               assigned_to=assigned_to, assigned_team=assigned_team)
+    try:
+        return ticket_feed.sse_feed(request, view, stats=stats)
+    except ticket_feed.TooManySubscribers:
+        raise HTTPException(status_code=503, detail="Too many realtime subscribers, try again later")
+
+# The same feed over a WebSocket
+@router.websocket("/ws")
+async def websocket_tickets(
+    websocket: WebSocket,
+    status: Optional[str] = None,
+    priority: Optional[str] = None,
+    category: Optional[str] = None,
+    assigned_to: Optional[str] = None,
+    assigned_team: Optional[str] = None,
+    stats: bool = False,
+):
+    view = ticket_feed.parse_view(status=status, priority=priority, category=category,
+                               assigned_to=assigned_to, assigned_team=assigned_team)
+    await ticket_feed.websocket_feed(websocket, view, stats=stats)
+
 # Get ticket by ID
 @router.get("/{ticket_id}", response_model=TicketResponse)
-async def get_ticket(ticket_id: str):
+async def get_ticket(ticket_id: str, db: Database = Depends(get_db)):
     """
     Get a specific ticket by ID
     """
     try:
-        ticket = await database.db.get_ticket(ticket_id)
+        ticket = await ticket_cache.get(ticket_id, db)
         if not ticket:
             raise HTTPException(status_code=404, detail="Ticket not found")
         return ticket
@@ -88,12 +366,12 @@ async def get_ticket(ticket_id: str):
 
 # Get ticket by ticket number
 @router.get("/number/{ticket_number}", response_model=TicketResponse)
-async def get_ticket_by_number(ticket_number: str):
+async def get_ticket_by_number(ticket_number: str, db: Database = Depends(get_db)):
     """
     Get a specific ticket by ticket number
     """
     try:
-        ticket = await database.db.get_ticket_by_number(ticket_number)
+        ticket = await ticket_cache.get_by_number(ticket_number, db)
         if not ticket:
             raise HTTPException(status_code=404, detail="Ticket not found")
         return ticket
@@ -104,24 +382,44 @@ async def get_ticket_by_number(ticket_number: str):
 
 # Update ticket
 @router.put("/{ticket_id}", response_model=TicketResponse)
-async def update_ticket(ticket_id: str, ticket_update: TicketUpdate):
+async def update_ticket(ticket_id: str, ticket_update: TicketUpdate, db: Database = Depends(get_db)):
     """
     Update a specific ticket
     """
     try:
-        # Check if ticket exists
-        existing_ticket = await database.db.get_ticket(ticket_id)
-        if not existing_ticket:
-            raise HTTPException(status_code=404, detail="Ticket not found")
-        
         # Convert update data to dict, excluding unset fields
         update_data = ticket_update.dict(exclude_unset=True)
         
-        # Update the ticket
-        updated_ticket = await database.db.update_ticket(ticket_id, update_data)
+        # A new priority or category moves the due date, still counted from creation
+        current = None
+        if 'priority' in update_data or 'category' in update_data:
+            current = await ticket_cache.get(ticket_id, db)
+            if current:
+                due = sla.policy.due_date({**current, **update_data})
+                update_data['sla_due_date'] = due.isoformat() if due else None
+        
+        # Update the ticket; no row back means it does not exist
+        existing_ticket = ticket_cache.peek(ticket_id)
+        updated_ticket = await db.update_ticket(ticket_id, update_data)
         if not updated_ticket:
-            raise HTTPException(status_code=500, detail="Failed to update ticket")
+            ticket_cache.invalidate(ticket_id)
+            raise HTTPException(status_code=404, detail="Ticket not found")
         
+        ticket_cache.put(updated_ticket)
+        # Only an actual recategorisation teaches the classifier
+        if update_data.get('category') and (current or {}).get('category') != updated_ticket.get('category'):
+            classifier.learn_ticket(updated_ticket)
+        if duplicates and updated_ticket.get('status') in FINISHED_STATUSES:
+            duplicates.resolve(updated_ticket['ticket_number'])
+        if sla.scheduler:
+            sla.scheduler.track(updated_ticket)
+        if existing_ticket:
+            ticket_stats.record_update(existing_ticket, updated_ticket)
+        else:
+            # Previous status and priority unknown without another query
+            ticket_stats.invalidate()
+        ticket_feed.hub.publish(ticket_feed.UPDATED, updated_ticket,
+                                previous=existing_ticket, changed=list(update_data))
         return updated_ticket
         
     except HTTPException:
@@ -131,21 +429,25 @@ async def update_ticket(ticket_id: str, ticket_update: TicketUpdate):
 
 # Delete ticket
 @router.delete("/{ticket_id}")
-async def delete_ticket(ticket_id: str):
+async def delete_ticket(ticket_id: str, db: Database = Depends(get_db)):
     """
     Delete a specific ticket
     """
     try:
-        # Check if ticket exists
-        existing_ticket = await database.db.get_ticket(ticket_id)
-        if not existing_ticket:
+        # Delete the ticket; the deleted row comes back, or nothing if it did not exist
+        deleted_ticket = await db.delete_ticket(ticket_id)
+        ticket_cache.invalidate(ticket_id)
+        if sla.scheduler:
+            sla.scheduler.untrack(ticket_id)
+        if not deleted_ticket:
             raise HTTPException(status_code=404, detail="Ticket not found")
         
-        # Delete the ticket (you'll need to implement this method in database.py)
-        success = await database.db.delete_ticket(ticket_id)
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to delete ticket")
-        
+        ticket_stats.record_delete(deleted_ticket)
+        if duplicates:
+            # Nothing new may be linked to it, whether it was a duplicate or the incident itself
+            duplicates.discard(deleted_ticket['ticket_number'])
+            duplicates.resolve(deleted_ticket['ticket_number'])
+        ticket_feed.hub.publish(ticket_feed.DELETED, deleted_ticket)
         return MessageResponse(message="Ticket deleted successfully")
         
     except HTTPException:
@@ -155,29 +457,48 @@ async def delete_ticket(ticket_id: str):
 
 # Get ticket statistics
 @router.get("/stats/summary", response_model=TicketSummary)
-async def get_ticket_statistics():
+async def get_ticket_statistics(db: Database = Depends(get_db)):
     """
     Get ticket statistics summary
     """
     try:
-        stats = await database.db.get_ticket_statistics()
-        return stats
+        return await ticket_stats.summary(db)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching statistics: {str(e)}")
 
 # Search tickets by keyword
-@router.get("/search/{keyword}", response_model=List[TicketResponse])
+@router.get("/search/{keyword}", response_model=List[TicketListItem], response_model_exclude_unset=True)
 async def search_tickets(
     keyword: str,
+    response: Response,
+    status: Optional[str] = Query(None, description="Filter by status"),
+    priority: Optional[str] = Query(None, description="Filter by priority"),
     page: int = Query(1, ge=1, description="Page number"),
-    page_size: int = Query(50, ge=1, le=100, description="Items per page")
+    page_size: int = Query(50, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description=f"Cursor from the {NEXT_CURSOR_HEADER} header; overrides page"),
+    fields: Optional[str] = Query(None, description="Comma-separated ticket fields to return"),
+    db: Database = Depends(get_db)
 ):
     """
-    Search tickets by keyword in title or description
+    Search tickets by keyword in title or description, best matches first
     """
     try:
-        # You'll need to implement this method in database.py
-        tickets = await database.db.search_tickets(keyword, page=page, page_size=page_size)
+        after = decode_cursor(cursor) if cursor else None
+        columns = _list_columns(fields)
+        filters = {'status': status, 'priority': priority}
+        tickets = await db.search_tickets(
+            keyword, page=page, page_size=page_size, after=after, columns=columns, filters=filters
+        )
+        _set_next_cursor(response, tickets, page_size, keys=SEARCH_KEYS)
         return tickets
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching tickets: {str(e)}")
+
+# Breaches are recorded by the SLA scheduler, not through this router
+@sla.on_breach
+async def _publish_breach(ticket: dict) -> None:
+    ticket_feed.hub.publish(ticket_feed.UPDATED, ticket, previous=ticket, changed=['sla_breached_at'])
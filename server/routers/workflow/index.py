@@ -0,0 +1,57 @@
+from typing import List
+from fastapi import APIRouter, HTTPException, Request, status
+import jobs
+import llm
+from models import WorkflowTrigger, WorkflowJob, WorkflowAccepted
+from ..chats import SYSTEM_PROMPT, build_message
+
+router = APIRouter()
+
+# Workflow handlers
+@jobs.workflow("chat")
+async def chat_workflow(payload: dict) -> dict:
+    """Answer an employee message with the chatbot"""
+    message = payload.get("message")
+    if not message:
+        raise ValueError("payload.message is required")
+    reply = await llm.client.generate(build_message(message), system_prompt=SYSTEM_PROMPT,
+                                      kind="workflow")
+    return {"reply": reply}
+
+# Submit a workflow job
+@router.post("/workflow/trigger", response_model=WorkflowAccepted, status_code=status.HTTP_202_ACCEPTED)
+async def trigger_workflow(trigger: WorkflowTrigger, request: Request):
+    """
+    Queue a workflow and return its job id immediately
+    """
+    try:
+        job = await jobs.pool.submit(trigger.workflow_type, trigger.payload, trigger.priority)
+    except jobs.UnknownWorkflow:
+        raise HTTPException(status_code=404, detail=f"Unknown workflow type: {trigger.workflow_type}")
+    except jobs.QueueFull:
+        raise HTTPException(status_code=503, detail="Workflow queue is full, retry later")
+
+    return WorkflowAccepted(
+        job_id=job.id,
+        status=job.status,
+        status_url=str(request.url_for("get_workflow_status", job_id=job.id)),
+    )
+
+# Poll a workflow job
+@router.get("/workflow/{job_id}/status", response_model=WorkflowJob)
+async def get_workflow_status(job_id: str):
+    """
+    Get the status and result of a workflow job
+    """
+    job = await jobs.pool.status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# List workflow types
+@router.get("/workflows", response_model=List[str])
+async def list_workflows():
+    """
+    List the registered workflow types
+    """
+    return sorted(jobs.WORKFLOWS)
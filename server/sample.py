@@ -2,16 +2,17 @@ from typing import List
 import asyncio
 import aiohttp
 import random
-from datetime import datetime, timedelta
 
 # Base URL for your API
 BASE_URL = "http://localhost:8000/api/v1/ticket"
 
 # Sample data for generating realistic tickets
-SAMPLE_CATEGORIES = ["Technical", "Billing", "Feature Request", "Bug Report", "Account", "General Inquiry"]
-SAMPLE_PRIORITIES = ["Low", "Medium", "High", "Urgent"]
-SAMPLE_STATUSES = ["Open", "In Progress", "Resolved", "Closed"]
+# Values must match the enums in models/pydantic/ticket.py
+SAMPLE_CATEGORIES = ["password_reset", "vpn_access", "hardware", "software", "network", "email_issues", "access_rights", "other"]
+SAMPLE_PRIORITIES = ["low", "medium", "high", "critical"]
+SAMPLE_SOURCES = ["chatbot", "email", "manual", "phone"]
 SAMPLE_ASSIGNEES = ["alice@company.com", "bob@company.com", "charlie@company.com", "diana@company.com", None]
+SAMPLE_DEPARTMENTS = ["Finance", "Sales", "Engineering", "Operations"]
 
 SAMPLE_TITLES = [
     "Login issues with the new update",
@@ -57,10 +58,6 @@ def generate_sample_ticket(index: int) -> dict:
     """
     Generate a realistic sample ticket with random data
     """
-    # Generate random dates within the last 30 days
-    created_date = datetime.now() - timedelta(days=random.randint(0, 30))
-    updated_date = created_date + timedelta(hours=random.randint(1, 72))
-    
     # 80% chance of having an assignee
     has_assignee = random.random() > 0.2
     
@@ -69,16 +66,15 @@ def generate_sample_ticket(index: int) -> dict:
         "description": random.choice(SAMPLE_DESCRIPTIONS),
         "category": random.choice(SAMPLE_CATEGORIES),
         "priority": random.choice(SAMPLE_PRIORITIES),
-        "status": random.choice(SAMPLE_STATUSES),
+        "source": random.choice(SAMPLE_SOURCES),
         "assigned_to": random.choice(SAMPLE_ASSIGNEES) if has_assignee else None,
-        "reporter_email": f"user{index}@example.com",
-        "created_date": created_date.isoformat(),
-        "updated_date": updated_date.isoformat()
+        "requester_email": f"user{index}@example.com",
+        "requester_name": f"Sample User {index}"
     }
     
     # Add optional fields with some probability
     if random.random() > 0.7:  # 30% chance
-        ticket_data["due_date"] = (datetime.now() + timedelta(days=random.randint(1, 14))).isoformat()
+        ticket_data["department"] = random.choice(SAMPLE_DEPARTMENTS)
     
     if random.random() > 0.5:  # 50% chance
         ticket_data["tags"] = ["customer-reported", "v2.1"]
@@ -170,10 +166,11 @@ def create_simple_sample():
     sample_ticket = {
         "title": "Sample Ticket - Login Issue",
         "description": "Users are unable to login with correct credentials after the recent update.",
-        "category": "Technical",
-        "priority": "High",
-        "status": "Open",
-        "reporter_email": "testuser@example.com"
+        "category": "software",
+        "priority": "high",
+        "source": "manual",
+        "requester_email": "testuser@example.com",
+        "requester_name": "Test User"
     }
     
     try:
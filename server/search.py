@@ -0,0 +1,126 @@
+import bisect
+import math
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+# Prefix terms expanded per query token; bounds the cost of 1-2 letter queries
+MAX_PREFIX_EXPANSIONS = 64
+TITLE_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+PREFIX_MATCH_WEIGHT = 0.5
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall((text or "").lower())
+
+
+def to_prefix_tsquery(keyword: str) -> Optional[str]:
+    """
+    Build a Postgres tsquery that prefix-matches every word in keyword.
+
+    Only word characters survive tokenisation, so the result is safe to pass
+    to to_tsquery() without escaping.
+    """
+    tokens = tokenize(keyword)
+    return " & ".join(f"{token}:*" for token in tokens) if tokens else None
+
+
+class TicketSearchIndex:
+    """
+    In-process inverted index over ticket title and description.
+
+    Used when the Postgres search RPC is not available (local and test
+    setups). Mirrors its semantics: every query word must match, words match
+    as prefixes, title hits weigh more than description hits, and results are
+    ordered by (score, id) descending so keyset cursors work the same way.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._terms: List[str] = []
+        self._docs: Dict[str, Tuple[Set[str], dict]] = {}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, ticket: dict) -> None:
+        ticket_id = str(ticket['id'])
+        self.remove(ticket_id)
+
+        weights: Dict[str, float] = {}
+        for token in tokenize(ticket.get('title')):
+            weights[token] = weights.get(token, 0.0) + TITLE_WEIGHT
+        for token in tokenize(ticket.get('description')):
+            weights[token] = weights.get(token, 0.0) + DESCRIPTION_WEIGHT
+
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            postings[ticket_id] = weight
+
+        attributes = {key: ticket.get(key) for key in ('status', 'priority')}
+        self._docs[ticket_id] = (set(weights), attributes)
+
+    def remove(self, ticket_id: str) -> None:
+        doc = self._docs.pop(str(ticket_id), None)
+        if doc is None:
+            return
+        for term in doc[0]:
+            postings = self._postings[term]
+            postings.pop(str(ticket_id), None)
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def _expand(self, token: str) -> List[str]:
+        start = bisect.bisect_left(self._terms, token)
+        matches = []
+        for term in self._terms[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            matches.append(term)
+        return matches
+
+    def search(self, query: str, filters: Optional[dict] = None, limit: int = 50,
+               offset: int = 0, after: Optional[Tuple[float, str]] = None) -> List[Tuple[str, float]]:
+        """Return up to limit (ticket_id, score) pairs, best first"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        total = len(self._docs) or 1
+        scores: Optional[Dict[str, float]] = None
+        for token in tokens:
+            token_scores: Dict[str, float] = {}
+            for term in self._expand(token):
+                postings = self._postings[term]
+                idf = math.log(1 + total / len(postings))
+                factor = 1.0 if term == token else PREFIX_MATCH_WEIGHT
+                for ticket_id, weight in postings.items():
+                    score = weight * idf * factor
+                    if score > token_scores.get(ticket_id, 0.0):
+                        token_scores[ticket_id] = score
+            # Every query word has to match
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {tid: s + token_scores[tid] for tid, s in scores.items() if tid in token_scores}
+            if not scores:
+                return []
+
+        results = []
+        for ticket_id, score in scores.items():
+            attributes = self._docs[ticket_id][1]
+            if filters and any(v is not None and attributes.get(k) != v for k, v in filters.items()):
+                continue
+            score = round(score, 6)
+            if after is not None and (score, ticket_id) >= tuple(after):
+                continue
+            results.append((ticket_id, score))
+
+        results.sort(key=lambda r: (r[1], r[0]), reverse=True)
+        return results[offset:offset + limit]
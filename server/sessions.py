@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Optional
+
+from cache import LRUCache, RedisBackend
+from storage import connect, data_path
+
+# "sqlite" (default, survives restarts), "redis" (shared by every worker) or "memory"
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH") or data_path("sessions.sqlite3")
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+# Sessions kept by the memory backend
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "2000"))
+# Approximate prompt tokens allowed for the history sent with each message
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "1500"))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "300"))
+# Most recent turns always kept word for word
+SESSION_KEEP_TURNS = int(os.getenv("SESSION_KEEP_TURNS", "6"))
+# Appends to one session are serialised; sessions share this many locks
+_LOCK_STRIPES = 64
+# Times an append re-reads the session after another worker wrote it first
+_APPEND_ATTEMPTS = 5
+
+# Stores ARGV[1] only if the stored session is still at version ARGV[2] (0: absent)
+_REDIS_COMPARE_AND_SET = """
+local current = redis.call('GET', KEYS[1])
+local version = 0
+if current then version = cjson.decode(current)['version'] or 0 end
+if version ~= tonumber(ARGV[2]) then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+class SessionNotFound(LookupError):
+    """Raised when a session belongs to another user"""
+
+class SessionConflict(RuntimeError):
+    """Raised when other writers keep winning the race to append to a session"""
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text
+    return len(text or "") // 4 + 1
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def turn(role: str, content: str) -> dict:
+    return {"role": role, "content": content, "at": _now()}
+
+def summarize_turns(summary: str, turns: List[dict], max_tokens: int = SESSION_SUMMARY_TOKENS) -> str:
+    """
+    Fold turns into the running summary without another LLM call.
+
+    Keeps the first sentence of each turn; when the summary outgrows
+    max_tokens, its oldest lines are dropped first.
+    """
+    lines = [line for line in (summary or "").split("\n") if line]
+    for t in turns:
+        first_sentence = t["content"].strip().split("\n")[0].split(". ")[0][:200]
+        speaker = "Employee" if t["role"] == "user" else "Sahay"
+        lines.append(f"{speaker}: {first_sentence}")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+class SQLiteSessionBackend:
+    """Sessions in a local SQLite file, shared by the workers on one host"""
+
+    def __init__(self, path: str = SESSION_STORE_PATH):
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_sessions ("
+            " id TEXT PRIMARY KEY, expires_at REAL NOT NULL, data TEXT NOT NULL,"
+            " version INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def _run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._lock:
+            return fn(self._conn)
+
+    async def get(self, key: str) -> Optional[str]:
+        row = await asyncio.to_thread(self._run, lambda conn: conn.execute(
+            "SELECT data FROM chat_sessions WHERE id = ? AND expires_at > ?", (key, time.time())
+        ).fetchone())
+        return row[0] if row else None
+
+    async def compare_and_set(self, key: str, value: str, ttl: float, version: int) -> bool:
+        """Store value as version + 1 if the stored session is still at version (0: absent)"""
+        def write(conn: sqlite3.Connection) -> bool:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM chat_sessions WHERE expires_at <= ?", (now,))
+                if version:
+                    cursor = conn.execute(
+                        "UPDATE chat_sessions SET data = ?, expires_at = ?, version = ? WHERE id = ? AND version = ?",
+                        (value, now + ttl, version + 1, key, version))
+                else:
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO chat_sessions (id, expires_at, data, version) VALUES (?, ?, ?, 1)",
+                        (key, now + ttl, value))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return cursor.rowcount == 1
+        return await asyncio.to_thread(self._run, write)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._run, lambda conn: conn.execute(
+            "DELETE FROM chat_sessions WHERE id = ?", (key,)
+        ))
+
+class RedisSessionBackend(RedisBackend):
+    """Sessions in Redis, shared by every worker"""
+
+    def __init__(self, prefix: str = "sahay:session:"):
+        super().__init__(prefix=prefix)
+        self._compare_and_set = self._redis.register_script(_REDIS_COMPARE_AND_SET)
+
+    async def compare_and_set(self, key: str, value: str, ttl: float, version: int) -> bool:
+        """Store value if the stored session is still at version (0: absent)"""
+        return bool(await self._compare_and_set(keys=[self.prefix + key],
+                                                args=[value, version, max(1, int(ttl))]))
+
+class SessionStore:
+    """
+    Multi-turn chat sessions in a shared backend, or in an in-process LRU
+    when backend is None.
+
+    Shared backends are read through on every get, and appends are a
+    compare-and-set on the session's version, retried when another worker
+    appended first, so no worker serves or overwrites a stale copy.
+
+    Each session holds a running summary and the recent turns. Once the turns
+    exceed token_budget, the oldest are folded into the summary, so the
+    history sent to the LLM stays bounded however long the conversation runs.
+    """
+
+    def __init__(self, backend=None, ttl: float = SESSION_TTL_SECONDS,
+                 max_entries: int = SESSION_CACHE_MAX_ENTRIES,
+                 token_budget: int = SESSION_TOKEN_BUDGET, keep_turns: int = SESSION_KEEP_TURNS):
+        self.backend = backend
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self._local = LRUCache(max_entries=max_entries, ttl=ttl) if backend is None else None
+        self._locks: Optional[List[asyncio.Lock]] = None
+
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        if self._locks is None:
+            self._locks = [asyncio.Lock() for _ in range(_LOCK_STRIPES)]
+        return self._locks[hash(session_id) % _LOCK_STRIPES]
+
+    @staticmethod
+    def new(user_id: Optional[str] = None) -> dict:
+        return {"id": str(uuid.uuid4()), "user_id": user_id, "summary": "", "turns": [],
+                "created_at": _now(), "updated_at": _now(), "version": 0}
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        if self.backend is None:
+            return self._local.get(session_id)
+        data = await self.backend.get(session_id)
+        return json.loads(data) if data else None
+
+    async def get_owned(self, session_id: str, user_id: Optional[str]) -> Optional[dict]:
+        """The session if user_id owns it; someone else's session is treated as missing"""
+        session = await self.get(session_id)
+        if session and session.get("user_id") != user_id:
+            return None
+        return session
+
+    async def append(self, session_id: str, *turns: dict, user_id: Optional[str] = None) -> dict:
+        """Add turns to a session, creating it for user_id if needed, and compact it"""
+        async with self._lock(session_id):
+            for attempt in range(_APPEND_ATTEMPTS):
+                if attempt:
+                    # Let the other writer finish before re-reading
+                    await asyncio.sleep(random.uniform(0, 0.01 * attempt))
+                session = await self.get(session_id) or {**self.new(user_id), "id": session_id}
+                if session.get("user_id") != user_id:
+                    raise SessionNotFound(session_id)
+                version = session.get("version", 0)
+                session["turns"].extend(turns)
+                self._compact(session)
+                session["updated_at"] = _now()
+                session["version"] = version + 1
+                if self.backend is None:
+                    self._local.set(session_id, session)
+                    return session
+                if await self.backend.compare_and_set(session_id, json.dumps(session), self.ttl, version):
+                    return session
+            raise SessionConflict(session_id)
+
+    def _compact(self, session: dict) -> None:
+        recent = session["turns"]
+        while (len(recent) > self.keep_turns
+               and sum(estimate_tokens(t["content"]) for t in recent) > self.token_budget):
+            # Fold the oldest exchange (user + reply) in one go
+            folded, recent = recent[:2], recent[2:]
+            session["summary"] = summarize_turns(session["summary"], folded)
+        session["turns"] = recent
+
+    async def delete(self, session_id: str) -> None:
+        if self.backend is None:
+            self._local.pop(session_id)
+        else:
+            await self.backend.delete(session_id)
+
+    @staticmethod
+    def history(session: dict) -> List[dict]:
+        """Session as a ticket chat_history: the summary, then the kept turns"""
+        history = []
+        if session.get("summary"):
+            history.append({"role": "summary", "content": session["summary"], "at": session["created_at"]})
+        return history + session["turns"]
+
+def build_session_store() -> SessionStore:
+    """Store configured by SESSION_BACKEND (sqlite, redis or memory)"""
+    if SESSION_BACKEND == "redis":
+        return SessionStore(backend=RedisSessionBackend())
+    if SESSION_BACKEND == "sqlite":
+        return SessionStore(backend=SQLiteSessionBackend())
+    return SessionStore()
+
+# Shared by the chat and ticket routers
+sessions = build_session_store()
@@ -0,0 +1,68 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Flight(Generic[T]):
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[T]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one.
+
+    The first caller for a key starts the work; callers arriving while it is
+    in flight wait for the same result (or exception) instead of starting
+    their own. A waiter that is cancelled, e.g. because its client
+    disconnected, only stops waiting; the shared call is cancelled once no
+    one is waiting for it any more. on_coalesce is called for each caller
+    that joins a call already in flight.
+    """
+
+    def __init__(self, on_coalesce: Optional[Callable[[], None]] = None):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.on_coalesce = on_coalesce
+        self.calls = 0
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        flight = self._flights.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.coalesced += 1
+            if self.on_coalesce is not None:
+                self.on_coalesce()
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _forget(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        total = self.calls + self.coalesced
+        return {
+            "upstream_calls": self.calls,
+            "coalesced_calls": self.coalesced,
+            "in_flight": self.in_flight,
+            "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+        }
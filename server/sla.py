@@ -0,0 +1,290 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from datetime import date, datetime, time as clock, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from metrics import REGISTRY, SLA_BREACHES, SLA_TRACKED
+from models import TicketCategory, TicketPriority, TicketStatus
+from ticket_cache import ticket_cache
+
+logger = logging.getLogger(__name__)
+
+# Business hours to resolve a ticket, by priority
+SLA_TARGET_HOURS = os.getenv("SLA_TARGET_HOURS", "critical=4,high=8,medium=24,low=40")
+# Scales the priority target for quick or slow categories, e.g. password resets
+SLA_CATEGORY_FACTORS = os.getenv("SLA_CATEGORY_FACTORS", "password_reset=0.5,hardware=1.5")
+# Priorities whose clock runs around the clock instead of in business hours
+SLA_ROUND_THE_CLOCK = os.getenv("SLA_ROUND_THE_CLOCK", "critical")
+SLA_TIMEZONE = os.getenv("SLA_TIMEZONE", "Asia/Kolkata")
+SLA_BUSINESS_HOURS = os.getenv("SLA_BUSINESS_HOURS", "09:00-18:00")
+SLA_BUSINESS_DAYS = os.getenv("SLA_BUSINESS_DAYS", "mon,tue,wed,thu,fri")
+# Comma-separated YYYY-MM-DD dates with no business hours
+SLA_HOLIDAYS = os.getenv("SLA_HOLIDAYS", "")
+# Whether this worker fires breaches; due dates are set either way
+SLA_SCHEDULER = os.getenv("SLA_SCHEDULER", "on") != "off"
+# A breach that could not be checked or recorded is tried again after this long
+SLA_RETRY_SECONDS = float(os.getenv("SLA_RETRY_SECONDS", "30"))
+
+# Tickets in these states are on the clock; any other state takes them off the schedule
+ACTIVE_STATUSES = (TicketStatus.OPEN.value, TicketStatus.IN_PROGRESS.value)
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+# A calendar with no business hours in this many days is misconfigured
+MAX_CALENDAR_DAYS = 3660
+REBUILD_PAGE_SIZE = 1000
+REBUILD_COLUMNS = ["id", "ticket_number", "status", "priority", "category", "created_at",
+                   "sla_due_date", "sla_breached_at"]
+
+
+def _pairs(spec: str) -> Dict[str, float]:
+    pairs = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        pairs[name.strip()] = float(value)
+    return pairs
+
+def parse_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+class BusinessCalendar:
+    """
+    Working hours of the service desk: a daily window on business days in
+    one time zone, minus holidays. Windows are converted to UTC day by day,
+    so daylight-saving changes move them the way a wall clock would.
+    """
+
+    def __init__(self, tz: str = SLA_TIMEZONE, hours: str = SLA_BUSINESS_HOURS,
+                 days: str = SLA_BUSINESS_DAYS, holidays: str = SLA_HOLIDAYS):
+        try:
+            self.tz = ZoneInfo(tz)
+        except ZoneInfoNotFoundError:
+            logger.warning("sla.unknown_timezone", extra={"timezone": tz})
+            self.tz = timezone.utc
+        opens, _, closes = hours.partition("-")
+        self.opens, self.closes = clock.fromisoformat(opens.strip()), clock.fromisoformat(closes.strip())
+        self.days = {WEEKDAYS.index(d.strip().lower()[:3]) for d in days.split(",") if d.strip()}
+        self.holidays = {date.fromisoformat(d.strip()) for d in holidays.split(",") if d.strip()}
+
+    def window(self, day: date) -> Optional[Tuple[datetime, datetime]]:
+        """Business hours of day in UTC, or None when it has none"""
+        if day.weekday() not in self.days or day in self.holidays:
+            return None
+        opens = datetime.combine(day, self.opens, self.tz).astimezone(timezone.utc)
+        closes = datetime.combine(day, self.closes, self.tz).astimezone(timezone.utc)
+        return opens, closes
+
+    def add(self, start: datetime, hours: float) -> datetime:
+        """The moment `hours` business hours after start"""
+        remaining = timedelta(hours=hours)
+        day = start.astimezone(self.tz).date()
+        for _ in range(MAX_CALENDAR_DAYS):
+            window = self.window(day)
+            if window:
+                begin = max(start, window[0])
+                if begin < window[1]:
+                    if remaining <= window[1] - begin:
+                        return begin + remaining
+                    remaining -= window[1] - begin
+            day += timedelta(days=1)
+        raise ValueError("Business calendar has no working hours")
+
+class SLAPolicy:
+    """
+    Due dates for tickets.
+
+    The target is a number of hours for the ticket's priority, scaled by a
+    factor for its category, counted on the business calendar from the
+    moment the ticket was created. Round-the-clock priorities count
+    wall-clock hours instead.
+    """
+
+    def __init__(self, targets: str = SLA_TARGET_HOURS, factors: str = SLA_CATEGORY_FACTORS,
+                 round_the_clock: str = SLA_ROUND_THE_CLOCK, calendar: Optional[BusinessCalendar] = None):
+        self.targets = _pairs(targets)
+        self.factors = _pairs(factors)
+        self.round_the_clock = {p.strip() for p in round_the_clock.split(",") if p.strip()}
+        self.calendar = calendar or BusinessCalendar()
+
+    def target_hours(self, priority: str, category: Optional[str]) -> Optional[float]:
+        hours = self.targets.get(priority)
+        if hours is None:
+            return None
+        return hours * self.factors.get(category or TicketCategory.OTHER.value, 1.0)
+
+    def due_date(self, ticket: dict, created_at: Optional[datetime] = None) -> Optional[datetime]:
+        priority = TicketPriority(ticket.get('priority') or TicketPriority.MEDIUM).value
+        category = TicketCategory(ticket.get('category') or TicketCategory.OTHER).value
+        hours = self.target_hours(priority, category)
+        if hours is None:
+            return None
+        start = created_at or parse_datetime(ticket.get('created_at')) or datetime.now(timezone.utc)
+        if priority in self.round_the_clock:
+            return start + timedelta(hours=hours)
+        return self.calendar.add(start, hours)
+
+    def apply(self, rows: List[dict]) -> None:
+        """Set sla_due_date on ticket rows about to be inserted"""
+        now = datetime.now(timezone.utc)
+        for row in rows:
+            due = self.due_date(row, created_at=now)
+            row['sla_due_date'] = due.isoformat() if due else None
+
+BreachHandler = Callable[[dict], Awaitable[None]]
+
+# Called with the ticket, in order, when its SLA is breached
+BREACH_HANDLERS: List[BreachHandler] = []
+
+def on_breach(handler: BreachHandler) -> BreachHandler:
+    """Register an async handler for SLA breaches"""
+    BREACH_HANDLERS.append(handler)
+    return handler
+
+class SLAScheduler:
+    """
+    Fires SLA breaches at each ticket's due date, without polling.
+
+    Tickets on the clock sit in a min-heap keyed by due date, and one task
+    sleeps until the earliest of them, waking early when a sooner one is
+    added. A ticket that is updated or taken off the clock keeps its old
+    heap entry, which is skipped when it comes up because it no longer
+    matches the ticket's current due date; the heap is compacted once such
+    entries outnumber the live ones.
+
+    Before firing, the ticket is read back from the database, so changes
+    made through other workers are respected. sla_breached_at is then set
+    only if it is still empty, and handlers run only for the write that set
+    it, so a breach fires once however many workers schedule it and is not
+    scheduled again after a restart. A breach that fails to be read or
+    written is retried after SLA_RETRY_SECONDS. start() rebuilds the heap
+    from the open tickets.
+    """
+
+    def __init__(self, policy: SLAPolicy):
+        self.policy = policy
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def tracked(self) -> int:
+        return len(self._due)
+
+    def track(self, ticket: dict) -> None:
+        """Schedule ticket's breach, or take it off the schedule when its clock has stopped"""
+        ticket_id = str(ticket['id'])
+        due = parse_datetime(ticket.get('sla_due_date')) or self.policy.due_date(ticket)
+        if ticket.get('status') not in ACTIVE_STATUSES or ticket.get('sla_breached_at') or due is None:
+            self.untrack(ticket_id)
+            return
+        self._schedule(ticket_id, due.timestamp())
+
+    def _schedule(self, ticket_id: str, due_at: float) -> None:
+        if self._due.get(ticket_id) == due_at:
+            return
+        self._due[ticket_id] = due_at
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (due_at, ticket_id))
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(due, tid) for tid, due in self._due.items()]
+            heapq.heapify(self._heap)
+        if self._wakeup is not None and (earliest is None or due_at < earliest):
+            self._wakeup.set()
+
+    def untrack(self, ticket_id: str) -> None:
+        self._due.pop(str(ticket_id), None)
+
+    async def start(self, db) -> None:
+        await self.rebuild(db)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def rebuild(self, db) -> None:
+        """Schedule every open ticket, a page at a time per status"""
+        try:
+            for status in ACTIVE_STATUSES:
+                after = None
+                while True:
+                    page = await db.get_tickets(filters={'status': status}, page_size=REBUILD_PAGE_SIZE,
+                                                after=after, columns=REBUILD_COLUMNS)
+                    for ticket in page:
+                        self.track(ticket)
+                    if len(page) < REBUILD_PAGE_SIZE:
+                        break
+                    after = (page[-1]['created_at'], page[-1]['id'])
+        except Exception as e:
+            logger.warning("sla.rebuild_failed", extra={"error": str(e)})
+        logger.info("sla.rebuilt", extra={"tickets": self.tracked})
+
+    async def _run(self, db) -> None:
+        while True:
+            self._wakeup.clear()
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            due_at, ticket_id = self._heap[0]
+            delay = due_at - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            del self._due[ticket_id]
+            try:
+                await self._breach(db, ticket_id)
+            except Exception:
+                logger.exception("sla.breach_failed", extra={"ticket_id": ticket_id})
+                # Safe to repeat: a breach already recorded is not fired again
+                self._schedule(ticket_id, time.time() + SLA_RETRY_SECONDS)
+
+    async def _breach(self, db, ticket_id: str) -> None:
+        ticket = await db.get_ticket(ticket_id, raise_errors=True)
+        if not ticket or ticket.get('status') not in ACTIVE_STATUSES or ticket.get('sla_breached_at'):
+            return
+        due = parse_datetime(ticket.get('sla_due_date')) or self.policy.due_date(ticket)
+        if due is None or due.timestamp() > time.time():
+            # Changed elsewhere since it was scheduled
+            self.track(ticket)
+            return
+        breached_at = datetime.now(timezone.utc).isoformat()
+        ticket = await db.update_ticket(ticket_id, {'sla_breached_at': breached_at},
+                                        only_if_null='sla_breached_at')
+        if not ticket:
+            # Another worker recorded it first, or the ticket is gone
+            return
+        ticket_cache.put(ticket)
+        SLA_BREACHES.labels(ticket.get('priority') or "unknown").inc()
+        logger.warning("sla.breached", extra={
+            "ticket_id": ticket_id, "ticket_number": ticket.get('ticket_number'),
+            "priority": ticket.get('priority'), "sla_due_date": ticket.get('sla_due_date'),
+        })
+        for handler in BREACH_HANDLERS:
+            await handler(ticket)
+
+# Shared by the ticket router and startup
+policy = SLAPolicy()
+scheduler = SLAScheduler(policy) if SLA_SCHEDULER else None
+
+@REGISTRY.collector
+async def _sla_metrics() -> None:
+    if scheduler is not None:
+        SLA_TRACKED.labels().set(scheduler.tracked)
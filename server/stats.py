@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STATS_TTL_SECONDS = float(os.getenv("STATS_TTL_SECONDS", "30"))
+
+DIMENSIONS = ('status', 'priority', 'category')
+
+Counts = Dict[str, Dict[str, int]]
+
+
+def summarize(counts: Counts) -> dict:
+    """Build the TicketSummary payload from grouped counts"""
+    by_status = counts.get('status', {})
+    by_priority = counts.get('priority', {})
+    return {
+        'total_tickets': sum(by_status.values()),
+        'open_tickets': by_status.get('open', 0),
+        'in_progress_tickets': by_status.get('in_progress', 0),
+        'resolved_tickets': by_status.get('resolved', 0),
+        'high_priority_tickets': by_priority.get('high', 0),
+        'critical_tickets': by_priority.get('critical', 0),
+        'by_status': dict(by_status),
+        'by_priority': dict(by_priority),
+        'by_category': dict(counts.get('category', {})),
+    }
+
+
+class TicketStatsCache:
+    """
+    In-memory ticket counters for the dashboard.
+
+    Loaded from one grouped query, then kept current by applying the deltas of
+    every create/update/delete made through this worker. Counters are reloaded
+    after ttl seconds so writes made by other workers are picked up.
+    """
+
+    def __init__(self, ttl: float = STATS_TTL_SECONDS):
+        self.ttl = ttl
+        self._counts: Optional[Counts] = None
+        self._loaded_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _is_fresh(self) -> bool:
+        return self._counts is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def summary(self, db) -> dict:
+        if not self._is_fresh():
+            # Only one request reloads; the others wait and reuse its result
+            async with self.lock:
+                if not self._is_fresh():
+                    await self._reload(db)
+        return summarize(self._counts or {})
+
+    async def _reload(self, db) -> None:
+        try:
+            self._counts = await db.get_ticket_counts()
+            self._loaded_at = time.monotonic()
+        except Exception as e:
+            logger.error("Error refreshing ticket statistics: %s", e)
+            if self._counts is None:
+                raise
+
+    def invalidate(self) -> None:
+        self._counts = None
+
+    def _apply(self, ticket: dict, delta: int) -> None:
+        if self._counts is None or not ticket:
+            return
+        for dimension in DIMENSIONS:
+            value = ticket.get(dimension)
+            if value is None:
+                continue
+            value = getattr(value, 'value', value)
+            bucket = self._counts.setdefault(dimension, {})
+            bucket[value] = max(0, bucket.get(value, 0) + delta)
+
+    def record_create(self, ticket: dict) -> None:
+        self._apply(ticket, 1)
+
+    def record_update(self, before: dict, after: dict) -> None:
+        self._apply(before, -1)
+        self._apply(after, 1)
+
+    def record_delete(self, ticket: dict) -> None:
+        self._apply(ticket, -1)
+
+
+# Shared by the ticket router
+ticket_stats = TicketStatsCache()
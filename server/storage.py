@@ -0,0 +1,17 @@
+import os
+import sqlite3
+
+# Local SQLite files (the sqlite database backend, sessions, the job broker and
+# the realtime relay) live here unless their own *_PATH says otherwise, so
+# they stay out of the source tree
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(
+    os.getenv("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share"), "sahayak"
+))
+
+def data_path(name: str) -> str:
+    return os.path.join(DATA_DIR, name)
+
+def connect(path: str) -> sqlite3.Connection:
+    """Autocommit connection usable from worker threads, creating its directory if needed"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return sqlite3.connect(path, check_same_thread=False, isolation_level=None)
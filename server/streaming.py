@@ -0,0 +1,88 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+import llm
+
+logger = logging.getLogger(__name__)
+
+# Chunks buffered between the model and a slow client before we stop reading upstream
+STREAM_BUFFER_CHUNKS = 32
+
+_DONE = object()
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Format a single Server-Sent Event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def text_chunks(text: str) -> AsyncIterator[str]:
+    """Stream an already complete reply through the same SSE path"""
+    yield text
+
+
+async def _pump(chunks: AsyncIterator[str], queue: asyncio.Queue) -> None:
+    """Copy model chunks into the bounded queue, then any error, then a terminal marker"""
+    try:
+        async for chunk in chunks:
+            # Blocks while the client is behind, which pauses the upstream read
+            await queue.put(chunk)
+    except llm.LLMError as e:
+        await queue.put(e)
+    except Exception as e:
+        # Session or cache backend failures, or bugs: the client still hears about it
+        logger.exception("stream.failed")
+        await queue.put(e)
+    finally:
+        await chunks.aclose()
+    await queue.put(_DONE)
+
+
+async def sse_events(request: Request, chunks: AsyncIterator[str],
+                     buffer: int = STREAM_BUFFER_CHUNKS) -> AsyncIterator[str]:
+    """
+    Relay model chunks to the client as SSE messages.
+
+    The model is read by a separate task through a bounded queue, so a slow
+    client applies backpressure instead of growing memory, and the upstream
+    stream is cancelled as soon as the client disconnects.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=buffer)
+    producer = asyncio.create_task(_pump(chunks, queue))
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=llm.DISCONNECT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                continue
+
+            if item is _DONE:
+                yield sse_event({}, event="done")
+                break
+            if isinstance(item, Exception):
+                detail = str(item) if isinstance(item, llm.LLMError) else "The reply could not be completed"
+                yield sse_event({"detail": detail}, event="error")
+                continue
+            yield sse_event({"token": item})
+    finally:
+        producer.cancel()
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
+
+
+def sse_response(request: Request, chunks: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        sse_events(request, chunks),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,81 @@
+import os
+from typing import Dict, Optional
+
+from cache import LRUCache
+from metrics import CACHE_REQUESTS
+
+TICKET_CACHE_MAX_ENTRIES = int(os.getenv("TICKET_CACHE_MAX_ENTRIES", "5000"))
+# Bounds how stale a ticket changed by another worker can be
+TICKET_CACHE_TTL_SECONDS = float(os.getenv("TICKET_CACHE_TTL_SECONDS", "30"))
+
+class TicketCache:
+    """
+    Read-through cache of full ticket rows, keyed by id and by ticket_number.
+
+    Writes made through this worker update or drop the cached copy, so it is
+    exact for them; changes made by other workers show up after ttl. A read
+    that races a write never stores the row it fetched before the write.
+    """
+
+    def __init__(self, max_entries: int = TICKET_CACHE_MAX_ENTRIES,
+                 ttl: float = TICKET_CACHE_TTL_SECONDS):
+        self._tickets = LRUCache(max_entries=max_entries, ttl=ttl)
+        self._ids_by_number = LRUCache(max_entries=max_entries, ttl=ttl)
+        # Bumped on every write so in-flight reads know their row is stale
+        self._versions: Dict[str, int] = {}
+        self._epoch = 0
+        self._writes = 0
+
+    def peek(self, ticket_id: str) -> Optional[dict]:
+        """Cached row without touching the database"""
+        return self._tickets.get(str(ticket_id))
+
+    async def get(self, ticket_id: str, db) -> Optional[dict]:
+        ticket = self.peek(ticket_id)
+        CACHE_REQUESTS.labels("ticket", "miss" if ticket is None else "hit").inc()
+        if ticket is None:
+            version = self._version(ticket_id)
+            ticket = await db.get_ticket(ticket_id)
+            if ticket and self._version(ticket_id) == version:
+                self.put(ticket)
+        return ticket
+
+    async def get_by_number(self, ticket_number: str, db) -> Optional[dict]:
+        ticket_id = self._ids_by_number.get(ticket_number)
+        ticket = self.peek(ticket_id) if ticket_id else None
+        CACHE_REQUESTS.labels("ticket", "miss" if ticket is None else "hit").inc()
+        if ticket is None:
+            # The id is unknown until the row arrives, so any write in between counts
+            writes = self._writes
+            ticket = await db.get_ticket_by_number(ticket_number)
+            if ticket and self._writes == writes:
+                self.put(ticket)
+        return ticket
+
+    def put(self, ticket: dict) -> None:
+        ticket_id = str(ticket['id'])
+        self._bump(ticket_id)
+        self._tickets.set(ticket_id, ticket)
+        if ticket.get('ticket_number'):
+            self._ids_by_number.set(ticket['ticket_number'], ticket_id)
+
+    def invalidate(self, ticket_id: str) -> None:
+        ticket_id = str(ticket_id)
+        self._bump(ticket_id)
+        ticket = self._tickets.pop(ticket_id)
+        if ticket and ticket.get('ticket_number'):
+            self._ids_by_number.pop(ticket['ticket_number'])
+
+    def _version(self, ticket_id: str):
+        return self._epoch, self._versions.get(str(ticket_id), 0)
+
+    def _bump(self, ticket_id: str) -> None:
+        # Versions only matter while a read is in flight; keep the map bounded
+        if len(self._versions) >= 4 * self._tickets.max_entries:
+            self._versions.clear()
+            self._epoch += 1
+        self._writes += 1
+        self._versions[ticket_id] = self._versions.get(ticket_id, 0) + 1
+
+# Shared by the ticket router
+ticket_cache = TicketCache()
@@ -0,0 +1,443 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from fastapi import Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from metrics import REALTIME_DROPPED, REALTIME_EVENTS, REALTIME_SUBSCRIBERS, REGISTRY
+from models import TICKET_LIST_FIELDS
+from stats import ticket_stats
+from storage import connect, data_path
+
+logger = logging.getLogger(__name__)
+
+# "memory" reaches clients of this worker only; "sqlite" relays events between
+# the workers on one host through REALTIME_BROKER_PATH
+REALTIME_BROKER = os.getenv("REALTIME_BROKER", "memory")
+REALTIME_BROKER_PATH = os.getenv("REALTIME_BROKER_PATH") or data_path("realtime.sqlite3")
+REALTIME_POLL_SECONDS = float(os.getenv("REALTIME_POLL_SECONDS", "0.1"))
+# Relayed events are kept this long for workers that fall behind
+REALTIME_RETENTION_SECONDS = float(os.getenv("REALTIME_RETENTION_SECONDS", "60"))
+REALTIME_MAX_SUBSCRIBERS = int(os.getenv("REALTIME_MAX_SUBSCRIBERS", "5000"))
+# Per-connection buffer of undelivered events, in tickets and in bytes
+REALTIME_MAX_QUEUED = int(os.getenv("REALTIME_MAX_QUEUED", "500"))
+REALTIME_MAX_BUFFER_BYTES = int(os.getenv("REALTIME_MAX_BUFFER_BYTES", str(256 * 1024)))
+# A client that takes longer than this to accept one message is disconnected
+REALTIME_SEND_TIMEOUT_SECONDS = float(os.getenv("REALTIME_SEND_TIMEOUT_SECONDS", "10"))
+REALTIME_HEARTBEAT_SECONDS = float(os.getenv("REALTIME_HEARTBEAT_SECONDS", "15"))
+# Stats subscribers get a fresh summary at most this often, and only after a change
+REALTIME_STATS_INTERVAL_SECONDS = float(os.getenv("REALTIME_STATS_INTERVAL_SECONDS", "2"))
+
+# Views can be filtered on these fields; each takes a set of accepted values
+FILTER_FIELDS = ("status", "priority", "category", "assigned_to", "assigned_team")
+# Ticket fields carried by events: the list view plus what realtime views care about
+EVENT_FIELDS = TICKET_LIST_FIELDS + ("parent_ticket_number", "sla_due_date", "sla_breached_at")
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+# Buffer keys that are not ticket ids
+RESYNC_KEY = "resync"
+STATS_KEY = "stats"
+RESYNC = json.dumps({"type": "resync"})
+PING = json.dumps({"type": "ping"})
+# WebSocket close code for "try again later": the worker is full or the client fell behind
+TRY_AGAIN_LATER = 1013
+
+View = Dict[str, FrozenSet[str]]
+
+
+class SlowConsumer(Exception):
+    """Raised to the sender of a connection that fell too far behind and was dropped"""
+
+
+class TooManySubscribers(Exception):
+    """Raised when this worker already serves REALTIME_MAX_SUBSCRIBERS connections"""
+
+
+def parse_view(**params: Optional[str]) -> View:
+    """A view from comma-separated filter values, e.g. status="open,in_progress"; unset fields match anything"""
+    view = {}
+    for field, value in params.items():
+        values = frozenset(v.strip() for v in (value or "").split(",") if v.strip())
+        if values:
+            view[field] = values
+    return view
+
+
+def _field(ticket: dict, field: str) -> Optional[str]:
+    value = ticket.get(field)
+    return None if value is None else str(getattr(value, 'value', value))
+
+
+def _matches(view: View, ticket: Optional[dict]) -> bool:
+    return ticket is not None and all(_field(ticket, field) in values for field, values in view.items())
+
+
+class Subscription:
+    """
+    One connection's view and its buffer of undelivered events.
+
+    The buffer holds the latest event per ticket, so a client that is a
+    little behind gets each changed ticket once, in its latest state. When
+    it outgrows max_queued tickets or max_bytes, it is emptied and replaced
+    with a single resync event telling the client to reload its view; a
+    client that overflows again before taking that resync is disconnected.
+    """
+
+    def __init__(self, view: View, stats: bool = False,
+                 max_queued: int = REALTIME_MAX_QUEUED, max_bytes: int = REALTIME_MAX_BUFFER_BYTES):
+        self.view = view
+        self.stats = stats
+        self.max_queued = max_queued
+        self.max_bytes = max_bytes
+        self.closed = False
+        self._pending: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self._resyncing = False
+        self._ready = asyncio.Event()
+
+    def offer(self, key: str, data: str) -> None:
+        if self.closed:
+            return
+        replaced = self._pending.pop(key, None)
+        if replaced is not None:
+            self._bytes -= len(replaced)
+        self._pending[key] = data
+        self._bytes += len(data)
+        if len(self._pending) > self.max_queued or self._bytes > self.max_bytes:
+            self._pending.clear()
+            self._bytes = 0
+            if self._resyncing:
+                REALTIME_DROPPED.labels("disconnected").inc()
+                self.close()
+                return
+            REALTIME_DROPPED.labels("resync").inc()
+            self._resyncing = True
+            self._pending[RESYNC_KEY] = RESYNC
+            self._bytes = len(RESYNC)
+        self._ready.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+    async def get(self, timeout: float) -> Optional[str]:
+        """The next event, or None when there was none for timeout seconds"""
+        if not self._pending and not self.closed:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self.closed:
+            raise SlowConsumer()
+        key, data = self._pending.popitem(last=False)
+        self._bytes -= len(data)
+        if key == RESYNC_KEY:
+            self._resyncing = False
+        return data
+
+
+class SQLiteRelay:
+    """
+    Carries events between the worker processes on one host through a
+    SQLite file. Each worker appends the events it publishes and reads
+    those the other workers appended since its last read.
+    """
+
+    def __init__(self, path: str = REALTIME_BROKER_PATH, retention: float = REALTIME_RETENTION_SECONDS):
+        self.origin = uuid.uuid4().hex
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL,"
+            " created_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        (self._last,) = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()
+        self._pruned_at = 0.0
+
+    def _run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._lock:
+            return fn(self._conn)
+
+    def exchange(self, outgoing: List[str]) -> List[str]:
+        """Append outgoing and return what the other workers published since the last call"""
+        def run(conn: sqlite3.Connection) -> List[str]:
+            now = time.time()
+            if outgoing:
+                conn.execute("BEGIN")
+                try:
+                    conn.executemany("INSERT INTO events (origin, created_at, data) VALUES (?, ?, ?)",
+                                     [(self.origin, now, data) for data in outgoing])
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            if now - self._pruned_at > self.retention:
+                conn.execute("DELETE FROM events WHERE created_at < ?", (now - self.retention,))
+                self._pruned_at = now
+            rows = conn.execute("SELECT id, origin, data FROM events WHERE id > ? ORDER BY id",
+                                (self._last,)).fetchall()
+            if rows:
+                self._last = rows[-1][0]
+            return [data for _, origin, data in rows if origin != self.origin]
+        return self._run(run)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class RealtimeHub:
+    """
+    In-process pub/sub from ticket writes to connected clients.
+
+    Subscriptions are grouped by view, so an event is serialised once and
+    its filters are checked once per distinct view, not per connection. An
+    update reaches the views the ticket is in and the views it just left,
+    going by its previous state; when that is unknown, it also reaches
+    every view filtering on a field the update changed, and clients drop
+    tickets that no longer match. With a relay, events published here are
+    passed to the other workers and theirs are delivered here, which also
+    keeps this worker's dashboard counters current.
+
+    Subscribers that asked for stats get the dashboard summary after
+    changes, at most every stats_interval seconds, instead of polling it.
+    """
+
+    def __init__(self, relay: Optional[SQLiteRelay] = None, max_subscribers: int = REALTIME_MAX_SUBSCRIBERS,
+                 poll: float = REALTIME_POLL_SECONDS, stats_interval: float = REALTIME_STATS_INTERVAL_SECONDS):
+        self.relay = relay
+        self.max_subscribers = max_subscribers
+        self.poll = poll
+        self.stats_interval = stats_interval
+        self._views: Dict[FrozenSet[Tuple[str, FrozenSet[str]]], Tuple[View, Set[Subscription]]] = {}
+        self._count = 0
+        self._stats_dirty = True
+        self._outgoing: Deque[str] = deque(maxlen=10000)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def subscribers(self) -> int:
+        return self._count
+
+    def subscribe(self, view: View, stats: bool = False) -> Subscription:
+        if self._count >= self.max_subscribers:
+            raise TooManySubscribers()
+        subscription = Subscription(view, stats)
+        key = frozenset(view.items())
+        self._views.setdefault(key, (view, set()))[1].add(subscription)
+        self._count += 1
+        if stats:
+            self._stats_dirty = True
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        key = frozenset(subscription.view.items())
+        entry = self._views.get(key)
+        if entry is None or subscription not in entry[1]:
+            return
+        entry[1].discard(subscription)
+        if not entry[1]:
+            del self._views[key]
+        self._count -= 1
+
+    def publish(self, kind: str, ticket: dict, previous: Optional[dict] = None,
+                changed: Optional[List[str]] = None) -> None:
+        """
+        Announce a created, updated or deleted ticket. previous is the ticket
+        before an update, when known; changed names the fields an update set.
+        """
+        event = {
+            "type": kind,
+            "ticket": {field: ticket.get(field) for field in EVENT_FIELDS},
+            "previous": {field: previous.get(field) for field in FILTER_FIELDS} if previous else None,
+            "changed": sorted(changed) if changed else None,
+        }
+        data = json.dumps(event, default=str)
+        REALTIME_EVENTS.labels(kind).inc()
+        self._deliver(event, data)
+        if self.relay is not None:
+            self._outgoing.append(data)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def _deliver(self, event: dict, data: str) -> None:
+        ticket, previous = event["ticket"], event.get("previous")
+        changed = set(event.get("changed") or ())
+        key = str(ticket.get("id"))
+        for view, subscriptions in list(self._views.values()):
+            if not (_matches(view, ticket) or _matches(view, previous)
+                    or (previous is None and changed & view.keys())):
+                continue
+            for subscription in list(subscriptions):
+                subscription.offer(key, data)
+                if subscription.closed:
+                    self.unsubscribe(subscription)
+        self._stats_dirty = True
+
+    def _receive(self, data: str) -> None:
+        """Deliver an event published by another worker and apply it to the local counters"""
+        event = json.loads(data)
+        ticket, previous = event["ticket"], event.get("previous")
+        if event["type"] == CREATED:
+            ticket_stats.record_create(ticket)
+        elif event["type"] == DELETED:
+            ticket_stats.record_delete(ticket)
+        elif previous:
+            ticket_stats.record_update(previous, ticket)
+        elif event.get("changed") and set(event["changed"]) & {'status', 'priority'}:
+            ticket_stats.invalidate()
+        self._deliver(event, data)
+
+    async def start(self, db) -> None:
+        self._wakeup = asyncio.Event()
+        self._tasks.append(asyncio.create_task(self._push_stats(db)))
+        if self.relay is not None:
+            self._tasks.append(asyncio.create_task(self._relay()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        for _, subscriptions in list(self._views.values()):
+            for subscription in subscriptions:
+                subscription.close()
+        if self.relay is not None:
+            self.relay.close()
+
+    async def _relay(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            outgoing = list(self._outgoing)
+            self._outgoing.clear()
+            try:
+                incoming = await asyncio.to_thread(self.relay.exchange, outgoing)
+            except Exception as e:
+                logger.warning("realtime.relay_failed", extra={"error": str(e), "dropped": len(outgoing)})
+                continue
+            for data in incoming:
+                self._receive(data)
+
+    async def _push_stats(self, db) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            targets = [s for _, subscriptions in self._views.values() for s in subscriptions if s.stats]
+            if not self._stats_dirty or not targets:
+                continue
+            self._stats_dirty = False
+            try:
+                summary = await ticket_stats.summary(db)
+            except Exception as e:
+                logger.warning("realtime.stats_failed", extra={"error": str(e)})
+                continue
+            data = json.dumps({"type": "stats", "summary": summary})
+            for subscription in targets:
+                subscription.offer(STATS_KEY, data)
+                if subscription.closed:
+                    self.unsubscribe(subscription)
+
+
+async def _sse_events(request: Request, subscription: Subscription) -> AsyncIterator[str]:
+    try:
+        while True:
+            try:
+                data = await subscription.get(timeout=REALTIME_HEARTBEAT_SECONDS)
+            except SlowConsumer:
+                break
+            if data is None:
+                if await request.is_disconnected():
+                    break
+                # Comment line: keeps proxies from closing an idle stream
+                yield ": ping\n\n"
+                continue
+            yield f"data: {data}\n\n"
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def sse_feed(request: Request, view: View, stats: bool = False) -> StreamingResponse:
+    """Stream the view's events as Server-Sent Events; raises TooManySubscribers"""
+    subscription = hub.subscribe(view, stats)
+    return StreamingResponse(
+        _sse_events(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _discard_incoming(websocket: WebSocket, subscription: Subscription) -> None:
+    """Read (and ignore) client messages, so a disconnect ends the feed straight away"""
+    try:
+        while True:
+            await websocket.receive_text()
+    except (WebSocketDisconnect, RuntimeError):
+        subscription.close()
+
+
+async def _close(websocket: WebSocket) -> None:
+    try:
+        await websocket.close(code=TRY_AGAIN_LATER)
+    except RuntimeError:
+        pass
+
+
+async def websocket_feed(websocket: WebSocket, view: View, stats: bool = False) -> None:
+    """Send the view's events over a WebSocket until the client leaves or falls behind"""
+    try:
+        subscription = hub.subscribe(view, stats)
+    except TooManySubscribers:
+        await websocket.close(code=TRY_AGAIN_LATER)
+        return
+    await websocket.accept()
+    reader = asyncio.create_task(_discard_incoming(websocket, subscription))
+    try:
+        while True:
+            data = await subscription.get(timeout=REALTIME_HEARTBEAT_SECONDS)
+            await asyncio.wait_for(websocket.send_text(data or PING), timeout=REALTIME_SEND_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        # Its socket buffer is full: it stopped reading
+        REALTIME_DROPPED.labels("disconnected").inc()
+        await _close(websocket)
+    except SlowConsumer:
+        if not reader.done():
+            await _close(websocket)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        reader.cancel()
+        hub.unsubscribe(subscription)
+
+
+def build_hub() -> RealtimeHub:
+    """Hub configured by REALTIME_BROKER (memory or sqlite)"""
+    if REALTIME_BROKER == "sqlite":
+        return RealtimeHub(relay=SQLiteRelay())
+    return RealtimeHub()
+
+
+# Shared by the ticket router and startup
+hub = build_hub()
+
+
+@REGISTRY.collector
+async def _realtime_metrics() -> None:
+    REALTIME_SUBSCRIBERS.labels().set(hub.subscribers)
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Numbers reserved per database round-trip; unused ones are skipped on restart
+TICKET_NUMBER_BLOCK_SIZE = int(os.getenv("TICKET_NUMBER_BLOCK_SIZE", "100"))
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%y%m%d")
+
+def format_ticket_number(day: str, sequence: int) -> str:
+    # Four digits keeps the familiar TKT-YYMMDD-NNNN shape; busier days just grow wider
+    return f"TKT-{day}-{sequence:04d}"
+
+def fallback_ticket_number(day: Optional[str] = None) -> str:
+    """Unique number that needs no database, used when a block cannot be reserved"""
+    # Letters never appear in sequence numbers, so these cannot clash with them
+    return f"TKT-{day or _today()}-X{uuid.uuid4().hex[:12].upper()}"
+
+class TicketNumberAllocator:
+    """
+    Hands out TKT-YYMMDD-NNNN ticket numbers from a per-day sequence.
+
+    Each worker reserves a block of block_size numbers with one call to
+    db.reserve_ticket_numbers() and then allocates from it in memory, so
+    creating a ticket normally costs no extra round-trip and two workers can
+    never hand out the same number. Numbers restart at 1 each UTC day. Gaps
+    are expected: a restarted worker abandons the rest of its block.
+    """
+
+    def __init__(self, block_size: int = TICKET_NUMBER_BLOCK_SIZE):
+        self.block_size = block_size
+        self._day: Optional[str] = None
+        self._next = 0
+        self._end = 0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def allocate(self, db, count: int = 1) -> List[str]:
+        """Return count new ticket numbers"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        numbers: List[str] = []
+        async with self._lock:
+            while len(numbers) < count:
+                day = _today()
+                if day != self._day or self._next >= self._end:
+                    try:
+                        # Large bulk requests reserve what they need in one go
+                        size = max(self.block_size, count - len(numbers))
+                        start = await db.reserve_ticket_numbers(day, size)
+                    except Exception as e:
+                        logger.warning("Could not reserve ticket numbers, using fallback: %s", e)
+                        numbers.extend(fallback_ticket_number(day) for _ in range(count - len(numbers)))
+                        break
+                    self._day, self._next, self._end = day, start, start + size
+                take = min(count - len(numbers), self._end - self._next)
+                numbers.extend(format_ticket_number(day, n) for n in range(self._next, self._next + take))
+                self._next += take
+        return numbers
+
+    async def next(self, db) -> str:
+        return (await self.allocate(db, 1))[0]
+
+# Shared by the ticket router
+ticket_numbers = TicketNumberAllocator()
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Optional
+
+import httpx
+from jose import jwt, JWTError
+
+from cache import LRUCache, RedisBackend
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+# HS256 projects sign access tokens with this secret; others publish a JWKS
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+JWT_AUDIENCE = os.getenv("JWT_AUDIENCE", "authenticated")
+JWKS_TTL_SECONDS = float(os.getenv("JWKS_TTL_SECONDS", "600"))
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "120"))
+# Where logouts are recorded: "database" (default) or "redis" reach every worker,
+# "memory" only the worker that handled the logout
+TOKEN_REVOCATION_BACKEND = os.getenv("TOKEN_REVOCATION_BACKEND", "database")
+# Each worker re-checks a token against the shared store at most this often,
+# so a logout handled by another worker takes up to this long to apply
+TOKEN_REVOCATION_LAG_SECONDS = float(os.getenv("TOKEN_REVOCATION_LAG_SECONDS", "5"))
+
+class InvalidToken(Exception):
+    """Raised when an access token fails verification"""
+
+def _token_key(token: str) -> str:
+    # Never keep raw bearer tokens in memory longer than needed
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def _revocation_key(claims: dict, token_key: str) -> str:
+    # Revocations are recorded by the verified token id, or the token's hash without one
+    return f"jti:{claims['jti']}" if claims.get("jti") else token_key
+
+class TokenVerifier:
+    """
+    Verify Supabase access tokens in-process.
+
+    Signature, expiry and audience are checked locally against the JWT secret
+    or the project's cached JWKS, so an authenticated request costs no network
+    round-trip. Verified claims are cached until the token expires (capped by
+    ttl). Tokens revoked by logout are recorded in shared storage, the
+    database or Redis; each worker caches what it read there for
+    revocation_lag, so all workers reject a revoked token within that lag
+    until it would expire, without a lookup on every request. When neither a secret nor a JWKS is available, falls back to asking
+    Supabase, which is what every request used to do.
+    """
+
+    def __init__(self, secret: Optional[str] = SUPABASE_JWT_SECRET,
+                 jwks_url: Optional[str] = None, audience: str = JWT_AUDIENCE,
+                 ttl: float = TOKEN_CACHE_TTL_SECONDS,
+                 revocation_backend: str = TOKEN_REVOCATION_BACKEND,
+                 revocation_lag: float = TOKEN_REVOCATION_LAG_SECONDS):
+        self.secret = secret
+        self.jwks_url = jwks_url or (f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None)
+        self.audience = audience
+        self.ttl = ttl
+        self._claims = LRUCache(max_entries=TOKEN_CACHE_MAX_ENTRIES)
+        # True for revoked tokens, False for ones the shared store cleared recently
+        self._revoked = LRUCache(max_entries=TOKEN_CACHE_MAX_ENTRIES)
+        self.revocation_backend = revocation_backend
+        self.revocation_lag = revocation_lag
+        self._redis = RedisBackend(prefix="sahay:revoked:") if revocation_backend == "redis" else None
+        self._jwks: Optional[dict] = None
+        self._jwks_fetched_at = 0.0
+        self._jwks_lock: Optional[asyncio.Lock] = None
+
+    async def _get_jwks(self, refresh: bool = False) -> Optional[dict]:
+        stale = time.monotonic() - self._jwks_fetched_at > JWKS_TTL_SECONDS
+        if self._jwks is not None and not stale and not refresh:
+            return self._jwks
+        if self._jwks_lock is None:
+            self._jwks_lock = asyncio.Lock()
+        async with self._jwks_lock:
+            # Another request may have refreshed it while we waited
+            if self._jwks is not None and time.monotonic() - self._jwks_fetched_at < 1:
+                return self._jwks
+            try:
+                async with httpx.AsyncClient(timeout=5) as client:
+                    response = await client.get(self.jwks_url)
+                    response.raise_for_status()
+                    self._jwks = response.json()
+            except Exception as e:
+                logger.warning("Could not fetch JWKS from %s: %s", self.jwks_url, e)
+            # Also rate-limits refetching after a failure
+            self._jwks_fetched_at = time.monotonic()
+        return self._jwks
+
+    async def _signing_key(self, token: str):
+        if self.secret:
+            return self.secret, ["HS256"]
+        if not self.jwks_url:
+            return None, None
+        try:
+            header = jwt.get_unverified_header(token)
+        except JWTError as e:
+            raise InvalidToken(str(e))
+        if header.get("alg") == "HS256":
+            # Shared-secret token but no secret configured
+            return None, None
+        jwks = await self._get_jwks()
+        if not jwks or not jwks.get("keys"):
+            return None, None
+        keys = [k for k in jwks.get("keys", []) if k.get("kid") == header.get("kid")]
+        if not keys:
+            # Key rotation: refetch once before rejecting the token
+            jwks = await self._get_jwks(refresh=True)
+            keys = [k for k in (jwks or {}).get("keys", []) if k.get("kid") == header.get("kid")]
+        if not keys:
+            raise InvalidToken("Unknown signing key")
+        return keys[0], [keys[0].get("alg", header.get("alg"))]
+
+    async def verify(self, token: str, db) -> dict:
+        """Return the token's claims (sub, email, exp, ...) or raise InvalidToken"""
+        key = _token_key(token)
+        claims = self._claims.get(key)
+        CACHE_REQUESTS.labels("token", "miss" if claims is None else "hit").inc()
+        if claims is None:
+            claims = await self._decode(token, db)
+            expires_in = claims.get("exp", 0) - time.time()
+            if expires_in > 0:
+                self._claims.set(key, claims, ttl=min(self.ttl, expires_in))
+        if await self._is_revoked(_revocation_key(claims, key), db):
+            raise InvalidToken("Token has been revoked")
+        return claims
+
+    async def _decode(self, token: str, db) -> dict:
+        signing_key, algorithms = await self._signing_key(token)
+        if signing_key is None:
+            return await self._verify_remotely(token, db)
+        try:
+            return jwt.decode(token, signing_key, algorithms=algorithms, audience=self.audience)
+        except JWTError as e:
+            raise InvalidToken(str(e))
+
+    async def _verify_remotely(self, token: str, db) -> dict:
+        try:
+            user = await db.run(db.auth.get_user, token)
+        except Exception as e:
+            raise InvalidToken(str(e))
+        if not user or not user.user:
+            raise InvalidToken("Invalid authentication credentials")
+        return {"sub": user.user.id, "email": user.user.email, "exp": time.time() + self.ttl}
+
+    async def _is_revoked(self, key: str, db) -> bool:
+        if self._redis is None and self.revocation_backend != "database":
+            return bool(self._revoked.get(key))
+        revoked = self._revoked.get(key)
+        CACHE_REQUESTS.labels("revocation", "miss" if revoked is None else "hit").inc()
+        if revoked is None:
+            if self._redis is not None:
+                revoked = await self._redis.get(key) is not None
+            else:
+                revoked = await db.is_token_revoked(key)
+            self._revoked.set(key, revoked, ttl=self.revocation_lag)
+        return revoked
+
+    async def revoke(self, token: str, db) -> Optional[str]:
+        """
+        Reject token from now on in every worker, e.g. after logout; returns
+        its user id. Only a token that verifies is recorded, and only until
+        its own expiry, so forged tokens cannot fill the table or revoke
+        someone else's token id.
+        """
+        key = _token_key(token)
+        try:
+            claims = await self.verify(token, db)
+        except InvalidToken:
+            return None
+        self._claims.pop(key)
+        revocation_key = _revocation_key(claims, key)
+        exp = claims.get("exp", 0)
+        expires_in = exp - time.time()
+        if expires_in > 0:
+            self._revoked.set(revocation_key, True, ttl=expires_in)
+            if self._redis is not None:
+                await self._redis.set(revocation_key, "1", expires_in)
+            elif self.revocation_backend == "database":
+                await db.revoke_token(revocation_key, exp)
+        return claims.get("sub")
+
+class ProfileCache:
+    """TTL-bounded LRU cache of public.profiles rows keyed by user id"""
+
+    def __init__(self, max_entries: int = PROFILE_CACHE_MAX_ENTRIES,
+                 ttl: float = PROFILE_CACHE_TTL_SECONDS):
+        self._profiles = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    async def get(self, user_id: str, db) -> Optional[dict]:
+        # A missing profile is cached as {} so it is not re-queried each request
+        profile = self._profiles.get(user_id)
+        CACHE_REQUESTS.labels("profile", "miss" if profile is None else "hit").inc()
+        if profile is None:
+            profile = await db.get_profile(user_id) or {}
+            self._profiles.set(user_id, profile)
+        return profile or None
+
+    def invalidate(self, user_id: str) -> None:
+        self._profiles.pop(user_id)
+
+# Shared by the auth router
+token_verifier = TokenVerifier()
+profile_cache = ProfileCache()